@@ -39,7 +39,8 @@ class DamageEventAdmin(admin.ModelAdmin):
 
 
 class DamageScenarioAdmin(admin.ModelAdmin):
-    list_display = ['__unicode__', 'email', 'datetime_created']
+    list_display = [
+        '__unicode__', 'email', 'datetime_created', 'estimated_cost']
     inlines = [DamageEventInline]
     actions = ['process', 'send_received_email', 'send_finished_email', ]
 
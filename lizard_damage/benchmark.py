@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+
+"""Benchmark the damage pipeline using synthetic polders.
+
+A SyntheticPolder writes AHN and LGN tiles, waterlevel grids and road
+polygons for a square area of a given size to a temporary directory. The
+run() function points LIZARD_DAMAGE_DATA_ROOT at that directory,
+calculates a small risk scenario on it and returns the time spent in each
+stage of the pipeline as a dictionary that can be dumped as JSON, so that
+timings can be compared release-over-release.
+
+Stages that call each other are timed separately, so
+'DamageEvent.calculate' includes the time spent in
+'ResultCollector.finalize'."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import contextlib
+import datetime
+import logging
+import math
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from django.contrib.gis.geos import MultiPolygon
+from django.contrib.gis.geos import Polygon
+from django.core.files import File
+from django.test.utils import override_settings
+from osgeo import gdal
+import mock
+import numpy as np
+
+from lizard_damage import models
+from lizard_damage import raster
+from lizard_damage import results
+from lizard_damage import risk
+from lizard_damage import tools
+from lizard_damage_calculation import calculation
+
+logger = logging.getLogger(__name__)
+
+# Area of the synthetic polder in km2, by name of the scale
+SCALES = collections.OrderedDict((
+    ('1', 1),
+    ('10', 10),
+    ('100', 100),
+))
+
+# Repetition times of the events in the benchmark scenario; a risk map
+# needs more than one of them.
+REPETITION_TIMES = (10, 100, 1000)
+
+NODATA_HEIGHT = -9999
+NODATA_LANDUSE = 255
+NODATA_WATERLEVEL = -9999
+
+AHN_CELLSIZE = 0.5
+LANDUSE_BLOCKSIZE = 50  # Landuse is constant within blocks of 25 x 25 m
+WATERLEVEL_CELLSIZE = 5
+
+ROAD_SPACING = 500  # Every 500 m there is a road...
+ROAD_WIDTH = 10  # ...that is 10 m wide.
+ROAD_GRIDCODES = sorted(models.Roads.ROAD_GRIDCODE.values())
+
+
+class Timings(object):
+    """Keep track of the total time spent in named stages."""
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+
+    def add(self, stage, seconds):
+        total, calls = self.stages.get(stage, (0, 0))
+        self.stages[stage] = (total + seconds, calls + 1)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+    def wrap(self, stage, function):
+        """Return a version of function that records its time under
+        stage."""
+        def wrapper(*args, **kwargs):
+            with self.measure(stage):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def as_dict(self):
+        return collections.OrderedDict(
+            (stage, {'seconds': total, 'calls': calls})
+            for stage, (total, calls) in self.stages.items())
+
+
+class SyntheticRoad(object):
+    """Quacks like a Roads instance, as far as the calculation is
+    concerned."""
+    def __init__(self, pk, gridcode, the_geom):
+        self.pk = self.gid = pk
+        self.gridcode = gridcode
+        self.the_geom = the_geom
+
+
+class SyntheticPolder(object):
+    """A square polder of a given area, with its lower left corner at
+    origin. Heights form a gentle bowl with some waves in it, so that
+    raising the waterlevel floods a growing part of the polder."""
+
+    def __init__(self, directory, area_km2, landuse_codes,
+                 ahn_version=models.DamageScenario.AHN2,
+                 origin=(120000, 480000), seed=0):
+        self.directory = directory
+        self.area_km2 = area_km2
+        self.landuse_codes = np.array(sorted(landuse_codes), dtype=np.uint8)
+        self.ahn_version = ahn_version
+        self.seed = seed
+
+        self.side = int(math.sqrt(area_km2) * 1000)
+        self.extent = (
+            origin[0], origin[1],
+            origin[0] + self.side, origin[1] + self.side)
+
+        self.roads = []
+        self.leaves = []
+
+    def waterlevel_path(self, repetition_time):
+        return os.path.join(
+            self.directory, 'waterlevels',
+            'waterlevel_T{}.tif'.format(repetition_time))
+
+    def tile_path(self, datadir, ahn_name):
+        return os.path.join(
+            self.directory, datadir, ahn_name[1:4], ahn_name + '.tif')
+
+    def create(self):
+        """Write all data of the polder to the directory."""
+        for index, repetition_time in enumerate(REPETITION_TIMES):
+            self.create_waterlevel(
+                self.waterlevel_path(repetition_time), offset=0.25 * index)
+
+        # Let the calculation tell us which leaves we need
+        dataset = gdal.Open(
+            self.waterlevel_path(REPETITION_TIMES[0]).encode('utf8'))
+        self.leaves = calculation._get_ahn_leaves(dataset, logger)
+        dataset = None
+
+        for ahn_name, extent in self.leaves:
+            self.create_tile(ahn_name, extent)
+
+        self.create_roads()
+
+    def create_waterlevel(self, path, offset):
+        """A sloping waterlevel covering the whole polder."""
+        size = self.side // WATERLEVEL_CELLSIZE
+        x = np.arange(size, dtype=np.float32) * WATERLEVEL_CELLSIZE
+        level = np.tile(-1.0 + offset + x / self.side, (size, 1))
+
+        write_geotiff(
+            path, level.astype(np.float32), NODATA_WATERLEVEL,
+            (self.extent[0], self.extent[3]), WATERLEVEL_CELLSIZE,
+            gdal.GDT_Float32)
+
+    def create_tile(self, ahn_name, extent):
+        minx, miny, maxx, maxy = extent
+        width = int(round((maxx - minx) / AHN_CELLSIZE))
+        height = int(round((maxy - miny) / AHN_CELLSIZE))
+
+        # Cell centers in RD
+        x = minx + (np.arange(width) + 0.5) * AHN_CELLSIZE
+        y = maxy - (np.arange(height) + 0.5) * AHN_CELLSIZE
+        xx, yy = np.meshgrid(x, y)
+
+        # Heights: a bowl around the center of the polder, with waves
+        cx = (self.extent[0] + self.extent[2]) / 2
+        cy = (self.extent[1] + self.extent[3]) / 2
+        radius = np.hypot(xx - cx, yy - cy) / self.side
+        heights = (
+            -1.5 + 2 * radius +
+            0.3 * np.sin(xx / 300) * np.cos(yy / 400)).astype(np.float32)
+
+        write_geotiff(
+            self.tile_path('data_ahn' + self.ahn_version, ahn_name),
+            heights, NODATA_HEIGHT, (minx, maxy), AHN_CELLSIZE,
+            gdal.GDT_Float32)
+
+        # Landuse: random codes in blocks, with roads burnt in
+        random = np.random.RandomState(
+            self.seed + int(minx) * 7 + int(miny) * 13)
+        blocks = random.choice(self.landuse_codes, size=(
+            int(math.ceil(height / LANDUSE_BLOCKSIZE)),
+            int(math.ceil(width / LANDUSE_BLOCKSIZE))))
+        landuse = np.kron(
+            blocks, np.ones((LANDUSE_BLOCKSIZE, LANDUSE_BLOCKSIZE),
+                            dtype=np.uint8))[:height, :width]
+
+        road_rows = np.less(
+            (y - self.extent[1]) % ROAD_SPACING, ROAD_WIDTH)
+        road_numbers = ((y - self.extent[1]) // ROAD_SPACING).astype(int)
+        for row in np.flatnonzero(road_rows):
+            landuse[row] = ROAD_GRIDCODES[
+                road_numbers[row] % len(ROAD_GRIDCODES)]
+
+        write_geotiff(
+            self.tile_path('data_lgn', ahn_name),
+            landuse.astype(np.uint8), NODATA_LANDUSE, (minx, maxy),
+            AHN_CELLSIZE, gdal.GDT_Byte)
+
+    def create_roads(self):
+        """One road polygon per road strip and leaf column, so that
+        roads have realistic lengths of about a kilometer."""
+        columns = sorted(set(extent[0] for ahn_name, extent in self.leaves))
+        column_width = (
+            columns[1] - columns[0] if len(columns) > 1 else self.side)
+
+        pk = 0
+        for number, y in enumerate(range(
+                self.extent[1], self.extent[3], ROAD_SPACING)):
+            gridcode = ROAD_GRIDCODES[number % len(ROAD_GRIDCODES)]
+            for x in columns:
+                pk += 1
+                polygon = Polygon((
+                    (x, y), (x + column_width, y),
+                    (x + column_width, y + ROAD_WIDTH), (x, y + ROAD_WIDTH),
+                    (x, y)), srid=28992)
+                self.roads.append(SyntheticRoad(
+                    pk, gridcode, MultiPolygon(polygon, srid=28992)))
+
+    def get_roads_by_geo(self, gridcode, geo, shape):
+        """Replacement for Roads.get_by_geo, so that the benchmark
+        doesn't need the raster database."""
+        polygon = raster.get_polygon_from_geo_and_shape(geo, shape)
+        return [road for road in self.roads
+                if road.gridcode == gridcode and
+                road.the_geom.intersects(polygon)]
+
+    @property
+    def pixels(self):
+        """Number of AHN pixels in all leaves."""
+        return sum(
+            int(round((maxx - minx) / AHN_CELLSIZE)) *
+            int(round((maxy - miny) / AHN_CELLSIZE))
+            for ahn_name, (minx, miny, maxx, maxy) in self.leaves)
+
+
+def write_geotiff(path, array, nodatavalue, origin, cellsize, datatype):
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    dataset = gdal.GetDriverByName(b'GTiff').Create(
+        path.encode('utf8'), array.shape[1], array.shape[0], 1, datatype,
+        [b'TILED=YES', b'COMPRESS=DEFLATE'])
+    dataset.SetProjection(raster.PROJECTION_RD)
+    dataset.SetGeoTransform(
+        (origin[0], cellsize, 0, origin[1], 0, -cellsize))
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(nodatavalue)
+    band.WriteArray(array)
+    dataset = None  # Closes the file
+
+
+def run(scale, ahn_version=models.DamageScenario.AHN2, seed=0,
+        keep_data=False):
+    """Benchmark one scale (a key of SCALES). Creates a scenario with an
+    event per repetition time, calculates it, and creates a risk map and
+    a benefit map from the results. Everything is removed afterwards.
+
+    Returns a dictionary that can be dumped as JSON."""
+    timings = Timings()
+    directory = tempfile.mkdtemp(prefix='damage_benchmark_')
+
+    scenario = models.DamageScenario.objects.create(
+        name='benchmark {} km2'.format(scale),
+        email='benchmark@example.com',
+        scenario_type=4,
+        calc_type=models.DamageScenario.CALC_TYPE_AVG,
+        ahn_version=ahn_version)
+    benefit_scenario = None
+
+    try:
+        dt_path, damage_table = scenario.read_damage_table()
+        polder = SyntheticPolder(
+            directory, SCALES[scale], damage_table.data.keys(),
+            ahn_version=ahn_version, seed=seed)
+        with timings.measure('create synthetic data'):
+            polder.create()
+
+        for repetition_time in REPETITION_TIMES:
+            models.DamageEvent.setup(
+                scenario, floodtime_hours=24, repairtime_roads_days=1,
+                repairtime_buildings_days=5, floodmonth=9,
+                repetition_time=repetition_time,
+                waterlevels=[dict(
+                    waterlevel=polder.waterlevel_path(repetition_time),
+                    index=1)])
+
+        finalize = timings.wrap(
+            'ResultCollector.finalize', results.ResultCollector.finalize)
+        with override_settings(LIZARD_DAMAGE_DATA_ROOT=directory), \
+                mock.patch.object(
+                    models.Roads, 'get_by_geo', polder.get_roads_by_geo), \
+                mock.patch.object(
+                    results.ResultCollector, 'finalize', finalize):
+            for event in scenario.damageevent_set.all():
+                with timings.measure('DamageEvent.calculate'):
+                    event.calculate(logger)
+
+            with timings.measure('risk.create_risk_map'):
+                risk.create_risk_map(damage_scenario=scenario, logger=logger)
+
+            # Compare the risk map to itself, we are only interested in
+            # the time it takes.
+            riskresult = scenario.riskresult_set.get()
+            benefit_scenario = models.BenefitScenario(
+                name='benchmark {} km2'.format(scale),
+                email='benchmark@example.com')
+            for field in (benefit_scenario.zip_risk_a,
+                          benefit_scenario.zip_risk_b):
+                with open(riskresult.zip_risk.path, 'rb') as zip_risk:
+                    field.save(
+                        os.path.basename(riskresult.zip_risk.name),
+                        File(zip_risk), save=False)
+            benefit_scenario.save()
+
+            with timings.measure('risk.create_benefit_map'):
+                risk.create_benefit_map(
+                    benefit_scenario=benefit_scenario, logger=logger)
+
+        return collections.OrderedDict((
+            ('version', tools.version()),
+            ('datetime', datetime.datetime.now().isoformat()),
+            ('python', platform.python_version()),
+            ('gdal', gdal.__version__),
+            ('scale_km2', SCALES[scale]),
+            ('ahn_version', ahn_version),
+            ('seed', seed),
+            ('events', len(REPETITION_TIMES)),
+            ('leaves', len(polder.leaves)),
+            ('pixels', polder.pixels),
+            ('timings', timings.as_dict()),
+        ))
+    finally:
+        for riskresult in scenario.riskresult_set.all():
+            riskresult.zip_risk.delete()
+        scenario.delete()
+        if benefit_scenario is not None:
+            for field in (benefit_scenario.zip_risk_a,
+                          benefit_scenario.zip_risk_b,
+                          benefit_scenario.zip_result):
+                if field:
+                    field.delete(save=False)
+            benefit_scenario.delete()
+        if keep_data:
+            logger.info("Synthetic data kept in {}".format(directory))
+        else:
+            shutil.rmtree(directory)
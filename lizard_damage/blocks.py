@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+"""Reading and writing rasters window by window.
+
+Uploaded rasters can be far larger than what fits in a web worker, so
+code that has to look at all of one should go through these helpers
+instead of calling ReadAsArray() on the whole band. Windows are strips
+of whole native GDAL blocks, so that every block is read exactly once.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import math
+
+from osgeo import gdal
+
+# Maximum number of cells in a window, unless a single strip of blocks
+# is larger than that
+WINDOW_SIZE = 2 ** 22
+
+
+def windows(band, window_size=WINDOW_SIZE):
+    """Yield (xoff, yoff, xsize, ysize) of strips of whole blocks of
+    band, of at most about window_size cells each."""
+    block_height = band.GetBlockSize()[1]
+    rows = max(
+        window_size // band.XSize // block_height * block_height,
+        block_height)
+    for yoff in range(0, band.YSize, rows):
+        yield 0, yoff, band.XSize, min(rows, band.YSize - yoff)
+
+
+def read_windows(band, window_size=WINDOW_SIZE):
+    """Yield (xoff, yoff, array) for each window of band."""
+    for xoff, yoff, xsize, ysize in windows(band, window_size):
+        yield xoff, yoff, band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+
+def empty_like(dataset, datatype=None, nodatavalue=None):
+    """Return a single band MEM dataset with the same size, projection
+    and geotransform as dataset, but without copying its data. If
+    nodatavalue is given, it is set and the band is filled with it."""
+    if datatype is None:
+        datatype = dataset.GetRasterBand(1).DataType
+    result = gdal.GetDriverByName(b'MEM').Create(
+        b'', dataset.RasterXSize, dataset.RasterYSize, 1, datatype)
+    result.SetProjection(dataset.GetProjection())
+    result.SetGeoTransform(dataset.GetGeoTransform())
+    if nodatavalue is not None:
+        band = result.GetRasterBand(1)
+        band.SetNoDataValue(nodatavalue)
+        band.Fill(nodatavalue)
+    return result
+
+
+def window(dataset, bbox):
+    """Return (xoff, yoff, xsize, ysize) of the part of the dataset
+    inside bbox (minx, miny, maxx, maxy), or None if they don't
+    overlap."""
+    x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+    minx, miny, maxx, maxy = bbox
+
+    col0 = max(int(math.floor((minx - x0) / dx)), 0)
+    col1 = min(int(math.ceil((maxx - x0) / dx)), dataset.RasterXSize)
+    row0 = max(int(math.floor((maxy - y0) / dy)), 0)
+    row1 = min(int(math.ceil((miny - y0) / dy)), dataset.RasterYSize)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    return col0, row0, col1 - col0, row1 - row0
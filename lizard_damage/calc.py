@@ -12,20 +12,11 @@ import numpy as np
 import logging
 import os
 import tempfile
-import traceback
 
-from matplotlib import colors
 from PIL import Image
-import json
-import subprocess
-
-from django.core.files import File
-from django.template.defaultfilters import slugify
 
+from lizard_damage import colormaps
 from lizard_damage import raster
-from lizard_damage.models import DamageEventResult
-from lizard_damage.models import RD
-from lizard_damage.models import extent_from_geotiff
 
 logger = logging.getLogger(__name__)
 
@@ -35,87 +26,6 @@ def convert_tif_to_png(filename_tif, filename_png):
     im.save(filename_png, 'PNG')
 
 
-def process_result(
-        logger, damage_event, damage_event_index, result, scenario_name):
-    errors = 0
-    # result[0] is the result zip file name in temp dir.
-    with open(result[0], 'rb') as doc_file:
-        try:
-            if damage_event.result:
-                logger.warning('Deleting existing results...')
-                damage_event.result.delete()  # Delete old results
-            logger.info('Saving results...')
-            damage_event.result.save(
-                '%s%i.zip' % (
-                    slugify(scenario_name),
-                    damage_event_index + 1),
-                File(doc_file), save=True)
-            damage_event.save()
-        except:
-            logger.error('Exception saving zipfile. Too big?')
-            for exception_line in traceback.format_exc().split('\n'):
-                logger.error(exception_line)
-            errors = 1
-        os.remove(result[0])  # remove temp file, whether it was saved
-                              # or not
-
-        # result[2] is the table in a data structure
-        damage_event.table = json.dumps(result[2])
-
-        # Store references to GeoImage objects
-        damage_event.set_slugs(
-            landuse_slugs=','.join(result[3]),
-            height_slugs=','.join(result[4]),
-            depth_slugs=','.join(result[5]))
-
-        damage_event.save()
-
-        # result[1] is a list of png files to be uploaded to the django db.
-        if damage_event.damageeventresult_set.count() >= 0:
-            logger.warning("Removing old images...")
-            for damage_event_result in (
-                    damage_event.damageeventresult_set.all()):
-                damage_event_result.image.delete()
-                damage_event_result.delete()
-        for img in result[1]:
-            # convert filename_png to geotiff,
-            #import pdb; pdb.set_trace()
-
-            logger.info('Warping png to tif... %s' % img['filename_png'])
-            command = (
-                'gdalwarp %s %s -t_srs "+proj=latlong '
-                '+datum=WGS83" -s_srs "%s"' % (
-                    img['filename_png'], img['filename_tif'], RD.strip()))
-            logger.info(command)
-            # Warp png file, output is tif.
-            subprocess.call([
-                'gdalwarp', img['filename_png'], img['filename_tif'],
-                '-t_srs', "+proj=latlong +datum=WGS84",
-                '-s_srs', RD.strip()])
-
-            img['extent'] = extent_from_geotiff(img['filename_tif'])
-            # Convert it back to png
-            convert_tif_to_png(img['filename_tif'], img['filename_png'])
-
-            damage_event_result = DamageEventResult(
-                damage_event=damage_event,
-                west=img['extent'][0],
-                south=img['extent'][1],
-                east=img['extent'][2],
-                north=img['extent'][3])
-            logger.info('Uploading %s...' % img['filename_png'])
-            with open(img['filename_png'], 'rb') as img_file:
-                damage_event_result.image.save(
-                    img['dstname'] % damage_event.slug,
-                    File(img_file), save=True)
-            damage_event_result.save()
-            os.remove(img['filename_png'])
-            os.remove(img['filename_pgw'])
-            os.remove(img['filename_tif'])
-        logger.info('Result has %d images' % len(result[1]))
-    return errors
-
-
 def mkstemp_and_close():
     """
     Make a tempfile and close it. It can be reopened later on.
@@ -216,9 +126,14 @@ def landuse_legend():
     return result
 
 
-def slug_for_landuse(ahn_name):
-    """Name as slug in GeoImage"""
-    return 'landuse_%s' % ahn_name
+def slug_for_landuse(ahn_name, overview_level=0):
+    """Name as slug in GeoImage
+
+    Overview level n is the image at 1 / 2 ** n of the full resolution.
+    """
+    if overview_level == 0:
+        return 'landuse_%s' % ahn_name
+    return 'landuse_%s_o%d' % (ahn_name, overview_level)
 
 
 def slug_for_height(ahn_name, min_value, max_value):
@@ -237,7 +152,7 @@ def slug_for_depth(ahn_name, min_value, max_value):
 
 
 def get_colorizer(max_damage):
-    """ Return colormap and normalizer. """
+    """Return a function that turns damage data into an RGBA array."""
     # Note the hardcoded area_per_pixel
     area_per_pixel = 0.25
     f = 1 / max_damage * area_per_pixel
@@ -261,12 +176,10 @@ def get_colorizer(max_damage):
         ),
     }
 
-    # Beware of the amount of quantization levels, it DOES matter
-    colormap = colors.LinearSegmentedColormap('damage', cdict, N=1024)
-    normalize = colors.Normalize(vmin=0, vmax=max_damage)
+    lut = colormaps.segmented_lut(cdict)
 
     def colorize(data):
-        return colormap(normalize(data), bytes=True)
+        return colormaps.apply_lut(lut, data, vmin=0, vmax=max_damage)
 
     return colorize
 
@@ -280,6 +193,59 @@ def write_result(name, ma_result, ds_template):
     )
 
 
+def _wet_cells(landuse_ma, depth_ma):
+    """Return landuse and depth data, and where there is water on
+    known landuse."""
+    landuse = np.ma.getdata(landuse_ma)
+    depth = np.ma.getdata(depth_ma)
+    wet = ~(np.ma.getmaskarray(landuse_ma) | np.ma.getmaskarray(depth_ma))
+    wet &= depth > 0
+    return landuse, depth, wet
+
+
+def damage_for_calc_type(
+        landuse_ma, depth_ma, area_per_pixel, compiled_table, calc_type,
+        month, floodtime, repairtime_buildings, road_grid_codes):
+    """Return (damage per landuse code, damage grid) of one tile, for
+    another calc_type than the calculator's, from the landuse and depth
+    it already prepared. compiled_table is a
+    damagetables.CompiledDamageTable, calc_type one of the values of
+    calculation.CALC_TYPES.
+
+    Like the calculator, only wet cells have damage and the indirect
+    damage of roads is left out; it counts once per flooded road, over
+    all tiles."""
+    landuse, depth, wet = _wet_cells(landuse_ma, depth_ma)
+    landuse, depth = landuse[wet], depth[wet]
+
+    cells = compiled_table.cell_damage(
+        landuse, depth, area_per_pixel, calc_type, month, floodtime,
+        repairtime_buildings, road_grid_codes)
+    result = np.ma.masked_array(
+        np.zeros(wet.shape, dtype=np.float64), mask=~wet)
+    result[wet] = cells
+    return compiled_table.per_code(landuse, cells), result
+
+
+def damage_per_month(
+        landuse_ma, depth_ma, area_per_pixel, compiled_table, calc_type,
+        months, floodtime, repairtime_buildings, road_grid_codes):
+    """Return {month: damage per landuse code} of one tile for each of
+    months, from the landuse and depth the calculator prepared. Only the
+    month factor differs between months, so the depth factors are
+    computed once. Indirect road damage is left out, like in
+    damage_for_calc_type."""
+    landuse, depth, wet = _wet_cells(landuse_ma, depth_ma)
+    landuse, depth = landuse[wet], depth[wet]
+    gamma_depth = compiled_table.gamma_depth(landuse, depth)
+
+    return {
+        month: compiled_table.per_code(landuse, compiled_table.cell_damage(
+            landuse, depth, area_per_pixel, calc_type, month, floodtime,
+            repairtime_buildings, road_grid_codes, gamma_depth=gamma_depth))
+        for month in months}
+
+
 def write_table(
         name, damage, area, damage_table, meta=[], include_total=False):
     """
@@ -328,16 +294,24 @@ def write_table(
             )
 
 
-def result_as_dict(damage, area, damage_table):
+def result_as_dict(damage, area, damage_table, extra_damage=None):
     """
     return data structure of result which can be stored and looped
+
+    extra_damage is an optional dict of name -> damage per code, for
+    instance {'min': ..., 'max': ...}, that become extra columns
+    'damage_<name>'.
     """
+    extra_damage = extra_damage or {}
 
     head = [{'display': 'bron', 'key': 'source'},
             {'display': 'code', 'key': 'code'},
             {'display': 'omschrijving', 'key': 'description'},
             {'display': 'oppervlakte met schade [ha]', 'key': 'area_ha'},
             {'display': 'schade', 'key': 'damage'}]
+    head += [{'display': 'schade ({})'.format(name),
+              'key': 'damage_{}'.format(name)}
+             for name in sorted(extra_damage)]
 
     data = [{
         'source': None,
@@ -353,6 +327,12 @@ def result_as_dict(damage, area, damage_table):
         'damage': damage[dr.code],
     } for code, dr in damage_table.data.items()]
 
+    for name, other_damage in extra_damage.items():
+        key = 'damage_{}'.format(name)
+        data[0][key] = sum(other_damage.values())
+        for row in data[1:]:
+            row[key] = other_damage[row['code']]
+
     return (head, data)
 
 
@@ -362,10 +342,16 @@ def write_image(name, values):
 
     Values is a 2d np array
     """
+    Image.fromarray(colorize_damage(values)).save(name, 'PNG')
+
+
+def colorize_damage(values):
+    """Return RGBA array of damage values, semi-transparent where
+    there is damage and fully transparent elsewhere."""
     colorize = get_colorizer(max_damage=11)
     rgba = colorize(values)
     rgba[:, :, 3] = np.where(rgba[:, :, 0], 153, 0)
-    Image.fromarray(rgba).save(name, 'PNG')
+    return rgba
 
 
 def add_roads_to_image(roads, image_path, extent):
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+"""Calculating large damage events chunk by chunk.
+
+The calculator is given the waterlevels of the whole event, and how
+much of them it keeps around while it goes through the leaves is not up
+to us. For waterlevels of more than LIZARD_DAMAGE_OUT_OF_CORE_AREA, the
+leaves are therefore grouped into square chunks, and a new calculator
+is made for each chunk that only gets the part of the waterlevels
+around its leaves. Those parts are copied window by window (see
+blocks.py) to temporary GeoTIFFs, that are removed as soon as the chunk
+is done. Leaves are still calculated one at a time and their results
+are written to disk right away, so memory use depends on the chunk size
+instead of on the size of the waterlevels.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import math
+import os
+import shutil
+import tempfile
+
+from osgeo import gdal
+
+from lizard_damage import blocks
+
+
+def chunk_leaves(leaves, chunk_size):
+    """Group leaves, an iterable of (ahn_name, extent), by the square of
+    chunk_size m that the centre of their extent is in. Returns a list
+    of (extent, names) of the chunks, where extent is the extent of all
+    their leaves together."""
+    chunks = collections.defaultdict(list)
+    for ahn_name, extent in leaves:
+        minx, miny, maxx, maxy = extent
+        key = (int(math.floor((minx + maxx) / 2 / chunk_size)),
+               int(math.floor((miny + maxy) / 2 / chunk_size)))
+        chunks[key].append((ahn_name, extent))
+
+    result = []
+    for key in sorted(chunks):
+        extents = [extent for _, extent in chunks[key]]
+        result.append((
+            (min(extent[0] for extent in extents),
+             min(extent[1] for extent in extents),
+             max(extent[2] for extent in extents),
+             max(extent[3] for extent in extents)),
+            sorted(ahn_name for ahn_name, _ in chunks[key])))
+    return result
+
+
+def clip(path, extent, target_path, window_size=blocks.WINDOW_SIZE):
+    """Copy the part of the raster at path inside extent, plus a cell
+    on each side for resampling, to a GeoTIFF at target_path. Returns
+    target_path, or None if the raster doesn't overlap extent."""
+    dataset = gdal.Open(path.encode('utf8'))
+    x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+    minx, miny, maxx, maxy = extent
+    margin = max(abs(dx), abs(dy))
+    window = blocks.window(dataset, (
+        minx - margin, miny - margin, maxx + margin, maxy + margin))
+    if window is None:
+        return None
+    xoff, yoff, xsize, ysize = window
+
+    band = dataset.GetRasterBand(1)
+    target = gdal.GetDriverByName(b'GTiff').Create(
+        target_path.encode('utf8'), xsize, ysize, 1, band.DataType)
+    target.SetProjection(dataset.GetProjection())
+    target.SetGeoTransform(
+        (x0 + xoff * dx, dx, 0, y0 + yoff * dy, 0, dy))
+    target_band = target.GetRasterBand(1)
+    nodatavalue = band.GetNoDataValue()
+    if nodatavalue is not None:
+        target_band.SetNoDataValue(nodatavalue)
+
+    rows = max(window_size // xsize, 1)
+    for row in range(0, ysize, rows):
+        data = band.ReadAsArray(
+            xoff, yoff + row, xsize, min(rows, ysize - row))
+        target_band.WriteArray(data, 0, row)
+
+    # Closing the dataset flushes it
+    target = None
+    return target_path
+
+
+def calculate_chunk(
+        make_calculator, waterlevel_paths, extent, names, tempdir, logger,
+        **kwargs):
+    """Yield the results of calculator.calculate_for_all_leaves(**kwargs)
+    for the leaves named in names, whose extent together is extent.
+    make_calculator(waterlevel_paths) must return a new
+    LeafSkippingDamageCalculator for those waterlevels."""
+    chunkdir = tempfile.mkdtemp(dir=tempdir)
+    try:
+        paths = [
+            clip(path, extent, os.path.join(
+                chunkdir, 'waterlevel_{}.tif'.format(index)))
+            for index, path in enumerate(waterlevel_paths)]
+        paths = [path for path in paths if path is not None]
+        if not paths:
+            logger.warning("No waterlevel for leaves {}".format(names))
+            return
+
+        calculator = make_calculator(paths)
+        calculator.only_leaves = frozenset(names)
+        for tile in calculator.calculate_for_all_leaves(**kwargs):
+            yield tile
+    finally:
+        shutil.rmtree(chunkdir)
+
+
+def calculate_for_all_leaves(
+        make_calculator, waterlevel_paths, leaves, chunk_size, tempdir,
+        logger, **kwargs):
+    """Yield the results of calculate_chunk() for leaves, chunk by
+    chunk."""
+    chunks = chunk_leaves(leaves, chunk_size)
+    for number, (extent, names) in enumerate(chunks, 1):
+        logger.info("Chunk {} of {}: {} leaves".format(
+            number, len(chunks), len(names)))
+        for tile in calculate_chunk(
+                make_calculator, waterlevel_paths, extent, names, tempdir,
+                logger, **kwargs):
+            yield tile
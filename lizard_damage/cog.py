@@ -0,0 +1,111 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Writing Cloud Optimized GeoTIFFs (COGs) of result rasters.
+
+A COG is an internally tiled GeoTIFF with its overviews stored before
+the image data, so that a client can read any area at any resolution
+with a few HTTP range requests. If GDAL has the COG driver (GDAL >= 3.1)
+that is used; otherwise the same layout is made with the GTiff driver
+by building overviews on a temporary copy first and then copying that
+with COPY_SRC_OVERVIEWS=YES. Everything happens in-process."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import os
+import shutil
+import tempfile
+
+from osgeo import gdal
+
+from lizard_damage.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BLOCKSIZE = 512
+
+# Overviews are added until the smallest one fits in a single block
+MIN_OVERVIEW_SIZE = BLOCKSIZE
+
+
+def enabled():
+    return settings.LIZARD_DAMAGE_WRITE_COG
+
+
+def compression():
+    """Return the configured compression, falling back to DEFLATE if
+    this GDAL wasn't built with it."""
+    wanted = settings.LIZARD_DAMAGE_COG_COMPRESSION.upper()
+    options = gdal.GetDriverByName(b'GTiff').GetMetadataItem(
+        b'DMD_CREATIONOPTIONLIST') or ''
+    if wanted not in options:
+        logger.warning(
+            "GDAL has no {} compression, using DEFLATE.".format(wanted))
+        return 'DEFLATE'
+    return wanted
+
+
+def overview_factors(dataset):
+    factors = []
+    factor = 2
+    while max(dataset.RasterXSize, dataset.RasterYSize) // factor >= (
+            MIN_OVERVIEW_SIZE):
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def _creation_options(dataset, compress):
+    options = ['COMPRESS={}'.format(compress)]
+    data_type = dataset.GetRasterBand(1).DataType
+    if data_type in (gdal.GDT_Float32, gdal.GDT_Float64):
+        # Floating point predictor, much better compression of damage
+        options.append('PREDICTOR=3')
+    return options
+
+
+def write_cog(dataset, path, resampling='AVERAGE'):
+    """Write dataset as a COG at path."""
+    path = str(path)
+    compress = compression()
+    options = _creation_options(dataset, compress)
+
+    cog_driver = gdal.GetDriverByName(b'COG')
+    if cog_driver is not None:
+        cog_driver.CreateCopy(path, dataset, options=[str(option) for option in (
+            options + ['BLOCKSIZE={}'.format(BLOCKSIZE),
+                       'RESAMPLING={}'.format(resampling),
+                       'OVERVIEWS=IGNORE_EXISTING'])])
+        return
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        # Overviews can't be added to the final file without breaking
+        # the layout, so they go into a temporary copy first
+        tmp_path = os.path.join(tempdir, b'cog.tif')
+        tmp = gdal.GetDriverByName(b'GTiff').CreateCopy(
+            tmp_path, dataset, options=[b'TILED=YES', b'COMPRESS=LZW'])
+        tmp.BuildOverviews(str(resampling), overview_factors(tmp))
+
+        gdal.GetDriverByName(b'GTiff').CreateCopy(
+            path, tmp, options=[str(option) for option in (options + [
+                'TILED=YES',
+                'BLOCKXSIZE={}'.format(BLOCKSIZE),
+                'BLOCKYSIZE={}'.format(BLOCKSIZE),
+                'COPY_SRC_OVERVIEWS=YES',
+                'BIGTIFF=IF_SAFER'])])
+        tmp = None
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def write_cog_from_files(paths, path, resampling='AVERAGE'):
+    """Mosaic the raster files at paths (all with the same projection
+    and data type) into a single COG at path."""
+    vrt = gdal.BuildVRT(b'', [str(p) for p in paths])
+    write_cog(vrt, path, resampling=resampling)
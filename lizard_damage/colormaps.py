@@ -0,0 +1,137 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Colorizing arrays with precomputed lookup tables.
+
+A lookup table (LUT) is a (N + 1, 4) uint8 array of RGBA colors. The
+first N rows are the colormap, the last row is the color for masked
+(and NaN) cells. Colorizing an array is quantizing it into LUT indices
+followed by a single np.take, which is much cheaper than calling a
+matplotlib colormap on a normalized float copy of the data. The colors
+are the same as matplotlib's LinearSegmentedColormap and ListedColormap
+with bytes=True would give, except that quantizing in float32 may put a
+value right at a boundary one level (of 1024) off."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import numpy as np
+
+# Beware of the amount of quantization levels, it DOES matter
+N = 1024
+
+# Color of masked cells
+BAD = (0, 0, 0, 0)
+
+CDICT_HEIGHT = {
+    'red': ((0.0, 51. / 256, 51. / 256),
+            (0.5, 237. / 256, 237. / 256),
+            (1.0, 83. / 256, 83. / 256)),
+    'green': ((0.0, 114. / 256, 114. / 256),
+              (0.5, 245. / 256, 245. / 256),
+              (1.0, 83. / 256, 83. / 256)),
+    'blue': ((0.0, 54. / 256, 54. / 256),
+             (0.5, 170. / 256, 170. / 256),
+             (1.0, 83. / 256, 83. / 256)),
+}
+
+CDICT_WATER_DEPTH = {
+    'red': ((0.0, 170. / 256, 170. / 256),
+            (0.5, 65. / 256, 65. / 256),
+            (1.0, 4. / 256, 4. / 256)),
+    'green': ((0.0, 200. / 256, 200. / 256),
+              (0.5, 120. / 256, 120. / 256),
+              (1.0, 65. / 256, 65. / 256)),
+    'blue': ((0.0, 255. / 256, 255. / 256),
+             (0.5, 221. / 256, 221. / 256),
+             (1.0, 176. / 256, 176. / 256)),
+    }
+
+
+def _mapping_array(n, segments):
+    """Interpolate one channel of a segmented colormap at n points,
+    like matplotlib.colors.makeMappingArray."""
+    segments = np.array(segments, dtype=np.float64)
+    x = segments[:, 0] * (n - 1)
+    y0 = segments[:, 1]
+    y1 = segments[:, 2]
+
+    xind = np.arange(n, dtype=np.float64)
+    ind = np.searchsorted(x, xind)[1:-1]
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    lut = np.concatenate([
+        [y1[0]],
+        distance * (y0[ind] - y1[ind - 1]) + y1[ind - 1],
+        [y0[-1]]])
+    return np.clip(lut, 0.0, 1.0)
+
+
+def segmented_lut(cdict, n=N):
+    """Return a LUT for a matplotlib style segment dictionary."""
+    lut = np.empty((n + 1, 4), dtype=np.uint8)
+    for channel, color in enumerate(('red', 'green', 'blue')):
+        lut[:n, channel] = _mapping_array(n, cdict[color]) * 255
+    if 'alpha' in cdict:
+        lut[:n, 3] = _mapping_array(n, cdict['alpha']) * 255
+    else:
+        lut[:n, 3] = 255
+    lut[n] = BAD
+    return lut
+
+
+def listed_lut(colors):
+    """Return a LUT for a list of '#rrggbb' colors."""
+    lut = np.empty((len(colors) + 1, 4), dtype=np.uint8)
+    for i, color in enumerate(colors):
+        lut[i] = (int(color[1:3], 16), int(color[3:5], 16),
+                  int(color[5:7], 16), 255)
+    lut[len(colors)] = BAD
+    return lut
+
+
+def _masked_cells(data):
+    values = np.ma.getdata(data)
+    mask = np.ma.getmaskarray(data)
+    if values.dtype.kind == 'f':
+        mask = mask | np.isnan(values)
+    return values, mask
+
+
+def apply_lut(lut, data, vmin, vmax):
+    """Colorize data with a segmented LUT, with the colors stretched
+    from vmin to vmax. Values outside that range get the color of the
+    nearest end. Returns an RGBA uint8 array."""
+    n = len(lut) - 1
+    values, mask = _masked_cells(data)
+
+    # Quantize in a single float32 array; matplotlib's Normalize
+    # would make a float64 copy, and the colormap another one
+    index = np.subtract(values, vmin, dtype=np.float32)
+    if vmax > vmin:
+        index *= n / (vmax - vmin)
+    else:
+        index[...] = 0
+    np.clip(index, 0, n - 1, out=index)
+    index = index.astype(np.int16)
+    index[mask] = n
+
+    return np.take(lut, index, axis=0)
+
+
+def apply_listed_lut(lut, data):
+    """Colorize data of which the values are indices in a listed LUT.
+    Returns an RGBA uint8 array."""
+    n = len(lut) - 1
+    values, mask = _masked_cells(data)
+
+    index = np.clip(values, 0, n - 1).astype(np.int16)
+    index[mask] = n
+
+    return np.take(lut, index, axis=0)
+
+
+HEIGHT_LUT = segmented_lut(CDICT_HEIGHT)
+WATER_DEPTH_LUT = segmented_lut(CDICT_WATER_DEPTH)
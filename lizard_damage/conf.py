@@ -33,7 +33,87 @@ class MyAppConf(AppConf):
     # Where to find land use and height tiles on the local filesystem
     DATA_ROOT = os.path.join(settings.BUILDOUT_DIR, 'var', 'data')
 
+    # Largest waterlevel area in m2 a user may upload, unless they have
+    # a quota in WATERLEVEL_SIZE_QUOTAS: a dict of email address or
+    # '@domain' to an area in m2, or None for
+    # MAX_WATERLEVEL_SIZE_CEILING. See quotas.py.
+    #
+    # The email address is whatever was typed into the first step of
+    # the (anonymous) wizard, it is not verified. So anybody can get
+    # any quota, and quotas only express who we expect to need more.
+    # MAX_WATERLEVEL_SIZE_CEILING is the hard limit for everybody, set
+    # it to what the servers can calculate in acceptable time.
     MAX_WATERLEVEL_SIZE = 200 * 1000 * 1000  # 200 km2
+    MAX_WATERLEVEL_SIZE_CEILING = 2000 * 1000 * 1000  # 2000 km2
+    WATERLEVEL_SIZE_QUOTAS = {}
+
+    # Events with more than OUT_OF_CORE_AREA m2 of waterlevels are
+    # calculated in square chunks of leaves of OUT_OF_CORE_CHUNK_SIZE m,
+    # so that their memory use doesn't grow with their size. See
+    # chunks.py.
+    OUT_OF_CORE_AREA = 200 * 1000 * 1000  # 200 km2
+    OUT_OF_CORE_CHUNK_SIZE = 10 * 1000  # 10 km
+
+    # Spread events with more than DISTRIBUTE_AREA m2 of waterlevels
+    # over the celery workers, a chunk per task. Needs a celery result
+    # backend, and workdirs on storage shared by all workers. None is
+    # off. See distributed.py.
+    DISTRIBUTE_AREA = None
+
+    # Estimated calculation time of a scenario in seconds, see costs.py:
+    # an amount per scenario plus an amount per AHN leaf of every
+    # waterlevel, times COST_CUSTOM_INPUT_FACTOR with custom heights or
+    # landuse.
+    COST_SECONDS_PER_SCENARIO = 60
+    COST_SECONDS_PER_LEAF = 15
+    COST_CUSTOM_INPUT_FACTOR = 1.5
+
+    # Scenarios estimated to take longer than LARGE_SCENARIO_SECONDS are
+    # sent to celery queue LARGE_QUEUE, the others to SMALL_QUEUE (None
+    # is celery's default queue), so that small scenarios don't wait
+    # for large ones. Workers must consume those queues (celery worker
+    # -Q). QUEUE_CONCURRENCY is the number of scenarios each queue
+    # calculates at the same time, for the expected end time in emails.
+    SMALL_QUEUE = None
+    LARGE_QUEUE = None
+    LARGE_SCENARIO_SECONDS = 15 * 60
+    QUEUE_CONCURRENCY = 1
+
+    # Record memory use per tile and per stage of a calculation, in a
+    # memory_profile.jsonl file in the workdir of the event (and of the
+    # scenario, for risk maps). See profiling.py.
+    PROFILE_MEMORY = False
+
+    # Cache of rendered web map tiles, see webtiles.py. The least
+    # recently used tiles are removed when it gets larger than
+    # TILE_CACHE_SIZE bytes.
+    TILE_CACHE_DIR = os.path.join(settings.BUILDOUT_DIR, 'var', 'tile_cache')
+    TILE_CACHE_SIZE = 2 * 1024 * 1024 * 1024  # 2 GB
+
+    # Also write damage, risk and benefit maps as a single Cloud
+    # Optimized GeoTIFF each, with this compression (DEFLATE or ZSTD;
+    # ZSTD needs a GDAL built with it). See cog.py.
+    WRITE_COG = False
+    COG_COMPRESSION = 'DEFLATE'
+
+    # Also keep the height, depth and landuse of every tile, as images
+    # and as rasters for web tiles. Off by default, because it writes
+    # several times as much to tmp and the workdir as the damage alone.
+    SAVE_TILE_LAYERS = False
+
+    # Skip the leaves of a damage event that can't be wet, see culling.py
+    CULL_DRY_LEAVES = True
+
+    # Let the web server send result downloads: None (Django streams
+    # them), 'x-sendfile' or 'x-accel-redirect'. For the latter, the
+    # URL prefix is an nginx internal location that maps to MEDIA_ROOT.
+    # See downloads.py.
+    SENDFILE_BACKEND = None
+    SENDFILE_URL_PREFIX = '/protected/'
+
+    # Reuse the results of an earlier event with exactly the same
+    # inputs instead of calculating them again. See dedup.py.
+    REUSE_RESULTS = True
 
 # Note that lizard_damage's emails also need settings for
 # EMAIL_USE_TLS, EMAIL_HOST, EMAIL_HOST_USER, EMAIL_HOST_PASSWORD and
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+"""Estimating how long a damage scenario takes to calculate.
+
+Nearly all the time of a calculation goes into the AHN leaves of its
+waterlevels, so the estimate is a fixed amount per scenario plus an
+amount per leaf of every waterlevel of every event (a time series that
+wasn't combined into a single grid has a waterlevel per timestep).
+Extra calc types and months add a little per leaf, custom heights or
+landuse multiply it. The amounts are settings, so that they can be
+tuned to the actual servers.
+
+The estimate is stored on the DamageScenario. It decides the celery
+queue of the scenario, so that long scenarios don't hold up small ones,
+and it is the basis of the expected end time in the emails.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import datetime
+
+from lizard_damage.conf import settings
+from lizard_damage_calculation import calculation
+
+# Part of the time per leaf that each extra calc type or month adds
+EXTRA_RESULT_FACTOR = 0.2
+
+# Scenarios that haven't been saved for this long are not counted as
+# waiting or running anymore, they probably crashed
+STALE_AFTER = datetime.timedelta(days=1)
+
+
+def leaf_count(path, logger):
+    from lizard_damage.models import gdal_open
+
+    dataset = gdal_open(path)
+    if dataset is None:
+        return 0
+    return len(calculation._get_ahn_leaves(dataset, logger))
+
+
+def estimate(damage_scenario, logger):
+    """Return the estimated calculation time of damage_scenario in
+    seconds."""
+    per_leaf = settings.LIZARD_DAMAGE_COST_SECONDS_PER_LEAF
+    if damage_scenario.customheights or damage_scenario.customlanduse:
+        per_leaf *= settings.LIZARD_DAMAGE_COST_CUSTOM_INPUT_FACTOR
+
+    extra_calc_types = len(damage_scenario.extra_calc_types)
+    leaves = {}
+    seconds = settings.LIZARD_DAMAGE_COST_SECONDS_PER_SCENARIO
+
+    for damage_event in damage_scenario.damageevent_set.all():
+        extra_results = extra_calc_types + len(
+            damage_event.extra_floodmonths)
+        for dewl in damage_event.damageeventwaterlevel_set.all():
+            path = dewl.waterlevel_path
+            if path not in leaves:
+                leaves[path] = leaf_count(path, logger)
+            seconds += leaves[path] * per_leaf * (
+                1 + EXTRA_RESULT_FACTOR * extra_results)
+
+    if damage_scenario.uniform_levels_region:
+        # The levels themselves come from a histogram, that is cheap
+        seconds += per_leaf * leaf_count(
+            damage_scenario.uniform_levels_region, logger)
+
+    return seconds
+
+
+def is_large(estimated_cost):
+    return (estimated_cost is not None and estimated_cost >
+            settings.LIZARD_DAMAGE_LARGE_SCENARIO_SECONDS)
+
+
+def queue(damage_scenario):
+    """Name of the celery queue for damage_scenario, or None for the
+    default queue."""
+    if is_large(damage_scenario.estimated_cost):
+        return settings.LIZARD_DAMAGE_LARGE_QUEUE
+    return settings.LIZARD_DAMAGE_SMALL_QUEUE
+
+
+def queue_options(damage_scenario):
+    """Options for apply_async() and signatures, to send a task of
+    damage_scenario to its queue."""
+    name = queue(damage_scenario)
+    return {} if name is None else {'queue': name}
+
+
+def waiting_seconds(damage_scenario):
+    """Estimated time until damage_scenario starts: the estimates of
+    the scenarios that were received before it and that are waiting or
+    being calculated in the same queue."""
+    from lizard_damage.models import DamageScenario
+
+    ahead = DamageScenario.objects.filter(
+        id__lt=damage_scenario.id,
+        status__in=(DamageScenario.SCENARIO_STATUS_RECEIVED,
+                    DamageScenario.SCENARIO_STATUS_INPROGRESS),
+        # datetime_created is updated on every save
+        datetime_created__gt=datetime.datetime.now() - STALE_AFTER,
+        estimated_cost__isnull=False)
+    large = is_large(damage_scenario.estimated_cost)
+    seconds = sum(
+        estimated_cost for estimated_cost in
+        ahead.values_list('estimated_cost', flat=True)
+        if is_large(estimated_cost) == large)
+    return seconds / settings.LIZARD_DAMAGE_QUEUE_CONCURRENCY
+
+
+def eta(damage_scenario, start_dt=None):
+    """Return when damage_scenario is expected to be ready, as text for
+    an email, or None if there is no estimate. If it hasn't started yet
+    (start_dt is None), the scenarios ahead of it are included."""
+    if damage_scenario.estimated_cost is None:
+        return None
+    if start_dt is None:
+        start_dt = datetime.datetime.now() + datetime.timedelta(
+            seconds=waiting_seconds(damage_scenario))
+    ready = start_dt + datetime.timedelta(
+        seconds=damage_scenario.estimated_cost)
+    return ready.strftime('%d-%m-%Y %H:%M')
@@ -0,0 +1,87 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Finding the leaves of a damage event that can't be wet.
+
+The leaves of an event are all AHN leaves in the bounding box of its
+waterlevel, and for long narrow floods most of them are dry. Before
+the calculation, the waterlevel grids alone are read per leaf (they
+are much coarser than the AHN, so that is cheap). A leaf is dry if it
+has no waterlevel data at all, or if its highest waterlevel is not
+above the lowest point of its AHN tile. The latter is only known if the
+tile has its statistics stored (e.g. by 'gdalinfo -stats'); it is read
+from the metadata, never computed."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import blocks
+
+NO_WATERLEVEL = 'no waterlevel'
+BELOW_GROUND = 'waterlevel below ground'
+
+
+def max_waterlevel(datasets, extent):
+    """Return the highest waterlevel in any of datasets inside extent,
+    or None if there is no waterlevel data there."""
+    maximum = None
+    for dataset in datasets:
+        clip = blocks.window(dataset, extent)
+        if clip is None:
+            continue
+        band = dataset.GetRasterBand(1)
+        data = band.ReadAsArray(*clip)
+        nodatavalue = band.GetNoDataValue()
+
+        valid = np.ones(data.shape, dtype=np.bool)
+        if data.dtype.kind == 'f':
+            valid &= ~np.isnan(data)
+        if nodatavalue is not None:
+            valid &= data != nodatavalue
+        values = data[valid]
+        if values.size and (maximum is None or values.max() > maximum):
+            maximum = values.max()
+    return maximum
+
+
+def ground_minimum(path):
+    """Return the lowest height in the tile at path if it is stored in
+    its metadata, otherwise None."""
+    if not os.path.exists(path):
+        return None
+    dataset = gdal.Open(path.encode('utf8'))
+    if dataset is None:
+        return None
+    minimum = dataset.GetRasterBand(1).GetMetadataItem(
+        b'STATISTICS_MINIMUM')
+    return None if minimum is None else float(minimum)
+
+
+def dry_leaves(waterlevel_paths, leaves, ahn_data_dir):
+    """Return a dict of the names of the leaves that can't be wet, with
+    the reason. leaves is an iterable of (ahn_name, extent)."""
+    datasets = [gdal.Open(path.encode('utf8')) for path in waterlevel_paths]
+    datasets = [dataset for dataset in datasets if dataset is not None]
+    if not datasets:
+        return {}
+
+    dry = {}
+    for ahn_name, extent in leaves:
+        maximum = max_waterlevel(datasets, extent)
+        if maximum is None:
+            dry[ahn_name] = NO_WATERLEVEL
+            continue
+
+        minimum = ground_minimum(os.path.join(
+            ahn_data_dir, ahn_name[1:4], ahn_name + '.tif'))
+        if minimum is not None and maximum <= minimum:
+            dry[ahn_name] = BELOW_GROUND
+    return dry
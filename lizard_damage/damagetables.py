@@ -0,0 +1,159 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""A per process cache of parsed damage tables.
+
+Parsing a damage table needs the Unit rows, and used to happen for
+every event. Tables are now parsed once per process, keyed by the hash
+of the file's content, and the Units are loaded once. Saving or deleting
+a Unit empties the cache; other processes notice through a version
+number in Django's cache, so that only works across processes if that
+is a shared cache.
+
+Each table is kept as a CompiledDamageTable, which also has the
+amounts and factors of all codes as lookup arrays indexed by landuse
+code, so the damage of many cells can be computed without a Python
+loop over the codes."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import io
+import os
+
+from django.core.cache import cache
+import numpy as np
+
+from lizard_damage.conf import settings
+from lizard_damage_calculation import table
+
+UNITS_VERSION_KEY = 'lizard_damage_units_version'
+
+# content hash: CompiledDamageTable
+_tables = {}
+# [units version, list of Units], or empty
+_units = []
+
+
+class CompiledDamageTable(object):
+    def __init__(self, damage_table):
+        self.table = damage_table
+        self.codes = sorted(damage_table.data)
+        # Landuse codes outside the table all map to the last entry
+        self.size = max(self.codes) + 1 if self.codes else 0
+        self._factors = {}
+
+    def lut_index(self, landuse):
+        """Return landuse as indices into the lookup arrays."""
+        landuse = np.asarray(landuse)
+        return np.where(
+            (landuse >= 0) & (landuse < self.size), landuse, self.size)
+
+    def _lut(self, values):
+        lut = np.zeros(self.size + 1, dtype=np.float64)
+        for code, value in values.items():
+            lut[code] = value
+        lut.setflags(write=False)
+        return lut
+
+    def factors(self, calc_type, month, floodtime, repairtime_buildings,
+                road_grid_codes):
+        """Return (direct, indirect) lookup arrays of the damage per m2
+        of each code without the depth factor. Indirect damage of roads
+        is 0, it counts per flooded road instead."""
+        key = (calc_type, month, floodtime, repairtime_buildings,
+               tuple(sorted(road_grid_codes)))
+        if key not in self._factors:
+            data = self.table.data
+            self._factors[key] = (
+                self._lut({
+                    code: dr.to_direct_damage(calc_type) *
+                    dr.to_gamma_floodtime(floodtime) *
+                    dr.to_gamma_month(month)
+                    for code, dr in data.items()}),
+                self._lut({
+                    code: dr.to_indirect_damage(calc_type) *
+                    dr.to_gamma_repairtime(repairtime_buildings)
+                    for code, dr in data.items()
+                    if code not in road_grid_codes}))
+        return self._factors[key]
+
+    def gamma_depth(self, landuse, depth):
+        """Return the depth factor of each cell. Cells are grouped by
+        code, so each code's damage curve is evaluated once."""
+        result = np.zeros(depth.shape, dtype=np.float64)
+        order = np.argsort(landuse, kind='mergesort')
+        codes, starts = np.unique(landuse[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for code, start, end in zip(codes, starts, ends):
+            dr = self.table.data.get(int(code))
+            if dr is not None:
+                cells = order[start:end]
+                result[cells] = dr.to_gamma_depth(depth[cells])
+        return result
+
+    def cell_damage(self, landuse, depth, area, calc_type, month, floodtime,
+                    repairtime_buildings, road_grid_codes, gamma_depth=None):
+        """Return the damage of each wet cell. landuse and depth are 1D
+        arrays, area is the area per cell (a number or an array).
+        gamma_depth can be given if it is already known."""
+        if gamma_depth is None:
+            gamma_depth = self.gamma_depth(landuse, depth)
+        direct, indirect = self.factors(
+            calc_type, month, floodtime, repairtime_buildings,
+            road_grid_codes)
+        index = self.lut_index(landuse)
+        return area * (direct[index] * gamma_depth + indirect[index])
+
+    def per_code(self, landuse, values):
+        """Return a dict of the sum of values per code of the table."""
+        sums = np.bincount(
+            self.lut_index(landuse), weights=values,
+            minlength=self.size + 1)
+        return {code: float(sums[code]) for code in self.codes}
+
+
+def units():
+    """Return the Units, loaded once per process until they change."""
+    from lizard_damage.models import Unit
+
+    version = cache.get(UNITS_VERSION_KEY, 0)
+    if not _units or _units[0] != version:
+        _units[:] = [version, list(Unit.objects.all())]
+        _tables.clear()
+    return _units[1]
+
+
+def clear(**kwargs):
+    """Signal handler for changed Units."""
+    del _units[:]
+    _tables.clear()
+    try:
+        cache.incr(UNITS_VERSION_KEY)
+    except ValueError:
+        cache.set(UNITS_VERSION_KEY, 1, None)
+
+
+def compiled(path):
+    """Return the CompiledDamageTable of the damage table cfg at path."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    units_list = units()
+    key = hashlib.sha256(content).hexdigest()
+    if key not in _tables:
+        _tables[key] = CompiledDamageTable(table.DamageTable.read_cfg(
+            io.BytesIO(content), units=units_list))
+    return _tables[key]
+
+
+def read(path):
+    """Return the (shared, so don't change it) DamageTable at path."""
+    return compiled(path).table
+
+
+def default_path():
+    return os.path.join(settings.BUILDOUT_DIR, table.DEFAULT_DAMAGE_TABLE)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+"""Reusing the results of identical damage events.
+
+Events are identified by a hash of everything that goes into their
+calculation: the bytes of the waterlevels, damage table and custom
+rasters, and the parameters. When an event has the same hash as one
+that was calculated before, the files of that event are hard linked
+into the new event's workdir instead of calculating them again. Hard
+links keep the files alive when the old scenario is cleaned up.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import json
+import os
+import shutil
+
+CHUNK_SIZE = 1024 * 1024
+
+# Increase to stop reusing results made by older code
+HASH_VERSION = 1
+
+
+def content_hash(paths, parameters):
+    """Return the sha256 hex digest of the files at paths (None for a
+    missing input), in order, and parameters, a dict that is serialized
+    as JSON."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        [HASH_VERSION, parameters], sort_keys=True).encode('utf8'))
+    for path in paths:
+        if path is None:
+            digest.update(b'\0none')
+            continue
+        digest.update(b'\0file')
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, target):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Other filesystem, or no hard links there
+        shutil.copy2(source, target)
+
+
+def link_tree(source_dir, target_dir, exclude=()):
+    """Hard link (or copy) all files below source_dir to the same place
+    below target_dir, except for the top level directories in exclude.
+    Returns the number of files."""
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        if dirpath == source_dir:
+            dirnames[:] = [name for name in dirnames if name not in exclude]
+        relative = os.path.relpath(dirpath, source_dir)
+        target = os.path.normpath(os.path.join(target_dir, relative))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for filename in filenames:
+            link_or_copy(
+                os.path.join(dirpath, filename),
+                os.path.join(target, filename))
+            count += 1
+    return count
+
+
+def unlink_shared(directory):
+    """Remove the files below directory that are hard linked elsewhere,
+    so that writing new files there leaves the other copies alone.
+    Returns the number of removed files."""
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.stat(path).st_nlink > 1:
+                os.remove(path)
+                count += 1
+    return count
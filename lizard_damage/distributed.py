@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+"""Calculating one damage event on several celery workers.
+
+Events with more than LIZARD_DAMAGE_DISTRIBUTE_AREA m2 of waterlevels
+are split into the same square chunks of leaves as in chunks.py, and
+every chunk becomes a celery task (tasks.calculate_damage_chunk). A
+chunk task records its tiles like DamageEvent.calculate does, into the
+event's workdir, except that the per tile files that go into the result
+zip are put in a zipfile of its own, and its totals and what its
+ResultCollector knows about the tiles are written to a JSON file next
+to it. The workdirs must therefore be on storage that all workers share.
+
+The chunk tasks are the header of a celery chord, whose callback
+(tasks.reduce_damage_event) adds the totals together, including the
+flooded area of each road before the 100 m2 threshold for indirect road
+damage is applied, and then finishes the event as usual: zipfile,
+damage GeoTIFFs and images. After that it continues the scenario with
+its next event.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import datetime
+import json
+import os
+import shutil
+
+from celery import chord
+
+from lizard_damage import chunks
+from lizard_damage import costs
+from lizard_damage import models
+from lizard_damage import profiling
+from lizard_damage import results
+from lizard_damage.conf import settings
+
+PARTIALS_DIR = 'partials'
+
+# Task arguments are serialized, so the start time is passed as a string
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def partial_path(workdir, number, extension):
+    return os.path.join(
+        workdir, PARTIALS_DIR, 'chunk_{}.{}'.format(number, extension))
+
+
+def start(damage_event, event_index, errors, start_dt, logger):
+    """Start the chord that calculates damage_event, which is at
+    event_index in its scenario. errors and start_dt are the scenario's
+    so far. Returns False if the results of an identical event were
+    reused instead, so there is nothing to calculate."""
+    from lizard_damage import tasks
+
+    logger.info("event %s, distributed" % (damage_event,))
+    reused, content_hash = damage_event.reuse_or_unshare(logger)
+    if reused:
+        return False
+
+    event_calculation = models.EventCalculation(
+        damage_event, logger, content_hash)
+    all_leaves, skipped_leaves = event_calculation.leaves()
+    leaf_chunks = chunks.chunk_leaves(
+        all_leaves, settings.LIZARD_DAMAGE_OUT_OF_CORE_CHUNK_SIZE)
+    logger.info("Distributing {} leaves over {} chunks".format(
+        len(all_leaves), len(leaf_chunks)))
+
+    # Made here, so that the chunks don't race to make them
+    partials_dir = os.path.join(damage_event.workdir, PARTIALS_DIR)
+    if os.path.exists(partials_dir):
+        shutil.rmtree(partials_dir)
+    os.makedirs(partials_dir)
+    tempdir = os.path.join(damage_event.workdir, 'tmp')
+    if not os.path.exists(tempdir):
+        os.makedirs(tempdir)
+
+    # On the scenario's queue, so that small scenarios don't wait
+    options = costs.queue_options(damage_event.scenario)
+    callback = tasks.reduce_damage_event.s(
+        damage_event.id, event_index, errors,
+        start_dt.strftime(DATETIME_FORMAT),
+        [[ahn_name, list(extent)] for ahn_name, extent in all_leaves],
+        skipped_leaves, content_hash, taskname=logger.name).set(**options)
+    if not leaf_chunks:
+        callback.delay([])
+        return True
+
+    chord(
+        tasks.calculate_damage_chunk.s(
+            damage_event.id, number, list(extent), names,
+            taskname=logger.name).set(**options)
+        for number, (extent, names) in enumerate(leaf_chunks))(callback)
+    return True
+
+
+def calculate_chunk(damage_event, number, extent, names, logger):
+    """Record the tiles of one chunk. Returns the path of the JSON file
+    with its totals."""
+    event_calculation = models.EventCalculation(damage_event, logger)
+    workdir = damage_event.workdir
+    zip_path = partial_path(workdir, number, 'zip')
+    result_collector = results.ResultCollector(
+        workdir, [], logger, zip_filename=zip_path)
+
+    for leaf_result in chunks.calculate_chunk(
+            event_calculation.make_calculator,
+            event_calculation.waterlevel_ascfiles, extent, names,
+            result_collector.tempdir, logger,
+            **event_calculation.calculation_kwargs):
+        event_calculation.record_tile(result_collector, leaf_result)
+
+    json_path = partial_path(workdir, number, 'json')
+    with open(json_path, 'w') as f:
+        json.dump({
+            'zipfile': zip_path,
+            'totals': event_calculation.totals(),
+            'state': result_collector.state(),
+        }, f)
+    return json_path
+
+
+def finish(damage_event, json_paths, all_leaves, skipped_leaves,
+           content_hash, logger):
+    """Add the results of the chunks at json_paths together and finish
+    damage_event."""
+    all_leaves = [(ahn_name, tuple(extent)) for ahn_name, extent in all_leaves]
+    event_calculation = models.EventCalculation(
+        damage_event, logger, content_hash)
+
+    profiler = profiling.profiler_for_directory(damage_event.workdir)
+    profiler.start()
+    result_collector = event_calculation.result_collector(
+        all_leaves, profiler=profiler)
+
+    for json_path in json_paths:
+        with open(json_path) as f:
+            partial = json.load(f)
+        event_calculation.add_totals(partial['totals'])
+        result_collector.add_state(partial['state'])
+        if os.path.exists(partial['zipfile']):
+            result_collector.add_zipfile(partial['zipfile'])
+
+    event_calculation.finish(
+        result_collector, all_leaves, skipped_leaves, profiler)
+    profiler.stop()
+    shutil.rmtree(os.path.join(damage_event.workdir, PARTIALS_DIR))
+
+
+def parse_datetime(value):
+    return datetime.datetime.strptime(value, DATETIME_FORMAT)
@@ -0,0 +1,229 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Serving (large) result files for download.
+
+Files are streamed in chunks, and a single HTTP Range is supported so
+that interrupted downloads can be resumed. If
+LIZARD_DAMAGE_SENDFILE_BACKEND is set, the web server sends the file
+instead: 'x-sendfile' (Apache mod_xsendfile, lighttpd) gets the path in
+an X-Sendfile header, 'x-accel-redirect' (nginx) gets
+LIZARD_DAMAGE_SENDFILE_URL_PREFIX plus the path relative to MEDIA_ROOT,
+which has to be an internal location that maps to MEDIA_ROOT.
+
+Single members of a result zip can be served too, decompressed on the
+fly, and for rasters just a window of them (through GDAL's /vsizip/)."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+
+from django.http import HttpResponse
+from django.http import StreamingHttpResponse
+from django.utils.http import http_date
+from django.utils.http import parse_http_date_safe
+from osgeo import gdal
+
+from lizard_damage import blocks
+from lizard_damage.conf import settings
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*bytes=(\d*)-(\d*)\s*$')
+
+# Largest raster window that is cut out of a result, in pixels
+MAX_WINDOW_PIXELS = 25000000
+
+
+def parse_range(header, size):
+    """Return (start, end) of the byte range in a Range header, with
+    end inclusive. Returns None if there is no usable (single) range,
+    and raises ValueError if the range can't be satisfied."""
+    match = RANGE_RE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+
+    start, end = match.groups()
+    if not start:
+        # Suffix range, the last <end> bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def iter_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _sendfile_response(path):
+    backend = settings.LIZARD_DAMAGE_SENDFILE_BACKEND
+    response = HttpResponse()
+    if backend == 'x-sendfile':
+        response['X-Sendfile'] = path.encode('utf8')
+    elif backend == 'x-accel-redirect':
+        relative = os.path.relpath(path, settings.MEDIA_ROOT)
+        response['X-Accel-Redirect'] = (
+            settings.LIZARD_DAMAGE_SENDFILE_URL_PREFIX.rstrip('/') + '/' +
+            relative).encode('utf8')
+    else:
+        raise ValueError(
+            "Unknown LIZARD_DAMAGE_SENDFILE_BACKEND {}".format(backend))
+    # The web server sets the type and length itself
+    del response['Content-Type']
+    return response
+
+
+def file_response(request, path, filename=None):
+    """Return a response with the file at path as an attachment."""
+    if filename is None:
+        filename = os.path.basename(path)
+
+    if settings.LIZARD_DAMAGE_SENDFILE_BACKEND:
+        response = _sendfile_response(path)
+    else:
+        stat = os.stat(path)
+        size = stat.st_size
+
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if (if_range is None or
+                parse_http_date_safe(if_range) == int(stat.st_mtime)):
+            try:
+                byte_range = parse_range(
+                    request.META.get('HTTP_RANGE'), size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{}'.format(size)
+                return response
+
+        if byte_range is None:
+            length = size
+            response = StreamingHttpResponse(iter_file(path, 0, size))
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                iter_file(path, start, length), status=206)
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, size)
+
+        response['Content-Length'] = str(length)
+        response['Content-Type'] = _content_type(filename)
+        response['Accept-Ranges'] = 'bytes'
+        response['Last-Modified'] = http_date(stat.st_mtime)
+
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+        filename)
+    return response
+
+
+def _content_type(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def iter_zip_member(zip_path, member):
+    with zipfile.ZipFile(zip_path) as archive:
+        with archive.open(member) as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def zip_member_response(zip_path, member):
+    """Return a response with a single member of the zipfile at
+    zip_path as an attachment, decompressed while it is sent."""
+    with zipfile.ZipFile(zip_path) as archive:
+        info = archive.getinfo(member)
+
+    filename = os.path.basename(member)
+    response = StreamingHttpResponse(iter_zip_member(zip_path, member))
+    response['Content-Length'] = str(info.file_size)
+    response['Content-Type'] = _content_type(filename)
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+        filename)
+    return response
+
+
+def parse_bbox(value):
+    """Return (minx, miny, maxx, maxy) from a 'minx,miny,maxx,maxy'
+    string. Raises ValueError if it isn't one."""
+    bbox = [float(part) for part in value.split(',')]
+    if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        raise ValueError("Invalid bbox {}".format(value))
+    return tuple(bbox)
+
+
+def raster_window_response(zip_path, member, bbox):
+    """Return a response with the part of raster member of the zipfile
+    at zip_path inside bbox, as a GeoTIFF. Raises ValueError if the
+    member isn't a raster, or the window is empty or too large."""
+    dataset = gdal.Open(
+        '/vsizip/{}/{}'.format(zip_path, member).encode('utf8'))
+    if dataset is None:
+        raise ValueError("{} is not a raster".format(member))
+
+    clip = blocks.window(dataset, bbox)
+    if clip is None:
+        raise ValueError("bbox is outside {}".format(member))
+    col, row, width, height = clip
+    if width * height > MAX_WINDOW_PIXELS:
+        raise ValueError("bbox is too large")
+
+    x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+    first_band = dataset.GetRasterBand(1)
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, b'window.tif')
+        target = gdal.GetDriverByName(b'GTiff').Create(
+            path, width, height, dataset.RasterCount, first_band.DataType,
+            [b'TILED=YES', b'COMPRESS=DEFLATE'])
+        target.SetProjection(dataset.GetProjection())
+        target.SetGeoTransform(
+            (x0 + col * dx, dx, 0, y0 + row * dy, 0, dy))
+        for index in range(1, dataset.RasterCount + 1):
+            band = dataset.GetRasterBand(index)
+            target_band = target.GetRasterBand(index)
+            nodata = band.GetNoDataValue()
+            if nodata is not None:
+                target_band.SetNoDataValue(nodata)
+            target_band.WriteArray(
+                band.ReadAsArray(col, row, width, height))
+        target = None
+
+        with open(path, 'rb') as f:
+            data = f.read()
+    finally:
+        shutil.rmtree(tempdir)
+
+    filename = '{}_{}_{}.tif'.format(
+        os.path.splitext(os.path.basename(member))[0],
+        int(x0 + col * dx), int(y0 + row * dy))
+    response = HttpResponse(data, content_type='image/tiff')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+        filename)
+    return response
@@ -23,6 +23,7 @@ from djcelery.models import TaskMeta
 
 from lizard_task.models import SecuredPeriodicTask
 
+from . import costs
 from . import models
 
 
@@ -131,7 +132,8 @@ def send_taskrecieved_mail(damage_scenario, logger):
         % damage_scenario.name)
     send_email_to_task(
         damage_scenario.id, 'email_taskrecieved', subject,
-        extra_context={'celery_queuelength': celery_queuelength})
+        extra_context={'celery_queuelength': celery_queuelength,
+                       'eta': costs.eta(damage_scenario)})
 
 
 def send_start_mail(damage_scenario, logger, start_dt):
@@ -141,7 +143,8 @@ def send_start_mail(damage_scenario, logger, start_dt):
         'WaterSchadeSchatter: Berekening scenario %s is gestart'
         % damage_scenario.name)
     send_email_to_task(
-        damage_scenario.id, 'email_started', subject)
+        damage_scenario.id, 'email_started', subject,
+        extra_context={'eta': costs.eta(damage_scenario, start_dt)})
 
 
 def send_damage_error_mail(damage_scenario, logger, start_dt):
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+"""Maximum waterlevel of a time series of waterlevel grids.
+
+Time series events (scenario type 2) can have hundreds of
+timesteps. Instead of extracting all of them and letting the calculator
+read them, the grids are read one at a time, straight from the uploaded
+zip through /vsizip/, and only running accumulators are kept: the
+maximum waterlevel, and optionally the first timestep with water and
+the number of timesteps with water. The accumulators are GeoTIFFs that
+are updated window by window, so memory use depends neither on the
+number of timesteps nor on the size of the grids.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import math
+
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import blocks
+from lizard_damage import utils
+
+NODATA = -9999
+
+# Bands of the inundation raster, in timesteps (0 is the first grid)
+FIRST_TIMESTEP_BAND = 1
+TIMESTEPS_WET_BAND = 2
+INUNDATION_NODATA = -1
+
+# In cells, for comparing coordinates of different grids
+EPSILON = 1e-6
+
+
+def vsizip_path(zip_path, member):
+    return '/vsizip/{}/{}'.format(zip_path, member)
+
+
+def _create(path, grid, projection, band_count, datatype, nodatavalue):
+    """Uncompressed, because the windows are written more than once.
+    grid is (xsize, ysize, geotransform)."""
+    xsize, ysize, geotransform = grid
+    dataset = gdal.GetDriverByName(b'GTiff').Create(
+        path.encode('utf8'), xsize, ysize, band_count, datatype)
+    dataset.SetProjection(projection)
+    dataset.SetGeoTransform(geotransform)
+    for index in range(1, band_count + 1):
+        band = dataset.GetRasterBand(index)
+        band.SetNoDataValue(nodatavalue)
+        band.Fill(nodatavalue)
+    return dataset
+
+
+def _union_grid(grids):
+    """Return (xsize, ysize, geotransform) of a grid with the cells of
+    the first of grids that covers all of them. grids are (xsize,
+    ysize, geotransform) tuples of north up rasters."""
+    x0, dx, _, y0, _, dy = grids[0][2]
+    minx = miny = float('inf')
+    maxx = maxy = float('-inf')
+    for xsize, ysize, (gx0, gdx, _, gy0, _, gdy) in grids:
+        minx = min(minx, gx0, gx0 + xsize * gdx)
+        maxx = max(maxx, gx0, gx0 + xsize * gdx)
+        miny = min(miny, gy0, gy0 + ysize * gdy)
+        maxy = max(maxy, gy0, gy0 + ysize * gdy)
+
+    # Rounded a little inwards first, so that floating point errors
+    # don't add a column or row
+    col0 = int(math.floor((minx - x0) / dx + EPSILON))
+    col1 = int(math.ceil((maxx - x0) / dx - EPSILON))
+    row0 = int(math.floor((maxy - y0) / dy + EPSILON))
+    row1 = int(math.ceil((miny - y0) / dy - EPSILON))
+    return col1 - col0, row1 - row0, (
+        x0 + col0 * dx, dx, 0, y0 + row0 * dy, 0, dy)
+
+
+def _same_grid(dataset, other):
+    return (
+        (dataset.RasterXSize, dataset.RasterYSize) ==
+        (other.RasterXSize, other.RasterYSize) and
+        dataset.GetGeoTransform() == other.GetGeoTransform())
+
+
+def _has_data(data, nodatavalue):
+    result = np.ones(data.shape, dtype=bool)
+    if nodatavalue is not None:
+        result &= data != nodatavalue
+    if data.dtype.kind == 'f':
+        result &= ~np.isnan(data)
+    return result
+
+
+def _update(envelope, inundation, band, timestep):
+    """Add the waterlevels in band to the accumulators."""
+    nodatavalue = band.GetNoDataValue()
+    envelope_band = envelope.GetRasterBand(1)
+
+    for xoff, yoff, xsize, ysize in blocks.windows(envelope_band):
+        data = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        wet = _has_data(data, nodatavalue)
+        if not wet.any():
+            continue
+
+        maximum = envelope_band.ReadAsArray(xoff, yoff, xsize, ysize)
+        higher = wet & ((maximum == NODATA) | (data > maximum))
+        maximum[higher] = data[higher]
+        envelope_band.WriteArray(maximum, xoff, yoff)
+
+        if inundation is None:
+            continue
+        first_band = inundation.GetRasterBand(FIRST_TIMESTEP_BAND)
+        first = first_band.ReadAsArray(xoff, yoff, xsize, ysize)
+        first[wet & (first == INUNDATION_NODATA)] = timestep
+        first_band.WriteArray(first, xoff, yoff)
+
+        count_band = inundation.GetRasterBand(TIMESTEPS_WET_BAND)
+        count = count_band.ReadAsArray(xoff, yoff, xsize, ysize)
+        count[wet] = np.maximum(count[wet], 0) + 1
+        count_band.WriteArray(count, xoff, yoff)
+
+
+def build(paths, envelope_path, inundation_path=None, logger=None):
+    """Write the maximum of the waterlevel grids at paths (in timestep
+    order, /vsizip/ paths are fine) to a GeoTIFF at envelope_path. Its
+    grid has the cells of the first one and covers all of them, because
+    a flood usually grows. If inundation_path is given, the first
+    timestep with water and the number of timesteps with water are
+    written there.
+
+    Raises ValueError if there are no paths or one can't be opened."""
+    if not paths:
+        raise ValueError("No waterlevels")
+
+    # Only the headers are read here, the data once per timestep below
+    grids = []
+    projection = None
+    for path in paths:
+        dataset = _open(path)
+        grids.append((dataset.RasterXSize, dataset.RasterYSize,
+                      dataset.GetGeoTransform()))
+        if projection is None:
+            projection = dataset.GetProjection()
+    dataset = None
+    grid = _union_grid(grids)
+
+    envelope = _create(
+        envelope_path, grid, projection, 1, gdal.GDT_Float32, NODATA)
+    inundation = None
+    if inundation_path is not None:
+        inundation = _create(
+            inundation_path, grid, projection, 2, gdal.GDT_Int16,
+            INUNDATION_NODATA)
+
+    for timestep, path in enumerate(paths):
+        dataset = _open(path)
+        if not _same_grid(dataset, envelope):
+            dataset = utils.reproject(dataset, envelope)
+
+        _update(envelope, inundation, dataset.GetRasterBand(1), timestep)
+        if logger is not None:
+            logger.debug("Added timestep {} ({})".format(timestep, path))
+
+    # Closing the datasets flushes them
+    envelope = inundation = None
+
+
+def _open(path):
+    dataset = gdal.Open(path.encode('utf8'))
+    if dataset is None:
+        raise ValueError("Can't open waterlevel {}".format(path))
+    return dataset
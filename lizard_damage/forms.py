@@ -10,13 +10,13 @@ from django.core.validators import MaxValueValidator
 from django.core.validators import MinValueValidator
 from django.utils.encoding import force_unicode
 from django.utils.safestring import mark_safe
-import gdal
 import logging
 import os
 import tempfile
 
 from lizard_damage import landuse_translator
-from lizard_damage.conf import settings
+from lizard_damage import leafindex
+from lizard_damage import quotas
 from lizard_damage.models import DamageScenario
 from lizard_damage.models import gdal_open
 from lizard_damage.raster import get_area_with_data
@@ -26,8 +26,6 @@ from lizard_damage_calculation import calculation
 logger = logging.getLogger(__name__)
 
 
-GDAL_TIFF_DRIVER = gdal.GetDriverByName(b'gtiff')
-
 SCENARIO_TYPES = DamageScenario.SCENARIO_TYPES
 SCENARIO_TYPES_DICT = DamageScenario.SCENARIO_TYPES_DICT
 
@@ -232,13 +230,31 @@ class FormStep1(forms.Form):
         'de winter is er minder schade dan in de zomer. Indien u niets invult'
         ' wordt default uitgegaan van september.')
 
+    floodmonths = forms.MultipleChoiceField(
+        label="Optioneel: schade ook berekenen voor deze maanden",
+        choices=MONTH_CHOICES, required=False,
+        widget=forms.CheckboxSelectMultiple,
+        help_text='De schade wordt in dezelfde berekening ook voor deze '
+        'maanden bepaald, als tabel per maand. Kaarten worden alleen voor '
+        'de maand van de gebeurtenis gemaakt.')
+
     calc_type = forms.ChoiceField(
         label="Gemiddelde, minimale of maximale schadebedragen "
         "en schadefuncties",
         choices=DamageScenario.CALC_TYPE_CHOICES,
         initial=DamageScenario.CALC_TYPE_AVG,
         help_text='Voer uw schadeberekening uit met voor Nederland '
-        'gemiddelde, maximale of minimale schadebedragen en schadefuncties.')
+        'gemiddelde, maximale of minimale schadebedragen en schadefuncties, '
+        'of met alle drie in een enkele berekening.')
+
+    def __init__(self, *args, **kwargs):
+        # Email address from step 0, for the waterlevel area quota
+        self.email = kwargs.pop('email', None)
+        super(FormStep1, self).__init__(*args, **kwargs)
+
+    def clean_floodmonths(self):
+        return [int(month) for month in
+                self.cleaned_data.get('floodmonths') or []]
 
     def add_field_error(self, field, message):
         """Assumes this field has no errors yet"""
@@ -315,12 +331,12 @@ class FormStep1(forms.Form):
         self.save_uploaded_gdal_file_field('waterlevel')
 
         ds = self.cleaned_data.get('waterlevel_dataset')
-        if ds:
-            if get_area_with_data(ds) > \
-               settings.LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE:
-                self.add_field_error(
-                    'waterlevel',
-                    'Het waterstand bestand mag maximaal 200 km2 bestrijken.')
+        if ds and quotas.exceeds(get_area_with_data(ds), self.email):
+            self.add_field_error(
+                'waterlevel',
+                'Het waterstand bestand mag maximaal {:.0f} km2 '
+                'bestrijken.'.format(
+                    quotas.max_waterlevel_size(self.email) / 1000000.))
 
         return self.cleaned_data.get('waterlevel')
 
@@ -339,40 +355,26 @@ class FormStep1(forms.Form):
             # Check that AHN-files exists for selected AHN-version
             # AHN files are stored on the server in directory 'data_ahn2' and
             # 'data_ahn3' for AHN version 2 and 3 respectively.
-            ahn_data_dir = os.path.join(settings.LIZARD_DAMAGE_DATA_ROOT,
-                                        'data_ahn' + cleaned_data['ahn_version'])
-            for ahn_file in ahn_files:
-                file_name = ahn_file + '.tif'
-                prefix = file_name[1:4]
-                path = os.path.join(ahn_data_dir, prefix, file_name)
-                if not os.path.isfile(path):
-                    logger.debug("file %s not present", file_name)
-                    self.add_field_error(
-                        'ahn_version',
-                        'Geen AHN-kaart beschikbaar voor het gebied van deze waterstand.')
+            missing = leafindex.missing_tiles(
+                'data_ahn' + cleaned_data['ahn_version'], ahn_files)
+            if missing:
+                logger.debug("files %s not present", missing)
+                self.add_field_error(
+                    'ahn_version',
+                    'Geen AHN-kaart beschikbaar voor het gebied van deze waterstand.')
 
         # Check the landuse Excel sheet
         translator = self.cleaned_data.get('customlanduseexcel_translator')
         landuse = self.cleaned_data.get('customlanduse_dataset')
         if translator and landuse:
             try:
-                translator.check_with_dataset(landuse)
-
-                # It's apparently correct. Use it to translate the
-                # customlanduse dataset, creating a new one. It's a
-                # bit dirty to do this in the form, but OK...
-                dataset = self.cleaned_data.get('customlanduse_dataset')
-                grid = dataset.GetRasterBand(1).ReadAsArray()
-
+                # It's a bit dirty to translate the customlanduse
+                # dataset in the form, but OK... Checking happens in
+                # the same pass, so if it's incorrect there's no new
+                # dataset.
                 new_filename = str(os.path.join(
                     self.temp_directory, 'translated_landusemap.tiff'))
-                new_dataset = GDAL_TIFF_DRIVER.CreateCopy(
-                    new_filename, dataset)
-                band = new_dataset.GetRasterBand(1)
-                band.WriteArray(translator.translate_grid(grid))
-                band.SetNoDataValue(translator.NODATA_VALUE)
-                del new_dataset
-                del dataset
+                translator.translate_dataset(landuse, new_filename)
                 os.remove(self.cleaned_data.get('customlanduse_file'))
                 self.cleaned_data['customlanduse_file'] = new_filename
             except landuse_translator.TranslatorException as e:
@@ -415,6 +417,8 @@ class FormStepUniformLevelsBatch(FormStep1):
             "per rekenstap de waterstand ingesteld. Cellen zonder "
             "waarde doen niet mee."
             )
+        # The damage per level comes from histograms, for one month
+        del self.fields['floodmonths']
 
     start_level = forms.FloatField(
         label="Startniveau (m)",
@@ -430,11 +434,29 @@ class FormStepUniformLevelsBatch(FormStep1):
         required=True,
         validators=[
             MinValueValidator(1),
-            MaxValueValidator(20),
-            # Max 20 seems enough to me. Safety valve for typos.
+            MaxValueValidator(500),
+            # Only the levels with maps are expensive, the rest comes
+            # from histograms. Still a safety valve for typos.
         ],
         help_text=("Aantal keer dat de waterstand met de "
                    "stapgrootte opgehoogd moet worden."))
+    rendered_levels = forms.CharField(
+        label="Waterstanden met kaarten (m)",
+        required=False,
+        help_text=("Komma-gescheiden waterstanden waarvoor ook kaarten "
+                   "gemaakt worden. Standaard alleen de hoogste. Voor "
+                   "de overige waterstanden wordt alleen de totale "
+                   "schade berekend."))
+
+    def clean_rendered_levels(self):
+        value = self.cleaned_data.get('rendered_levels') or ''
+        try:
+            return [float(level) for level in value.split(',')
+                    if level.strip()]
+        except ValueError:
+            raise forms.ValidationError(
+                "Geef waterstanden gescheiden door komma's, "
+                "bijvoorbeeld: 1.5, 2.0")
 
 
 class FormStep3(forms.Form):
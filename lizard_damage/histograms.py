@@ -0,0 +1,241 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Damage curves for uniform waterlevels (scenario type 7).
+
+With a uniform waterlevel, the water depth in a cell only depends on
+its ground height, and the damage only on the depth and the landuse.
+So instead of calculating full damage rasters for every level, the
+area of the calculation region is counted once per (landuse code,
+ground height bin), and once per (road, ground height bin) for the
+indirect road damage. The damage at any level then follows from those
+histograms and the damage table's depth functions, at the cost of
+rounding ground heights to the middle of their BIN_SIZE bin.
+
+Only wet cells (depth > 0) count, like in the full calculation."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import os
+
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import blocks
+from lizard_damage import raster
+from lizard_damage import utils
+
+# Height bins in m
+BIN_SIZE = 0.01
+
+# Roads that are flooded over at least this area get indirect damage
+ROAD_FLOODED_THRESHOLD = 100  # m2
+
+
+def region_mask_dataset(dataset):
+    """Return a byte MEM dataset that is 1 where dataset has data and
+    0 (nodata) elsewhere."""
+    band = dataset.GetRasterBand(1)
+    data = band.ReadAsArray()
+    nodatavalue = band.GetNoDataValue()
+    mask = np.ones(data.shape, dtype=np.uint8)
+    if nodatavalue is not None:
+        mask[data == nodatavalue] = 0
+    if data.dtype.kind == 'f':
+        mask[np.isnan(data)] = 0
+
+    result = blocks.empty_like(dataset, gdal.GDT_Byte, nodatavalue=0)
+    result.GetRasterBand(1).WriteArray(mask)
+    return result
+
+
+def warp_mask(ds_mask, ds_match):
+    """Return boolean array on the grid of ds_match, True where
+    ds_mask (made by region_mask_dataset) is 1."""
+    ds_dest = blocks.empty_like(ds_match, gdal.GDT_Byte, nodatavalue=0)
+    gdal.ReprojectImage(
+        ds_mask, ds_dest, ds_mask.GetProjection(),
+        ds_dest.GetProjection(), gdal.GRA_NearestNeighbour)
+    return ds_dest.GetRasterBand(1).ReadAsArray() == 1
+
+
+def _bins(heights):
+    return np.floor(heights / BIN_SIZE).astype(np.int64)
+
+
+def _accumulate(target, keys, bins, area_per_pixel):
+    """Add area_per_pixel for every (key, bin) pair to target, a dict
+    of (key, bin) -> area."""
+    if not keys.size:
+        return
+    combined = (keys.astype(np.int64) << 32) + (bins + 2 ** 31)
+    uniques, inverse = np.unique(combined, return_inverse=True)
+    counts = np.bincount(inverse)
+    for value, count in zip(uniques, counts):
+        key = int(value >> 32)
+        height_bin = int((value & 0xFFFFFFFF) - 2 ** 31)
+        target[key, height_bin] += count * area_per_pixel
+
+
+class LevelHistogram(object):
+    def __init__(self):
+        # (landuse code, height bin) -> area in m2
+        self.landuse = collections.defaultdict(float)
+        # (road pk, height bin) -> area in m2
+        self.roads = collections.defaultdict(float)
+        # road pk -> landuse code of the road
+        self.road_codes = {}
+        self._arrays = None
+
+    def add(self, landuse, heights, mask, area_per_pixel):
+        """Add the cells of a leaf where mask is True. landuse is an
+        array of landuse codes, heights a masked array of heights."""
+        self._arrays = None
+        valid = mask & ~np.ma.getmaskarray(heights)
+        _accumulate(
+            self.landuse, landuse[valid], _bins(np.ma.getdata(heights)[valid]),
+            area_per_pixel)
+
+    def add_road(self, road_pk, code, road_mask, heights, mask,
+                 area_per_pixel):
+        self._arrays = None
+        valid = road_mask & mask & ~np.ma.getmaskarray(heights)
+        self.road_codes[road_pk] = code
+        _accumulate(
+            self.roads, np.zeros(valid.sum(), dtype=np.int64) + road_pk,
+            _bins(np.ma.getdata(heights)[valid]), area_per_pixel)
+
+    def arrays(self):
+        """Return a dict of arrays, for saving with np.savez."""
+        if self._arrays is None:
+            self._arrays = self._make_arrays()
+        return self._arrays
+
+    def _make_arrays(self):
+        def split(histogram):
+            items = sorted(histogram.items())
+            return (
+                np.array([key for (key, _), _ in items], dtype=np.int64),
+                np.array([height_bin for (_, height_bin), _ in items],
+                         dtype=np.int64),
+                np.array([area for _, area in items], dtype=np.float64))
+
+        landuse_codes, landuse_bins, landuse_areas = split(self.landuse)
+        road_pks, road_bins, road_areas = split(self.roads)
+        return {
+            'landuse_codes': landuse_codes,
+            'landuse_bins': landuse_bins,
+            'landuse_areas': landuse_areas,
+            'road_pks': road_pks,
+            'road_bins': road_bins,
+            'road_areas': road_areas,
+            'road_code_pks': np.array(
+                sorted(self.road_codes), dtype=np.int64),
+            'road_code_codes': np.array(
+                [self.road_codes[pk] for pk in sorted(self.road_codes)],
+                dtype=np.int64),
+        }
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        histogram = cls()
+        with np.load(path) as data:
+            for code, height_bin, area in zip(
+                    data['landuse_codes'], data['landuse_bins'],
+                    data['landuse_areas']):
+                histogram.landuse[int(code), int(height_bin)] = area
+            for pk, height_bin, area in zip(
+                    data['road_pks'], data['road_bins'], data['road_areas']):
+                histogram.roads[int(pk), int(height_bin)] = area
+            histogram.road_codes = dict(
+                (int(pk), int(code)) for pk, code in zip(
+                    data['road_code_pks'], data['road_code_codes']))
+        return histogram
+
+    def damage(self, level, compiled_table, calc_type, month, floodtime,
+               repairtime_roads, repairtime_buildings, road_grid_codes):
+        """Return (damage, area) dicts per landuse code at a uniform
+        waterlevel, like the full calculation. compiled_table is a
+        damagetables.CompiledDamageTable, calc_type one of the values
+        of calculation.CALC_TYPES ('min', 'max' or 'avg')."""
+        arrays = self.arrays()
+        depths = level - (arrays['landuse_bins'] + 0.5) * BIN_SIZE
+        wet = depths > 0
+
+        codes = arrays['landuse_codes'][wet]
+        areas = arrays['landuse_areas'][wet]
+        damage = compiled_table.per_code(codes, compiled_table.cell_damage(
+            codes, depths[wet], areas, calc_type, month, floodtime,
+            repairtime_buildings, road_grid_codes))
+        area = compiled_table.per_code(codes, areas)
+
+        # Indirect damage of roads counts once per flooded road
+        road_depths = level - (arrays['road_bins'] + 0.5) * BIN_SIZE
+        flooded = collections.defaultdict(float)
+        for pk, road_area in zip(
+                arrays['road_pks'][road_depths > 0],
+                arrays['road_areas'][road_depths > 0]):
+            flooded[int(pk)] += road_area
+        for pk, flooded_m2 in flooded.items():
+            code = self.road_codes[pk]
+            if flooded_m2 >= ROAD_FLOODED_THRESHOLD and code in damage:
+                dr = compiled_table.table.data[code]
+                damage[code] += (
+                    dr.to_indirect_damage(calc_type) *
+                    dr.to_gamma_repairtime(repairtime_roads))
+
+        return damage, area
+
+
+def build(region_dataset, leaves, ahn_data_dir, lgn_data_dir, roads,
+          road_grid_codes, logger):
+    """Return the LevelHistogram of the region (cells where
+    region_dataset has data) on the given leaves. roads is the Roads
+    model, used to find the roads on each leaf."""
+    histogram = LevelHistogram()
+    ds_mask = region_mask_dataset(region_dataset)
+
+    for ahn_name, extent in leaves:
+        ds_height = gdal.Open(os.path.join(
+            ahn_data_dir, ahn_name[1:4], ahn_name + '.tif').encode('utf8'))
+        ds_landuse = gdal.Open(os.path.join(
+            lgn_data_dir, ahn_name[1:4], ahn_name + '.tif').encode('utf8'))
+        if ds_height is None or ds_landuse is None:
+            logger.warning('No height or landuse data for {}'.format(
+                ahn_name))
+            continue
+
+        mask = warp_mask(ds_mask, ds_height)
+        if not mask.any():
+            continue
+
+        if (ds_landuse.RasterXSize, ds_landuse.RasterYSize) != (
+                ds_height.RasterXSize, ds_height.RasterYSize):
+            ds_landuse = utils.reproject(ds_landuse, ds_height)
+
+        band = ds_height.GetRasterBand(1)
+        heights = np.ma.array(band.ReadAsArray())
+        if band.GetNoDataValue() is not None:
+            heights = np.ma.masked_equal(heights, band.GetNoDataValue())
+        landuse = ds_landuse.GetRasterBand(1).ReadAsArray().astype(np.int64)
+        geo = raster.get_geo(ds_height)
+        area_per_pixel = raster.geo2cellsize(geo)
+
+        histogram.add(landuse, heights, mask, area_per_pixel)
+        for code, gridcode in road_grid_codes.items():
+            for road in roads.get_by_geo(gridcode, geo, heights.shape):
+                road_mask = raster.get_mask([road], heights.shape, geo)
+                histogram.add_road(
+                    road.pk, code, road_mask.astype(bool), heights, mask,
+                    area_per_pixel)
+        logger.info('Histogram of leaf {} done'.format(ahn_name))
+
+    return histogram
@@ -5,13 +5,12 @@
 import logging
 import os
 
+from osgeo import gdal
 import numpy as np
 import xlrd
 
-from django.conf import settings
-
-from lizard_damage.models import Unit
-from lizard_damage_calculation import table
+from lizard_damage import blocks
+from lizard_damage import damagetables
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +24,12 @@ class TranslatorException(Exception):
 class LanduseTranslator(object):
     NODATA_VALUE = 255
 
+    # Largest range of values in column A we make a lookup table for
+    MAX_LUT_SIZE = 2 ** 16
+
+    # Translate the dataset in windows of at most this many cells
+    WINDOW_SIZE = blocks.WINDOW_SIZE
+
     def __init__(self, path):
         """Only sets path."""
         self.path = path
@@ -70,7 +75,87 @@ class LanduseTranslator(object):
                     .format(from_value))
             translate_dict[from_value] = to_value
 
+        if max(translate_dict) - min(translate_dict) >= self.MAX_LUT_SIZE:
+            raise TranslatorException(
+                "De waarden in kolom A mogen niet meer dan {} uit elkaar "
+                "liggen.".format(self.MAX_LUT_SIZE - 1))
+
         self.translate_dict = translate_dict
+        self._build_lut()
+
+    def _build_lut(self):
+        """Build the lookup table that translate_grid uses. Index i is
+        value i + self.offset in column A, the last two entries are for
+        unknown values and for nodata. self.known says which entries are
+        translatable. Both arrays are read only."""
+        self.offset = min(self.translate_dict)
+        self.unknown_index = max(self.translate_dict) - self.offset + 1
+        self.nodata_index = self.unknown_index + 1
+
+        if max(self.translate_dict.values()) <= np.iinfo(np.uint8).max:
+            self.dtype, self.gdal_type = np.uint8, gdal.GDT_Byte
+        else:
+            self.dtype, self.gdal_type = np.uint16, gdal.GDT_UInt16
+
+        lut = np.zeros(self.nodata_index + 1, dtype=self.dtype)
+        known = np.zeros(self.nodata_index + 1, dtype=np.bool)
+        for from_value, to_value in self.translate_dict.items():
+            lut[from_value - self.offset] = to_value
+            known[from_value - self.offset] = True
+        lut[self.nodata_index] = self.NODATA_VALUE
+        known[self.nodata_index] = True
+
+        lut.setflags(write=False)
+        known.setflags(write=False)
+        self.lut = lut
+        self.known = known
+
+    def check_damage_table(self):
+        """Check that all the values in column B are known in the
+        default damage table."""
+        damage_table = damagetables.read(damagetables.default_path())
+
+        codes = set(damage_table.data)
+        for value in sorted(self.translate_dict.values()):
+            if value not in codes:
+                raise TranslatorException(
+                    "De vertaaltabel heeft waarde {} in kolom B, "
+                    "maar die waarde komt niet voor de in de schadetabel."
+                    .format(value))
+
+    def translate_grid(self, grid, nodatavalue=None):
+        """Return grid with its values translated so that they are
+        known, and nodatavalue translated to NODATA_VALUE. Raises
+        TranslatorException if the grid has a value that isn't in the
+        translation table."""
+        index = grid.astype(np.int64)
+        index -= self.offset
+        index[(index < 0) | (index >= self.unknown_index)] = (
+            self.unknown_index)
+        if nodatavalue is not None:
+            index[grid == nodatavalue] = self.nodata_index
+
+        unknown = ~np.take(self.known, index)
+        if unknown.any():
+            raise TranslatorException(
+                "De vertaaltabel bevat geen waarde voor '{}'. "
+                "Die waarde komt wel voor op de landgebruikskaart."
+                .format(np.unique(grid[unknown])[0]))
+
+        return np.take(self.lut, index)
+
+    def _translated_windows(self, dataset):
+        """Yield (xoff, yoff, translated grid) per window of the
+        dataset's first band."""
+        if not dataset:
+            # Shouldn't happen, checked before calling this.
+            raise TranslatorException(
+                "De landgebruiksdata is niet beschikbaar.")
+
+        band = dataset.GetRasterBand(1)
+        nodatavalue = band.GetNoDataValue()
+        for xoff, yoff, grid in blocks.read_windows(band, self.WINDOW_SIZE):
+            yield xoff, yoff, self.translate_grid(grid, nodatavalue)
 
     def check_with_dataset(self, dataset):
         """Checks the Excel file in combination with a dataset.
@@ -85,71 +170,30 @@ class LanduseTranslator(object):
             # Something else failed before now.
             return
 
-        if not dataset:
-            # Shouldn't happen, checked before calling this.
-            raise TranslatorException(
-                "De landgebruiksdata is niet beschikbaar.")
+        self.check_damage_table()
+        for window in self._translated_windows(dataset):
+            pass
 
-        band = dataset.GetRasterBand(1)
-
-        # self.nodatavalue is used while translating
-        self.nodatavalue = int(band.GetNoDataValue())
-
-        grid = band.ReadAsArray()
+    def translate_dataset(self, dataset, path):
+        """Check the dataset like check_with_dataset, and write the
+        translated dataset as a GeoTIFF at path, in a single pass over
+        the dataset. If the check fails, nothing is left at path."""
+        self.check_damage_table()
 
-        uniques = np.unique(grid)
+        target = gdal.GetDriverByName(b'GTiff').Create(
+            str(path), dataset.RasterXSize, dataset.RasterYSize, 1,
+            self.gdal_type, [b'TILED=YES', b'COMPRESS=DEFLATE'])
+        target.SetProjection(dataset.GetProjection())
+        target.SetGeoTransform(dataset.GetGeoTransform())
+        band = target.GetRasterBand(1)
+        band.SetNoDataValue(self.NODATA_VALUE)
 
-        for value in uniques:
-            if value == self.nodatavalue:
-                continue
-            if int(value) not in self.translate_dict:
-                raise TranslatorException(
-                    "De vertaaltabel bevat geen waarde voor '{}'. "
-                    "Die waarde komt wel voor op de landgebruikskaart."
-                    .format(value))
-
-        # Check if all values are in the default damage table
-        default_damage_table_path = os.path.join(settings.BUILDOUT_DIR,
-                                                 table.DEFAULT_DAMAGE_TABLE)
-        damage_table = table.DamageTable.read_cfg(
-            open(default_damage_table_path), units=Unit.objects.all()
-        )
-
-        codes = set(damage_table.data)
-        for value in sorted(self.translate_dict.values()):
-            if value not in codes:
-                raise TranslatorException(
-                    "De vertaaltabel heeft waarde {} in kolom B, "
-                    "maar die waarde komt niet voor de in de schadetabel."
-                    .format(value))
+        try:
+            for xoff, yoff, grid in self._translated_windows(dataset):
+                band.WriteArray(grid, xoff, yoff)
+        except TranslatorException:
+            band = target = None
+            os.remove(path)
+            raise
+        band = target = None
 
-    def translate_grid(self, grid):
-        """Translates the values in grid so that they are known."""
-        grid = grid.astype(np.int)
-
-        # Build a numpy translation array
-        maxvalue = max(self.translate_dict)
-
-        if self.nodatavalue is not None:
-            # Set all points where the grid is nodata
-            # to the first unused value; then put that in
-            # the translate dict, so that it will be
-            # translated to our NODATA. The reason is
-            # that the numpy magic we use below doesn't
-            # work with negative numbers.
-            grid[grid == self.nodatavalue] = maxvalue + 1
-            self.translate_dict[maxvalue + 1] = self.NODATA_VALUE
-
-            # Increment maxvalue because the max value is
-            # higher now.
-            maxvalue += 1
-
-        translation = np.array([
-            # Translate each index to its to_value from
-            # the translate dict, or 0 if it's not
-            # in there (shouldn't happen).
-            self.translate_dict.get(i, 0)
-            for i in range(maxvalue + 1)])
-
-        # Numpy magic
-        return translation[grid]
@@ -0,0 +1,156 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""An in-memory spatial index of the available AHN and LGN tiles.
+
+Checking whether the tiles for an area exist used to mean a stat call
+per tile on the (NFS mounted) data directory. Instead, the
+damage_leaf_manifest management command writes a manifest with the
+extent of every tile in a data directory, and each process loads that
+once into a LeafIndex: a grid hash that answers 'which tiles intersect
+this extent' and 'which of these tiles are missing' without touching
+the filesystem. The manifest is reloaded when it is regenerated. If
+there is no manifest, get_index() returns None and callers fall back to
+looking at the files."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import json
+import math
+import os
+
+from . import tiles
+from .conf import settings
+
+MANIFEST_FILENAME = 'leaves.json'
+
+# Size of the grid hash cells in meters, a few tiles wide
+CELL_SIZE = 5000.0
+
+DATADIRS = ('data_ahn2', 'data_ahn3', 'data_lgn')
+
+
+def manifest_path(datadir):
+    return os.path.join(
+        settings.LIZARD_DAMAGE_DATA_ROOT, datadir, MANIFEST_FILENAME)
+
+
+def tile_extent(dataset):
+    """Return (minx, miny, maxx, maxy) of a dataset."""
+    x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+    x1 = x0 + dataset.RasterXSize * dx
+    y1 = y0 + dataset.RasterYSize * dy
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def build_manifest(datadir):
+    """Write the manifest of all tiles in datadir. Returns the number
+    of tiles in it."""
+    leaves = {}
+    for ahn_name in tiles.get_tile_names(datadir):
+        dataset = tiles.get_tile_dataset(datadir, ahn_name)
+        if dataset is not None:
+            leaves[ahn_name] = tile_extent(dataset)
+
+    path = manifest_path(datadir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'leaves': leaves}, f)
+    os.rename(tmp_path, path)
+    return len(leaves)
+
+
+class LeafIndex(object):
+    def __init__(self, leaves, cell_size=CELL_SIZE):
+        """leaves is a dict of tile name to (minx, miny, maxx, maxy)."""
+        self.leaves = leaves
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(list)
+        for name, extent in leaves.items():
+            for cell in self._cells(extent):
+                self.cells[cell].append(name)
+
+    @classmethod
+    def from_manifest(cls, path):
+        with open(path) as f:
+            leaves = json.load(f)['leaves']
+        return cls(dict(
+            (name, tuple(extent)) for name, extent in leaves.items()))
+
+    def _cells(self, extent):
+        minx, miny, maxx, maxy = extent
+        for i in range(int(math.floor(minx / self.cell_size)),
+                       int(math.floor(maxx / self.cell_size)) + 1):
+            for j in range(int(math.floor(miny / self.cell_size)),
+                           int(math.floor(maxy / self.cell_size)) + 1):
+                yield i, j
+
+    def __contains__(self, name):
+        return name in self.leaves
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def intersecting(self, extent):
+        """Return the sorted names of the tiles that intersect extent,
+        (minx, miny, maxx, maxy)."""
+        minx, miny, maxx, maxy = extent
+        names = set()
+        for cell in self._cells(extent):
+            for name in self.cells.get(cell, ()):
+                leaf_minx, leaf_miny, leaf_maxx, leaf_maxy = self.leaves[name]
+                if (leaf_minx < maxx and minx < leaf_maxx and
+                        leaf_miny < maxy and miny < leaf_maxy):
+                    names.add(name)
+        return sorted(names)
+
+    def missing(self, names):
+        """Return the names that aren't in the index, in order."""
+        return [name for name in names if name not in self.leaves]
+
+
+# manifest path: (manifest mtime, LeafIndex)
+_indexes = {}
+
+
+def get_index(datadir):
+    """Return the LeafIndex of datadir, or None if it has no manifest."""
+    path = manifest_path(datadir)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _indexes.get(path)
+    if cached is None or cached[0] != mtime:
+        _indexes[path] = (mtime, LeafIndex.from_manifest(path))
+    return _indexes[path][1]
+
+
+def data_version(datadir):
+    """Return something that changes when the tiles of datadir are
+    updated, for dedup.py: the mtime of its manifest, which is
+    regenerated after an update, or else that of the directory itself.
+    None if neither exists."""
+    for path in (manifest_path(datadir), os.path.dirname(
+            manifest_path(datadir))):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            continue
+    return None
+
+
+def missing_tiles(datadir, ahn_names):
+    """Return the names of the tiles of ahn_names that aren't in
+    datadir. Uses the index if there is one, otherwise the files."""
+    index = get_index(datadir)
+    if index is not None:
+        return index.missing(ahn_names)
+    return [ahn_name for ahn_name in ahn_names
+            if not os.path.isfile(tiles.get_tile_filename(datadir, ahn_name))]
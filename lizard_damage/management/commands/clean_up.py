@@ -9,6 +9,7 @@ from __future__ import (
 from django.core.management.base import BaseCommand
 
 from lizard_damage.models import DamageScenario
+from lizard_damage.models import GeoImage
 from lizard_task.models import SecuredPeriodicTask
 
 import logging
@@ -36,4 +37,8 @@ class Command(BaseCommand):
 
             damage_scenario.delete()
 
+        logger.info("Removing GeoImages whose image file is gone...")
+        removed = GeoImage.objects.reconcile()
+        logger.info("Removed %d GeoImages." % removed)
+
         logger.info("Finished.")
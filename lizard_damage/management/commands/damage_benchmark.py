@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+from __future__ import (
+    print_function,
+    unicode_literals,
+    absolute_import,
+    division,
+)
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from lizard_damage import benchmark
+
+import json
+import logging
+import optparse
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            '-s', '--scale',
+            action='append',
+            dest='scales',
+            default=[],
+            help='Area of the synthetic polder in km2, one of {}. '
+            'Can be given more than once. Default: all of them.'.format(
+                ', '.join(benchmark.SCALES))),
+        optparse.make_option(
+            '-a', '--ahn-version',
+            dest='ahn_version',
+            default='2',
+            help='AHN version to benchmark (default: 2)'),
+        optparse.make_option(
+            '--seed',
+            dest='seed',
+            type='int',
+            default=0,
+            help='Seed for the random landuse (default: 0)'),
+        optparse.make_option(
+            '-o', '--output',
+            dest='output',
+            default=None,
+            help='Write the JSON results to this file instead of stdout'),
+        optparse.make_option(
+            '-k', '--keep-data',
+            action='store_true',
+            dest='keep_data',
+            default=False,
+            help='Keep the generated synthetic data'),
+    )
+    help = ('Time the stages of the damage pipeline on synthetic polders, '
+            'and output the results as JSON.')
+
+    def handle(self, *args, **options):
+        scales = options['scales'] or list(benchmark.SCALES)
+        for scale in scales:
+            if scale not in benchmark.SCALES:
+                raise CommandError("Unknown scale {}.".format(scale))
+
+        result = []
+        for scale in scales:
+            logger.info("Benchmarking {} km2...".format(scale))
+            result.append(benchmark.run(
+                scale, ahn_version=options['ahn_version'],
+                seed=options['seed'], keep_data=options['keep_data']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(result, output, indent=2)
+        else:
+            json.dump(result, sys.stdout, indent=2)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+from __future__ import (
+    print_function,
+    unicode_literals,
+    absolute_import,
+    division,
+)
+
+from django.core.management.base import BaseCommand
+
+from lizard_damage import leafindex
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = '[datadir ...]'
+    help = ('Write the manifest of the tiles in the data directories '
+            '(default: {}) that the tile index is loaded from. Run it '
+            'again after tiles are added or removed.'.format(
+                ', '.join(leafindex.DATADIRS)))
+
+    def handle(self, *args, **options):
+        for datadir in args or leafindex.DATADIRS:
+            count = leafindex.build_manifest(datadir)
+            logger.info("{}: {} tiles".format(datadir, count))
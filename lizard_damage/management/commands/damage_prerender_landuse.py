@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+from __future__ import (
+    print_function,
+    unicode_literals,
+    absolute_import,
+    division,
+)
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from lizard_damage import calc
+from lizard_damage import tiles
+from lizard_damage.models import GeoImage
+
+import logging
+import multiprocessing
+import optparse
+
+logger = logging.getLogger(__name__)
+
+
+def prerender_tile(ahn_name, overview_levels, force=False):
+    """Make the landuse GeoImages of one LGN tile, at overview levels
+    0 up to and including overview_levels. Returns the number of
+    images made."""
+    slugs = [calc.slug_for_landuse(ahn_name, level)
+             for level in range(overview_levels + 1)]
+    if force:
+        GeoImage.objects.filter(slug__in=slugs).delete_with_files()
+        existing = {}
+    else:
+        existing = GeoImage.objects.existing(slugs)
+
+    todo = [(level, slug) for (level, slug) in enumerate(slugs)
+            if slug not in existing]
+    if not todo:
+        return 0
+
+    dataset = tiles.get_lgn_dataset(ahn_name, logger)
+    if dataset is None:
+        return 0
+
+    for level, slug in todo:
+        GeoImage.from_landuse_dataset(dataset, slug, overview_level=level)
+    return len(todo)
+
+
+def _prerender_tile(args):
+    # Pool.imap_unordered passes a single argument
+    ahn_name, overview_levels, force = args
+    try:
+        return ahn_name, prerender_tile(ahn_name, overview_levels, force)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            '-l', '--levels',
+            dest='levels',
+            type='int',
+            default=3,
+            help='Number of overview levels besides full resolution; '
+            'level n is at 1 / 2 ** n of the resolution (default: 3)'),
+        optparse.make_option(
+            '-p', '--processes',
+            dest='processes',
+            type='int',
+            default=None,
+            help='Number of worker processes (default: number of CPUs)'),
+        optparse.make_option(
+            '-f', '--force',
+            action='store_true',
+            dest='force',
+            default=False,
+            help='Render images again even if they exist'),
+    )
+    args = '[ahn_name ...]'
+    help = ('Render the landuse images of LGN tiles (default: all of them) '
+            'in advance, with overview levels, so that calculations and '
+            'KMLs do not have to wait for them.')
+
+    def handle(self, *args, **options):
+        ahn_names = list(args) or tiles.get_tile_names('data_lgn')
+        logger.info("Rendering landuse images for {} tiles...".format(
+            len(ahn_names)))
+
+        # Worker processes must not share the parent's connection
+        connection.close()
+
+        pool = multiprocessing.Pool(processes=options['processes'])
+        try:
+            made = 0
+            for ahn_name, count in pool.imap_unordered(
+                    _prerender_tile,
+                    [(ahn_name, options['levels'], options['force'])
+                     for ahn_name in ahn_names]):
+                logger.debug("{}: {} images".format(ahn_name, count))
+                made += count
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        logger.info("Finished, made {} images.".format(made))
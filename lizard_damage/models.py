@@ -23,21 +23,34 @@ import zipfile
 from PIL import Image
 from osgeo import gdal
 from pyproj import Proj
-import matplotlib as mpl
 import numpy as np
 
 from django.contrib.gis.db import models
 from django.core.urlresolvers import reverse
 from django.core.files import File
 from django.core.files.uploadedfile import UploadedFile
-
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+from lizard_damage import chunks
+from lizard_damage import colormaps
+from lizard_damage import costs
+from lizard_damage import culling
+from lizard_damage import damagetables
+from lizard_damage import dedup
+from lizard_damage import histograms
+from lizard_damage import leafindex
+from lizard_damage import profiling
 from lizard_damage import raster
 from lizard_damage import results
+from lizard_damage import tiles
 from lizard_damage import tools
 from lizard_damage import utils
 from lizard_damage.conf import settings
 from lizard_damage_calculation import calculation
-from lizard_damage_calculation import table
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +66,20 @@ RD = str(
 WGS84 = str('+proj=latlong +datum=WGS84')
 UNIFORM_LEVELS_FILENAME = 'uniform-levels.csv'
 # ^^^ Sync with damage_scenario_result.html
+UNIFORM_LEVELS_HISTOGRAM_FILENAME = 'uniform-levels-histogram.npz'
+
+# Custom rasters warped onto the AHN/LGN tiles, and the file that marks
+# that that is finished
+CUSTOM_DATA_DIRNAME = 'custom_data'
+CUSTOM_DATA_READY = 'ready'
+
+# First timestep with water and number of timesteps with water of a
+# time series, see envelope.py
+INUNDATION_FILENAME = 'inundatie.tif'
+
+# Largest number of cells of a landuse image; larger landuse rasters
+# (like an uploaded custom landuse) are rendered at an overview level
+MAX_LANDUSE_IMAGE_CELLS = 4096 * 4096
 
 rd_proj = Proj(RD)
 wgs84_proj = Proj(WGS84)
@@ -105,6 +132,29 @@ def friendly_filesize(size):
     return str(size)
 
 
+def scenario_workdir_path(scenario_id):
+    """Path of the workdir of the DamageScenario with this id. Doesn't
+    create it, see DamageScenario.workdir for that."""
+    return os.path.join(
+        settings.MEDIA_ROOT, 'damagescenario', str(scenario_id))
+
+
+def event_workdir_path(scenario_id, event_id):
+    """Path of the workdir of a DamageEvent, like scenario_workdir_path."""
+    return os.path.join(
+        scenario_workdir_path(scenario_id), 'damage_events', str(event_id))
+
+
+def remove_files(paths):
+    """Remove the files at paths, ignoring those that are already
+    gone."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 def copy(uploadedfile, targetdir):
     """Copy the file given by uploadedfile to targetdir, with the same name.
     Creates targetdir and parent dirs if they don't already exist.
@@ -212,6 +262,11 @@ class Unit(models.Model):
                 name=unit.name, factor=unit.factor)
 
 
+# Parsed damage tables depend on the units
+post_save.connect(damagetables.clear, sender=Unit)
+post_delete.connect(damagetables.clear, sender=Unit)
+
+
 class DamageScenario(models.Model):
     """
     Has all information to calculate damage for one waterlevel grid.
@@ -235,13 +290,24 @@ class DamageScenario(models.Model):
     CALC_TYPE_MIN = 1
     CALC_TYPE_MAX = 2
     CALC_TYPE_AVG = 3
+    # Average as the main result, minimum and maximum next to it
+    CALC_TYPE_ALL = 4
 
     CALC_TYPE_CHOICES = (
         (CALC_TYPE_MIN, 'Minimale schadebedragen en schadefuncties'),
         (CALC_TYPE_MAX, 'Maximale schadebedragen en schadefuncties'),
         (CALC_TYPE_AVG, 'Gemiddelde schadebedragen en schadefuncties'),
+        (CALC_TYPE_ALL, 'Gemiddelde, minimale en maximale schadebedragen '
+         'en schadefuncties'),
         )
 
+    # Names of the extra results of CALC_TYPE_ALL, in zip members
+    # (schade_<name>_<tile>) and table columns (damage_<name>)
+    EXTRA_CALC_TYPES = (
+        ('min', CALC_TYPE_MIN),
+        ('max', CALC_TYPE_MAX),
+    )
+
     AHN2 = "2"
     AHN3 = "3"
 
@@ -296,16 +362,29 @@ class DamageScenario(models.Model):
         'wordt de default gebruikt')
     customlandusegeoimage = models.ForeignKey(
         'GeoImage', null=True, blank=True)
+    uniform_levels_region = models.FilePathField(
+        max_length=200, null=True, blank=True,
+        help_text='Scenario type 7: raster with the area to calculate')
+    uniform_levels = models.TextField(
+        null=True, blank=True,
+        help_text='Scenario type 7: JSON with the levels and event '
+        'parameters, and after calculation the damage per level')
+    estimated_cost = models.FloatField(
+        null=True, blank=True,
+        help_text='Estimated calculation time in seconds, see costs.py')
 
     @classmethod
     def setup(
             cls, name, email, scenario_type, calc_type, ahn_version,
-            customheights, customlanduse, damagetable, damage_events):
+            customheights, customlanduse, damagetable, damage_events,
+            uniform_levels=None, uniform_levels_region=None):
         """Create and setup a DamageScenario. Handles all types."""
 
         scenario = cls.objects.create(
             name=name, email=email, scenario_type=scenario_type,
             calc_type=calc_type, ahn_version=ahn_version)
+        if uniform_levels is not None:
+            scenario.parsed_uniform_levels = uniform_levels
 
         files_to_move = dict()
         if customheights:
@@ -314,6 +393,8 @@ class DamageScenario(models.Model):
             files_to_move['customlanduse'] = customlanduse
         if damagetable:
             files_to_move['damagetable_file'] = damagetable
+        if uniform_levels_region:
+            files_to_move['uniform_levels_region'] = uniform_levels_region
 
         scenario.move_files(files_to_move)
         scenario.save()
@@ -321,6 +402,9 @@ class DamageScenario(models.Model):
         for damage_event_data in damage_events:
             DamageEvent.setup(scenario, **damage_event_data)
 
+        scenario.estimated_cost = costs.estimate(scenario, logger)
+        scenario.save()
+
         from lizard_damage import emails
         emails.send_taskrecieved_mail(scenario, logger)
 
@@ -342,8 +426,7 @@ class DamageScenario(models.Model):
         """The workdir must be located inside MEDIA_ROOT, because
         that's the directory that's mounted on both the webserver and
         the taskserver."""
-        workdir = os.path.join(
-            settings.MEDIA_ROOT, 'damagescenario', str(self.id))
+        workdir = scenario_workdir_path(self.id)
         if not os.path.isdir(workdir):
             os.makedirs(workdir)
         return workdir
@@ -359,16 +442,16 @@ class DamageScenario(models.Model):
         return "{}{}/{}".format(
             settings.MEDIA_URL, 'damagescenario', str(self.id))
 
+    @property
+    def damage_table_path(self):
+        return self.damagetable_file or damagetables.default_path()
+
     def read_damage_table(self):
         """Returns damage table from dt_path, or data/damagetable/dt.cfg
-        if not given."""
-
-        dt_path = self.damagetable_file or os.path.join(
-            settings.BUILDOUT_DIR, table.DEFAULT_DAMAGE_TABLE)
-
-        with open(dt_path) as cfg:
-            return dt_path, table.DamageTable.read_cfg(
-                cfg, units=Unit.objects.all())
+        if not given. The table is shared (see damagetables.py), so
+        don't change it."""
+        dt_path = self.damage_table_path
+        return dt_path, damagetables.read(dt_path)
 
     @property
     def display_status(self):
@@ -397,6 +480,95 @@ class DamageScenario(models.Model):
                 os.path.join(
                     settings.MEDIA_ROOT, self.customlanduse))
 
+    @property
+    def custom_data_dir(self):
+        """Directory with the custom heights and landuse, warped onto
+        the AHN and LGN tiles (see warp_custom_rasters)."""
+        return os.path.join(self.workdir, CUSTOM_DATA_DIRNAME)
+
+    def warp_custom_rasters(self, logger):
+        """Warp the custom heights and landuse once onto every AHN/LGN
+        tile that one of the events needs. The events then read those
+        tiles like the standard ones, instead of warping the whole
+        custom raster again for every tile of every event."""
+        if not (self.customheights or self.customlanduse):
+            return
+
+        paths = [
+            dewl.waterlevel_path
+            for damage_event in self.damageevent_set.all()
+            for dewl in damage_event.damageeventwaterlevel_set.all()]
+        if self.uniform_levels_region:
+            paths.append(self.uniform_levels_region)
+
+        ahn_names = set()
+        for path in paths:
+            ahn_names.update(
+                leaf[0] for leaf in calculation._get_ahn_leaves(
+                    gdal_open(path), logger))
+
+        for datadir, dataset in (
+                ('data_ahn' + self.ahn_version,
+                 self.alternative_heights_dataset),
+                ('data_lgn', self.alternative_landuse_dataset)):
+            if dataset is None:
+                continue
+            written = tiles.warp_to_tiles(
+                dataset, datadir, ahn_names,
+                os.path.join(self.custom_data_dir, datadir), logger=logger)
+            logger.info("Warped custom raster onto {} {} tiles".format(
+                written, datadir))
+
+        if not os.path.isdir(self.custom_data_dir):
+            os.makedirs(self.custom_data_dir)
+        ready = os.path.join(self.custom_data_dir, CUSTOM_DATA_READY)
+        with open(ready, 'w'):
+            pass
+
+    @property
+    def calculator_calc_type(self):
+        """calc_type for the DamageCalculator; with CALC_TYPE_ALL it
+        calculates the average, the others are extra_calc_types."""
+        if self.calc_type == self.CALC_TYPE_ALL:
+            return self.CALC_TYPE_AVG
+        return self.calc_type or calculation.CALC_TYPE_MAX
+
+    @property
+    def extra_calc_types(self):
+        """(name, calc_type) pairs calculated next to the main one, in
+        the same pass over the tiles."""
+        if self.calc_type == self.CALC_TYPE_ALL:
+            return self.EXTRA_CALC_TYPES
+        return ()
+
+    def calculator_data(self):
+        """Return keyword arguments for DamageCalculator with the
+        height and landuse sources. If the custom rasters have been
+        warped onto the tiles already, the tiles are used instead of
+        the custom rasters."""
+        data = {
+            'ahn_data_dir': os.path.join(
+                settings.LIZARD_DAMAGE_DATA_ROOT,
+                'data_ahn' + self.ahn_version),
+            'lgn_data_dir': os.path.join(
+                settings.LIZARD_DAMAGE_DATA_ROOT, 'data_lgn'),
+            'alternative_heights_dataset': self.alternative_heights_dataset,
+            'alternative_landuse_dataset': self.alternative_landuse_dataset,
+        }
+        if not os.path.exists(
+                os.path.join(self.custom_data_dir, CUSTOM_DATA_READY)):
+            return data
+
+        if self.customheights:
+            data['ahn_data_dir'] = os.path.join(
+                self.custom_data_dir, 'data_ahn' + self.ahn_version)
+            data['alternative_heights_dataset'] = None
+        if self.customlanduse:
+            data['lgn_data_dir'] = os.path.join(
+                self.custom_data_dir, 'data_lgn')
+            data['alternative_landuse_dataset'] = None
+        return data
+
     def move_files(self, file_dict):
         """file_dict has keys like 'customheights', and paths to
         these files as values. The files are moved to
@@ -425,7 +597,64 @@ class DamageScenario(models.Model):
         # Return a comma-separated list of a single slug, aka the slug itself
         return self.customlandusegeoimage.slug
 
+    @property
+    def parsed_uniform_levels(self):
+        if self.uniform_levels:
+            return json.loads(self.uniform_levels)
+
+    @parsed_uniform_levels.setter
+    def parsed_uniform_levels(self, value):
+        self.uniform_levels = json.dumps(value)
+
+    @property
+    def uniform_levels_histogram_path(self):
+        return os.path.join(self.workdir, UNIFORM_LEVELS_HISTOGRAM_FILENAME)
+
+    def uniform_levels_histogram(self, logger):
+        """Return the histograms.LevelHistogram of the region of this
+        type 7 scenario. It is made once and then kept in the workdir."""
+        path = self.uniform_levels_histogram_path
+        if os.path.exists(path):
+            return histograms.LevelHistogram.load(path)
+
+        region = gdal_open(self.uniform_levels_region)
+        data = self.calculator_data()
+        histogram = histograms.build(
+            region, calculation._get_ahn_leaves(region, logger),
+            data['ahn_data_dir'], data['lgn_data_dir'], Roads,
+            Roads.ROAD_GRIDCODE, logger)
+        histogram.save(path)
+        return histogram
+
+    def calculate_uniform_levels(self, logger):
+        """Calculate the total damage of every level of this type 7
+        scenario from the histograms of its region, and save it in
+        uniform_levels."""
+        uniform_levels = self.parsed_uniform_levels
+        compiled_table = damagetables.compiled(self.damage_table_path)
+        calc_type = calculation.CALC_TYPES[self.calculator_calc_type]
+        histogram = self.uniform_levels_histogram(logger)
+
+        uniform_levels['damage'] = []
+        for level in uniform_levels['levels']:
+            damage, area = histogram.damage(
+                level, compiled_table, calc_type,
+                month=uniform_levels['floodmonth'],
+                floodtime=uniform_levels['floodtime'],
+                repairtime_roads=uniform_levels['repairtime_roads'],
+                repairtime_buildings=uniform_levels['repairtime_buildings'],
+                road_grid_codes=Roads.ROAD_GRIDCODE)
+            uniform_levels['damage'].append(sum(damage.values()))
+        self.parsed_uniform_levels = uniform_levels
+        self.save()
+
     def table_for_uniform_levels_batch(self):
+        uniform_levels = self.parsed_uniform_levels
+        if uniform_levels and 'damage' in uniform_levels:
+            return [{'height': height, 'damage': damage}
+                    for height, damage in sorted(zip(
+                        uniform_levels['levels'], uniform_levels['damage']))]
+
         damage_events = self.damageevent_set.all()
         damage_per_height = {}
         for damage_event in damage_events:
@@ -450,33 +679,52 @@ class DamageScenario(models.Model):
                   for height in heights]
         return result
 
-    def calculate(self, logger):
+    def calculate(self, logger, first_event=0, errors=0, start_dt=None):
         """
         Calculate this DamageScenario. Called from task.
+
+        If an event is distributed over several workers, this returns
+        as soon as that has started, and it is called again by the task
+        that finishes that event, with the index of the next event,
+        the number of errors so far and the original start time. The
+        events are ordered by primary key, so that the index means the
+        same in that other task.
         """
-        start_dt = datetime.datetime.now()
-        logger.info("calculate damage")
+        # Use local imports while we are refactoring
+        from lizard_damage import risk
+        from lizard_damage import emails
 
-        logger.info("scenario: %d, %s" % (self.id, str(self)))
-        logger.info("calculating...")
+        if first_event == 0:
+            start_dt = datetime.datetime.now()
+            logger.info("calculate damage")
 
-        logger.info("scenario %s" % (self.name))
+            logger.info("scenario: %d, %s" % (self.id, str(self)))
+            logger.info("calculating...")
 
-        self.status = self.SCENARIO_STATUS_INPROGRESS
-        self.save()
+            logger.info("scenario %s" % (self.name))
 
-        errors = 0
+            self.status = self.SCENARIO_STATUS_INPROGRESS
+            self.save()
 
-        # Use local imports while we are refactoring
-        from lizard_damage import risk
-        from lizard_damage import emails
+            emails.send_start_mail(self, logger, start_dt)
 
-        emails.send_start_mail(self, logger, start_dt)
+            self.warp_custom_rasters(logger)
 
         all_riskmap_data = []
 
         for damage_event_index, damage_event in enumerate(
-                self.damageevent_set.all()):
+                self.damageevent_set.order_by('pk')):
+            if damage_event_index < first_event:
+                continue
+            if damage_event.distribute():
+                from lizard_damage import distributed
+                if distributed.start(
+                        damage_event, damage_event_index, errors, start_dt,
+                        logger):
+                    # The task that finishes it continues from there
+                    return
+                # The results of an identical event were reused
+                continue
             result, riskmap_data = damage_event.calculate(logger)
             if result:
                 all_riskmap_data += riskmap_data
@@ -489,6 +737,8 @@ class DamageScenario(models.Model):
 
         # Calculate csv for uniform levels batch
         if self.scenario_type == 7:
+            if self.uniform_levels and self.uniform_levels_region:
+                self.calculate_uniform_levels(logger)
             filename = os.path.join(self.workdir, UNIFORM_LEVELS_FILENAME)
             with open(filename, 'w') as resultfile:
                 resultfile.write("Waterniveau,schade\n")
@@ -508,6 +758,21 @@ class DamageScenario(models.Model):
             logger.info("finished with errors")
 
 
+class LeafSkippingDamageCalculator(calculation.DamageCalculator):
+    """DamageCalculator that leaves out the leaves named in
+    skip_leaves, for instance because they are dry, and if only_leaves
+    is set, all leaves not named there (see chunks.py)."""
+    skip_leaves = frozenset()
+    only_leaves = None
+
+    def get_ahn_leaves(self):
+        return [
+            leaf for leaf in
+            super(LeafSkippingDamageCalculator, self).get_ahn_leaves()
+            if leaf[0] not in self.skip_leaves and
+            (self.only_leaves is None or leaf[0] in self.only_leaves)]
+
+
 class DamageEvent(models.Model):
     """
     Has all information to calculate damage for one waterlevel grid.
@@ -540,21 +805,33 @@ class DamageEvent(models.Model):
     repairtime_buildings = models.FloatField(
         help_text='In seconds', default=5 * 3600 * 24)
     floodmonth = models.IntegerField(default=9)
+    floodmonths = models.TextField(
+        null=True, blank=True,
+        help_text='other months to calculate damage tables for, '
+        'in json format')
 
     repetition_time = models.FloatField(blank=True, null=True,
                                         help_text='In years!')
 
     # Result
     table = models.TextField(null=True, blank=True, help_text='in json format')
+    month_tables = models.TextField(
+        null=True, blank=True,
+        help_text='tables per month of floodmonth and floodmonths, '
+        'in json format')
 
     # Used for the legend
     min_height = models.FloatField(null=True, blank=True)
     max_height = models.FloatField(null=True, blank=True)
 
+    # Set after a successful calculation, see dedup.py
+    content_hash = models.CharField(
+        max_length=64, null=True, blank=True, db_index=True)
+
     @classmethod
     def setup(cls, scenario, floodtime_hours, repairtime_roads_days,
               repairtime_buildings_days, floodmonth, repetition_time,
-              waterlevels, name=None):
+              waterlevels, name=None, floodmonths=None):
         damage_event = cls.objects.create(
             scenario=scenario,
             floodtime=float(floodtime_hours) * 3600,
@@ -562,6 +839,10 @@ class DamageEvent(models.Model):
             repairtime_buildings=float(repairtime_buildings_days) * 3600 * 24,
             floodmonth=floodmonth)
 
+        if floodmonths:
+            damage_event.parsed_floodmonths = floodmonths
+            damage_event.save()
+
         if repetition_time is not None:
             damage_event.repetition_time = float(repetition_time)
             damage_event.save()
@@ -584,8 +865,7 @@ class DamageEvent(models.Model):
         """The workdir is below this scenario's workdir, and has
         the DamageEvent's primary key in its name. So this doesn't
         work on unsaved DamageEvents."""
-        workdir = os.path.join(
-            self.scenario.workdir, 'damage_events', str(self.id))
+        workdir = event_workdir_path(self.scenario_id, self.id)
         if not os.path.isdir(workdir):
             os.makedirs(workdir)
         return workdir
@@ -609,6 +889,18 @@ class DamageEvent(models.Model):
         """Path to result zipfile."""
         return os.path.join(self.workdir, results.ZIP_FILENAME)
 
+    @property
+    def cog(self):
+        """Path to the damage map as a single COG, if it was made."""
+        return os.path.join(self.workdir, results.COG_FILENAME)
+
+    @property
+    def cog_url(self):
+        if os.path.exists(self.cog):
+            return '/'.join((self.directory_url, results.COG_FILENAME))
+        else:
+            return None
+
     @property
     def result_display(self):
         """display name of result"""
@@ -628,6 +920,36 @@ class DamageEvent(models.Model):
     def parsed_table(self, value):
         self.table = json.dumps(value)
 
+    @property
+    def parsed_floodmonths(self):
+        return json.loads(self.floodmonths) if self.floodmonths else []
+
+    @parsed_floodmonths.setter
+    def parsed_floodmonths(self, value):
+        self.floodmonths = json.dumps(sorted(set(int(m) for m in value)))
+
+    @property
+    def extra_floodmonths(self):
+        """Months other than floodmonth to calculate tables for."""
+        return [month for month in self.parsed_floodmonths
+                if month != int(self.floodmonth)]
+
+    @property
+    def parsed_month_tables(self):
+        """Dict of month (a string, as it is json) to table."""
+        return json.loads(self.month_tables) if self.month_tables else {}
+
+    @parsed_month_tables.setter
+    def parsed_month_tables(self, value):
+        self.month_tables = json.dumps(value)
+
+    def month_totals(self):
+        """Return (month, total damage) pairs, for the interface."""
+        return [(int(month), table[1][0]['damage'])
+                for month, table in sorted(
+                    self.parsed_month_tables.items(),
+                    key=lambda item: int(item[0]))]
+
     def get_filenames(self, pattern=None):
         """
         Return list of filenames in the result zip file.
@@ -664,112 +986,389 @@ class DamageEvent(models.Model):
             os.rmdir(tempdir)
             return geotransform, data
 
+    def waterlevel_area(self):
+        """Total area in m2 of the waterlevels of this event."""
+        return sum(
+            raster.get_area_with_data(gdal_open(dewl.waterlevel_path))
+            for dewl in self.damageeventwaterlevel_set.all())
+
+    def compute_content_hash(self):
+        """Hash of all inputs of the calculation of this event."""
+        scenario = self.scenario
+        dt_path = scenario.damage_table_path
+        custom_paths = [
+            os.path.join(settings.MEDIA_ROOT, path) if path else None
+            for path in (scenario.customheights, scenario.customlanduse)]
+        paths = [dewl.waterlevel_path
+                 for dewl in self.damageeventwaterlevel_set.all()]
+
+        return dedup.content_hash(paths + [dt_path] + custom_paths, {
+            'waterlevels': len(paths),
+            'floodtime': self.floodtime,
+            'repairtime_roads': self.repairtime_roads,
+            'repairtime_buildings': self.repairtime_buildings,
+            'floodmonth': int(self.floodmonth),
+            'floodmonths': self.parsed_floodmonths,
+            'repetition_time': self.repetition_time,
+            'calc_type': scenario.calc_type,
+            'ahn_version': scenario.ahn_version,
+            'units': sorted(
+                (unit.name, unit.factor) for unit in damagetables.units()),
+            'version': tools.version(),
+            # The AHN and LGN tiles aren't hashed, they are too large
+            'data_versions': [
+                leafindex.data_version(datadir) for datadir in (
+                    'data_ahn' + scenario.ahn_version, 'data_lgn')],
+            # Settings that change the results
+            'cull_dry_leaves': settings.LIZARD_DAMAGE_CULL_DRY_LEAVES,
+            'write_cog': settings.LIZARD_DAMAGE_WRITE_COG,
+            'cog_compression': settings.LIZARD_DAMAGE_COG_COMPRESSION,
+            'save_tile_layers': settings.LIZARD_DAMAGE_SAVE_TILE_LAYERS,
+        })
+
+    def find_duplicate(self, content_hash):
+        """Return an earlier event with the same content_hash whose
+        results still exist, or None."""
+        for other in DamageEvent.objects.filter(
+                content_hash=content_hash).exclude(pk=self.pk):
+            if os.path.exists(other.result):
+                return other
+        return None
+
+    def reuse_results(self, other, logger):
+        """Take over the results of other, which had the same inputs."""
+        logger.info("Reusing the results of event {}".format(other.pk))
+        self.damageeventresult_set.all().delete_with_files()
+        count = dedup.link_tree(
+            other.workdir, self.workdir, exclude=('waterlevels', 'tmp'))
+        logger.info("Linked {} files".format(count))
+
+        DamageEventResult.objects.bulk_create([
+            DamageEventResult(
+                damage_event=self,
+                result_type=result.result_type,
+                relative_path=result.relative_path,
+                north=result.north, south=result.south,
+                east=result.east, west=result.west,
+                geotransform_json=result.geotransform_json)
+            for result in other.damageeventresult_set.all()])
+
+        self.table = other.table
+        self.month_tables = other.month_tables
+        self.min_height = other.min_height
+        self.max_height = other.max_height
+        self.content_hash = other.content_hash
+        self.save()
+
+    def reuse_or_unshare(self, logger):
+        """If an earlier event had the same inputs, take over its
+        results and return (True, its content hash). Otherwise make
+        sure the files in the workdir can be written and return (False,
+        content hash), the hash is None if reusing results is off."""
+        content_hash = None
+        if settings.LIZARD_DAMAGE_REUSE_RESULTS:
+            content_hash = self.compute_content_hash()
+            other = self.find_duplicate(content_hash)
+            if other is not None:
+                self.reuse_results(other, logger)
+                return True, content_hash
+        # Files are written in place below, that must not change the
+        # results of events they are shared with
+        dedup.unlink_shared(self.workdir)
+        return False, content_hash
+
+    def distribute(self):
+        """Whether to calculate this event over several celery workers,
+        see distributed.py."""
+        area = settings.LIZARD_DAMAGE_DISTRIBUTE_AREA
+        return area is not None and self.waterlevel_area() > area
+
     def calculate(self, logger):
         """
         Calculate this damage event.
         """
-        from lizard_damage import calc
-
         logger.info("event %s" % (self,))
         logger.info(" - month %s, floodtime %s" % (
             self.floodmonth, self.floodtime))
 
-        # Read damage table
-        dt_path, damage_table = self.scenario.read_damage_table()
-        logger.info('damage table: %s' % dt_path)
+        reused, content_hash = self.reuse_or_unshare(logger)
+        if reused:
+            return True, []
 
-        calc_type = self.scenario.calc_type or calculation.CALC_TYPE_MAX
-        # Use the calculator from lizard-damage-calculation for the
-        # actual calculation.
+        event_calculation = EventCalculation(self, logger, content_hash)
+        all_leaves, skipped_leaves = event_calculation.leaves()
 
-        ahn_dir = 'data_ahn' + self.scenario.ahn_version
+        profiler = profiling.profiler_for_directory(self.workdir)
+        profiler.start()
 
-        calculator = calculation.DamageCalculator(
-            ahn_data_dir=os.path.join(
-                settings.LIZARD_DAMAGE_DATA_ROOT, ahn_dir),
-            lgn_data_dir=os.path.join(
-                settings.LIZARD_DAMAGE_DATA_ROOT, 'data_lgn'),
-            alternative_heights_dataset=(
-                self.scenario.alternative_heights_dataset),
-            alternative_landuse_dataset=(
-                self.scenario.alternative_landuse_dataset),
-            table=damage_table,
-            get_roads_flooded_for_tile_and_code=
-            Roads.get_roads_flooded_for_tile_and_code,
-            calc_type=calc_type,
-            road_grid_codes=Roads.ROAD_GRIDCODE,
-            logger=logger)
+        result_collector = event_calculation.result_collector(
+            all_leaves, profiler=profiler)
+
+        if self.waterlevel_area() > settings.LIZARD_DAMAGE_OUT_OF_CORE_AREA:
+            logger.info("Large waterlevel, calculating in chunks")
+            leaf_results = chunks.calculate_for_all_leaves(
+                event_calculation.make_calculator,
+                event_calculation.waterlevel_ascfiles, all_leaves,
+                settings.LIZARD_DAMAGE_OUT_OF_CORE_CHUNK_SIZE,
+                result_collector.tempdir, logger,
+                **event_calculation.calculation_kwargs)
+        else:
+            calculator = event_calculation.make_calculator()
+            calculator.skip_leaves = frozenset(skipped_leaves)
+            leaf_results = calculator.calculate_for_all_leaves(
+                **event_calculation.calculation_kwargs)
+
+        for leaf_result in leaf_results:
+            # The tile has been read and calculated at this point
+            profiler.checkpoint('tile {}'.format(leaf_result[0]))
+            event_calculation.record_tile(result_collector, leaf_result)
+
+        event_calculation.finish(
+            result_collector, all_leaves, skipped_leaves, profiler)
+        profiler.stop()
+
+        return True, result_collector.riskmap_data  # success
+
+
+class EventCalculation(object):
+    """The inputs and running totals of the calculation of a
+    DamageEvent. The tiles are recorded one by one, by a single process
+    (DamageEvent.calculate) or by several celery workers whose totals
+    are added together afterwards (see distributed.py)."""
 
-        waterlevel_ascfiles = [
+    def __init__(self, damage_event, logger, content_hash=None):
+        self.damage_event = damage_event
+        self.logger = logger
+        self.content_hash = content_hash
+
+        # Read damage table
+        scenario = damage_event.scenario
+        self.dt_path, self.damage_table = scenario.read_damage_table()
+        self.compiled_table = damagetables.compiled(self.dt_path)
+        logger.info('damage table: %s' % self.dt_path)
+
+        self.calc_type = scenario.calculator_calc_type
+        self.extra_calc_types = scenario.extra_calc_types
+        self.extra_floodmonths = damage_event.extra_floodmonths
+        self.calculator_data = scenario.calculator_data()
+        self.calculation_kwargs = dict(
+            month=damage_event.floodmonth,
+            floodtime=damage_event.floodtime,
+            repairtime_roads=damage_event.repairtime_roads,
+            repairtime_buildings=damage_event.repairtime_buildings)
+
+        self.waterlevel_ascfiles = [
             dewl.waterlevel_path for dewl in
-            self.damageeventwaterlevel_set.all()]
-        calculator.set_waterlevel_datafiles(waterlevel_ascfiles)
+            damage_event.damageeventwaterlevel_set.all()]
 
         # Track global results
-        overall_area = collections.defaultdict(float)
-        overall_damage = collections.defaultdict(float)
-        roads_flooded_global = {i: collections.defaultdict(float)
-                                for i in Roads.ROAD_GRIDCODE}
-
+        self.overall_area = collections.defaultdict(float)
+        self.overall_damage = collections.defaultdict(float)
+        self.overall_extra_damage = {
+            name: collections.defaultdict(float)
+            for name, extra_calc_type in self.extra_calc_types}
+        self.overall_month_damage = {
+            month: collections.defaultdict(float)
+            for month in self.extra_floodmonths}
+        self.roads_flooded_global = {i: collections.defaultdict(float)
+                                     for i in Roads.ROAD_GRIDCODE}
+
+    def make_calculator(self, waterlevel_paths=None):
+        """Use the calculator from lizard-damage-calculation for the
+        actual calculation. By default it gets all waterlevels of the
+        event."""
+        calculator = LeafSkippingDamageCalculator(
+            table=self.damage_table,
+            get_roads_flooded_for_tile_and_code=
+            Roads.get_roads_flooded_for_tile_and_code,
+            calc_type=self.calc_type,
+            road_grid_codes=Roads.ROAD_GRIDCODE,
+            logger=self.logger,
+            **self.calculator_data)
+        calculator.set_waterlevel_datafiles(
+            waterlevel_paths or self.waterlevel_ascfiles)
+        return calculator
+
+    def leaves(self):
+        """Return the leaves to calculate, (ahn_name, extent) tuples,
+        and a dict of the skipped dry leaves."""
+        calculator = self.make_calculator()
         all_leaves = calculator.get_ahn_leaves()
+        if settings.LIZARD_DAMAGE_CULL_DRY_LEAVES:
+            skipped_leaves = culling.dry_leaves(
+                self.waterlevel_ascfiles, all_leaves,
+                self.calculator_data['ahn_data_dir'])
+            calculator.skip_leaves = frozenset(skipped_leaves)
+            all_leaves = calculator.get_ahn_leaves()
+            self.logger.info(
+                "Skipping {} dry leaves".format(len(skipped_leaves)))
+        else:
+            skipped_leaves = {}
+        return all_leaves, skipped_leaves
 
+    def result_collector(self, all_leaves, profiler=None):
         result_collector = results.ResultCollector(
-            self.workdir, all_leaves, logger)
-        result_collector.save_file_for_zipfile(dt_path, 'dt.cfg')
-
-        for (ahn_name, extent, ds_height, landuse_ma, depth_ma, damage,
-             area, result, roads_flooded_for_tile) in (
-                calculator.calculate_for_all_leaves(
-                    month=self.floodmonth,
-                    floodtime=self.floodtime,
-                    repairtime_roads=self.repairtime_roads,
-                    repairtime_buildings=self.repairtime_buildings)):
-            logger.info("Recording results for tile {}...".format(ahn_name))
-
-            # Keep track of flooded roads
-            for code, roads_flooded in roads_flooded_for_tile.iteritems():
-                for road, flooded_m2 in roads_flooded.iteritems():
-                    roads_flooded_global[code][road] += flooded_m2
-
-            logger.debug("result sum: %f" % result.sum())
-            arcname = 'schade_{}'.format(ahn_name)
-            if self.repetition_time:
-                arcname += '_T%.1f' % self.repetition_time
+            self.damage_event.workdir, all_leaves, self.logger,
+            profiler=profiler)
+        result_collector.save_file_for_zipfile(self.dt_path, 'dt.cfg')
+        for dewl in self.damage_event.damageeventwaterlevel_set.all():
+            if os.path.exists(dewl.inundation_path):
+                result_collector.save_file_for_zipfile(
+                    dewl.inundation_path, INUNDATION_FILENAME)
+        return result_collector
+
+    def meta(self, month=None, calc_type=None):
+        damage_event = self.damage_event
+        return [
+            ['schade module versie', tools.version()],
+            ['waterlevel', self.waterlevel_ascfiles[0]],
+            ['damage table', self.dt_path],
+            ['maand', str(month or damage_event.floodmonth)],
+            ['duur overstroming (s)', str(damage_event.floodtime)],
+            ['hersteltijd wegen (s)', str(damage_event.repairtime_roads)],
+            ['hersteltijd bebouwing (s)',
+             str(damage_event.repairtime_buildings)],
+            ['berekening',
+             {1: 'Minimum', 2: 'Maximum',
+              3: 'Gemiddelde'}[calc_type or self.calc_type]],
+        ]
+
+    def record_tile(self, result_collector, leaf_result):
+        """Save the results of one tile, as yielded by the calculator's
+        calculate_for_all_leaves(), and add them to the totals."""
+        from lizard_damage import calc
+
+        damage_event = self.damage_event
+        (ahn_name, extent, ds_height, landuse_ma, depth_ma, damage,
+         area, result, roads_flooded_for_tile) = leaf_result
+        self.logger.info("Recording results for tile {}...".format(ahn_name))
+
+        # Keep track of flooded roads
+        for code, roads_flooded in roads_flooded_for_tile.iteritems():
+            for road, flooded_m2 in roads_flooded.iteritems():
+                self.roads_flooded_global[code][road] += flooded_m2
+
+        self.logger.debug("result sum: %f" % result.sum())
+        result_collector.save_ma(
+            ahn_name, result, result_type='damage', ds_template=ds_height,
+            repetition_time=damage_event.repetition_time)
+        if settings.LIZARD_DAMAGE_SAVE_TILE_LAYERS:
+            result_collector.save_ma(
+                ahn_name, utils.ds2ma(ds_height), result_type='height',
+                ds_template=ds_height)
+            result_collector.save_ma(
+                ahn_name, depth_ma, result_type='depth',
+                ds_template=ds_height)
             result_collector.save_ma(
-                ahn_name, result, result_type='damage', ds_template=ds_height,
-                repetition_time=self.repetition_time)
+                ahn_name, landuse_ma, result_type='landuse',
+                ds_template=ds_height)
 
-            result_collector.save_csv_data_for_zipfile(
-                'schade_{}.csv'.format(ahn_name), dict(
-                    damage=damage, area=area, damage_table=damage_table,
-                    meta=[
-                        ['schade module versie', tools.version()],
-                        ['waterlevel', waterlevel_ascfiles[0]],
-                        ['damage table', dt_path],
-                        ['maand', str(self.floodmonth)],
-                        ['duur overstroming (s)', str(self.floodtime)],
-                        ['hersteltijd wegen (s)', str(self.repairtime_roads)],
-                        ['hersteltijd bebouwing (s)',
-                         str(self.repairtime_buildings)],
-                        ['berekening',
-                         {1: 'Minimum', 2: 'Maximum',
-                          3: 'Gemiddelde'}[calc_type]],
-                        ['ahn_name', ahn_name],
-                    ]))
-
-            for k in damage.keys():
-                overall_damage[k] += damage[k]
-
-            for k in area.keys():
-                overall_area[k] += area[k]
+        result_collector.save_csv_data_for_zipfile(
+            'schade_{}.csv'.format(ahn_name), dict(
+                damage=damage, area=area, damage_table=self.damage_table,
+                meta=self.meta() + [['ahn_name', ahn_name]]))
+
+        for k in damage.keys():
+            self.overall_damage[k] += damage[k]
+
+        # The other calc types reuse the prepared landuse and depth
+        for name, extra_calc_type in self.extra_calc_types:
+            extra_damage, extra_result = calc.damage_for_calc_type(
+                landuse_ma, depth_ma, raster.get_area_per_pixel(ds_height),
+                self.compiled_table, calculation.CALC_TYPES[extra_calc_type],
+                month=damage_event.floodmonth,
+                floodtime=damage_event.floodtime,
+                repairtime_buildings=damage_event.repairtime_buildings,
+                road_grid_codes=Roads.ROAD_GRIDCODE)
+            result_collector.save_ma(
+                ahn_name, extra_result, result_type='damage',
+                ds_template=ds_height,
+                repetition_time=damage_event.repetition_time, variant=name)
+            for k in extra_damage.keys():
+                self.overall_extra_damage[name][k] += extra_damage[k]
+
+        # So do the other months, only their month factor differs
+        if self.extra_floodmonths:
+            month_damage = calc.damage_per_month(
+                landuse_ma, depth_ma, raster.get_area_per_pixel(ds_height),
+                self.compiled_table, calculation.CALC_TYPES[self.calc_type],
+                months=self.extra_floodmonths,
+                floodtime=damage_event.floodtime,
+                repairtime_buildings=damage_event.repairtime_buildings,
+                road_grid_codes=Roads.ROAD_GRIDCODE)
+            for month, damage_for_month in month_damage.items():
+                for k in damage_for_month.keys():
+                    self.overall_month_damage[month][k] += damage_for_month[k]
+
+        for k in area.keys():
+            self.overall_area[k] += area[k]
+
+    def totals(self):
+        """The running totals, as something that can be stored as JSON
+        (keys can be numbers, so dicts are lists of pairs)."""
+        def pairs(totals):
+            return sorted(totals.items())
+
+        return {
+            'area': pairs(self.overall_area),
+            'damage': pairs(self.overall_damage),
+            'extra_damage': [
+                [name, pairs(totals)]
+                for name, totals in self.overall_extra_damage.items()],
+            'month_damage': [
+                [month, pairs(totals)]
+                for month, totals in self.overall_month_damage.items()],
+            'roads_flooded': [
+                [code, pairs(roads_flooded)]
+                for code, roads_flooded in self.roads_flooded_global.items()],
+        }
+
+    def add_totals(self, totals):
+        """Add totals from totals() of another EventCalculation of the
+        same event."""
+        def add(target, pairs):
+            for key, value in pairs:
+                target[key] += value
+
+        add(self.overall_area, totals['area'])
+        add(self.overall_damage, totals['damage'])
+        for name, pairs in totals['extra_damage']:
+            add(self.overall_extra_damage[name], pairs)
+        for month, pairs in totals['month_damage']:
+            add(self.overall_month_damage[month], pairs)
+        # Per road, so that the 100 m2 threshold is applied to the
+        # whole road and not to the parts of it
+        for code, pairs in totals['roads_flooded']:
+            add(self.roads_flooded_global[code], pairs)
+
+    def finish(self, result_collector, all_leaves, skipped_leaves,
+               profiler):
+        """Write everything that needs all tiles, and save the
+        results on the event."""
+        from lizard_damage import calc
+
+        damage_event = self.damage_event
+        damage_table = self.damage_table
+        calc_type = self.calc_type
+        overall_area = self.overall_area
+        overall_damage = self.overall_damage
+        overall_extra_damage = self.overall_extra_damage
+        overall_month_damage = self.overall_month_damage
+
+        result_collector.save_json_for_zipfile(
+            results.MANIFEST_FILENAME, {
+                'leaves': sorted(ahn_name for ahn_name, _ in all_leaves),
+                'skipped_leaves': skipped_leaves,
+            })
 
         # Generate vrt + geotiff out of the .asc files.
-        result_collector.build_damage_geotiff()
+        with profiler.stage('build damage geotiff'):
+            result_collector.build_damage_geotiff()
 
         # Only after all tiles have been processed, calculate overall indirect
         # Road damage. This is not visible in the per-tile-damagetable.
         roads_flooded_over_threshold = []
-        for code, roads_flooded in roads_flooded_global.iteritems():
+        for code, roads_flooded in self.roads_flooded_global.iteritems():
             damage_data = damage_table.data[code]
             for road, area in roads_flooded.iteritems():
                 if area >= 100:
@@ -777,9 +1376,10 @@ class DamageEvent(models.Model):
                     indirect_road_damage = (
                         damage_data.to_indirect_damage(
                             calculation.CALC_TYPES[calc_type]) *
-                        damage_data.to_gamma_repairtime(self.repairtime_roads))
+                        damage_data.to_gamma_repairtime(
+                            damage_event.repairtime_roads))
 
-                    logger.info(
+                    self.logger.info(
                         '%s - %s - %s: %.2f ind' %
                         (
                             damage_data.code,
@@ -788,48 +1388,99 @@ class DamageEvent(models.Model):
                             indirect_road_damage,
                             ),
                         )
-                    logger.info(
+                    self.logger.info(
                         ('track indirect road damage: scenario slug {}, ' +
                          'roadid {}, damage {}').format(
-                            self.scenario.slug, road, indirect_road_damage,
+                            damage_event.scenario.slug, road,
+                            indirect_road_damage,
                         ))
                     overall_damage[code] += indirect_road_damage
+                    for month in self.extra_floodmonths:
+                        overall_month_damage[month][code] += (
+                            indirect_road_damage)
+
+                    for name, extra_calc_type in self.extra_calc_types:
+                        overall_extra_damage[name][code] += (
+                            damage_data.to_indirect_damage(
+                                calculation.CALC_TYPES[extra_calc_type]) *
+                            damage_data.to_gamma_repairtime(
+                                damage_event.repairtime_roads))
 
         result_collector.save_csv_data_for_zipfile(
             'schade_totaal.csv', dict(
                 damage=overall_damage,
                 area=overall_area,
                 damage_table=damage_table,
-                meta=[
-                    ['schade module versie', tools.version()],
-                    ['waterlevel', waterlevel_ascfiles[0]],
-                    ['damage table', dt_path],
-                    ['maand', str(self.floodmonth)],
-                    ['duur overstroming (s)', str(self.floodtime)],
-                    ['hersteltijd wegen (s)', str(self.repairtime_roads)],
-                    ['hersteltijd bebouwing (s)',
-                     str(self.repairtime_buildings)],
-                    ['berekening',
-                     {1: 'Minimum', 2: 'Maximum', 3: 'Gemiddelde'}[calc_type]],
-                ],
+                meta=self.meta(),
                 include_total=True))
 
+        for name, extra_calc_type in self.extra_calc_types:
+            result_collector.save_csv_data_for_zipfile(
+                'schade_totaal_{}.csv'.format(name), dict(
+                    damage=overall_extra_damage[name],
+                    area=overall_area,
+                    damage_table=damage_table,
+                    meta=self.meta(calc_type=extra_calc_type),
+                    include_total=True))
+
+        for month in self.extra_floodmonths:
+            result_collector.save_csv_data_for_zipfile(
+                'schade_totaal_maand_{}.csv'.format(month), dict(
+                    damage=overall_month_damage[month],
+                    area=overall_area,
+                    damage_table=damage_table,
+                    meta=self.meta(month=month),
+                    include_total=True))
+
         result_collector.finalize()
-        DamageEventResult.create_from_result_collector(self, result_collector)
+        DamageEventResult.create_from_result_collector(
+            damage_event, result_collector)
 
         # Save a table in a JSON string to show in the interface
-        self.parsed_table = calc.result_as_dict(
+        damage_event.parsed_table = calc.result_as_dict(
             damage=overall_damage,
             area=overall_area,
-            damage_table=damage_table)
+            damage_table=damage_table,
+            extra_damage=overall_extra_damage)
+        if self.extra_floodmonths:
+            month_tables = {
+                month: calc.result_as_dict(
+                    damage=overall_month_damage[month],
+                    area=overall_area,
+                    damage_table=damage_table)
+                for month in self.extra_floodmonths}
+            month_tables[int(damage_event.floodmonth)] = calc.result_as_dict(
+                damage=overall_damage,
+                area=overall_area,
+                damage_table=damage_table)
+            damage_event.parsed_month_tables = month_tables
 
         # Save min and max height, for legend
-        self.min_height = result_collector.mins.get('height')
-        self.max_height = result_collector.maxes.get('height')
-        self.save()
+        if (result_collector.mins['height'] <=
+                result_collector.maxes['height']):
+            damage_event.min_height = result_collector.mins['height']
+            damage_event.max_height = result_collector.maxes['height']
+        damage_event.content_hash = self.content_hash
+        damage_event.save()
         result_collector.cleanup_tmp_dir()
 
-        return True, result_collector.riskmap_data  # success
+
+class DamageEventResultQuerySet(QuerySet):
+    def delete_with_files(self):
+        """Delete all results in one query, then remove their image
+        files. Doesn't create the workdirs of their events."""
+        paths = list(self.values_list(
+            'damage_event__scenario', 'damage_event', 'relative_path'))
+        self.delete()
+
+        remove_files(
+            event_workdir_path(scenario_id, event_id) + relative_path
+            for scenario_id, event_id, relative_path in paths)
+
+
+class DamageEventResultManager(models.Manager):
+    def get_queryset(self):
+        return DamageEventResultQuerySet(self.model, using=self._db)
 
 
 class DamageEventResult(models.Model):
@@ -854,6 +1505,8 @@ class DamageEventResult(models.Model):
 
     geotransform_json = models.TextField(null=True, blank=True)
 
+    objects = DamageEventResultManager()
+
     def __unicode__(self):
         return '%s' % (self.damage_event)
 
@@ -904,7 +1557,10 @@ class DamageEventWaterlevel(models.Model):
         ordering = ('index', )
 
     @classmethod
-    def setup(cls, damage_event, waterlevel, index=None):
+    def setup(cls, damage_event, waterlevel, index=None, inundation=None):
+        """inundation is an optional raster with the first timestep
+        with water and the number of timesteps with water, made by
+        envelope.build for time series."""
         # Create damageeventwaterlevel instance
         damageeventwaterlevel = cls.objects.create(event=damage_event)
 
@@ -915,6 +1571,8 @@ class DamageEventWaterlevel(models.Model):
         # Move provided file to workdir
         damageeventwaterlevel.waterlevel_path = copy(
             waterlevel, damageeventwaterlevel.workdir)
+        if inundation is not None:
+            shutil.copy(inundation, damageeventwaterlevel.inundation_path)
 
         # Save and return
         damageeventwaterlevel.save()
@@ -932,6 +1590,10 @@ class DamageEventWaterlevel(models.Model):
             os.makedirs(workdir)
         return workdir
 
+    @property
+    def inundation_path(self):
+        return os.path.join(self.workdir, INUNDATION_FILENAME)
+
     def __unicode__(self):
         return os.path.basename(self.waterlevel_path)
 
@@ -943,6 +1605,10 @@ class RiskResult(models.Model):
     zip_risk = models.FileField(
         upload_to='scenario/result',
     )
+    cog_risk = models.FileField(
+        upload_to='scenario/result',
+        null=True, blank=True,
+        help_text='Risk map as a single Cloud Optimized GeoTIFF, if enabled')
     scenario = models.ForeignKey(DamageScenario)
 
     def __unicode__(self):
@@ -994,6 +1660,11 @@ class BenefitScenario(models.Model):
         upload_to='benefit/result',
         null=True, blank=True,
         help_text='Will be filled when results are available')
+    cog_result = models.FileField(
+        upload_to='benefit/result',
+        null=True, blank=True,
+        help_text='Benefit map as a single Cloud Optimized GeoTIFF, '
+        'if enabled')
 
     status = models.IntegerField(
         choices=SCENARIO_STATUS_CHOICES,
@@ -1071,13 +1742,81 @@ class BenefitScenarioResult(models.Model):
         return '%s - %s' % (self.benefit_scenario, self.image)
 
 
+class GeoImageQuerySet(QuerySet):
+    def delete_with_files(self):
+        """Delete all GeoImages in one query, then remove their image
+        files."""
+        storage = self.model._meta.get_field('image').storage
+        names = list(
+            self.exclude(image='').values_list('image', flat=True))
+        self.delete()
+
+        for name in names:
+            storage.delete(name)
+
+    def existing(self, slugs):
+        """Return a dict of slug to GeoImage for those of the slugs that
+        have a GeoImage with an image file. Uses one query and one
+        directory listing per image directory, instead of a query and a
+        stat per slug."""
+        listings = {}
+        return dict(
+            (geoimage.slug, geoimage)
+            for geoimage in self.filter(slug__in=list(slugs))
+            if _image_file_exists(geoimage, listings))
+
+    def with_missing_files(self):
+        """Return the GeoImages (a list) whose image file is gone."""
+        listings = {}
+        return [
+            geoimage for geoimage in self
+            if not _image_file_exists(geoimage, listings)]
+
+    def reconcile(self):
+        """Delete GeoImages whose image file is gone, so that they are
+        made again the next time they are needed. Returns the number of
+        deleted GeoImages."""
+        missing = self.with_missing_files()
+        self.model.objects.filter(
+            pk__in=[geoimage.pk for geoimage in missing]).delete()
+        return len(missing)
+
+
+def _image_file_exists(geoimage, listings):
+    """Check whether geoimage's image file exists. Listings is a dict
+    of directory to the set of filenames in it, that is filled as
+    needed."""
+    if not geoimage.image:
+        return False
+
+    directory, filename = os.path.split(
+        os.path.join(settings.MEDIA_ROOT, geoimage.image.name))
+    if directory not in listings:
+        try:
+            listings[directory] = set(os.listdir(directory))
+        except OSError:
+            listings[directory] = set()
+    return filename in listings[directory]
+
+
+class GeoImageManager(models.Manager):
+    def get_queryset(self):
+        return GeoImageQuerySet(self.model, using=self._db)
+
+    def existing(self, slugs):
+        return self.get_queryset().existing(slugs)
+
+    def reconcile(self):
+        return self.get_queryset().reconcile()
+
+
 class GeoImage(models.Model):
     """
     Generic geo referenced image
 
     i.e. For use in kml files
     """
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
     image = models.FileField(upload_to='geoimage')
 
     north = models.FloatField()
@@ -1085,27 +1824,60 @@ class GeoImage(models.Model):
     east = models.FloatField()
     west = models.FloatField()
 
+    # Size of the image in pixels, so that KMLs don't have to open it.
+    # Empty for images made before migration 0033, see size().
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+
+    objects = GeoImageManager()
+
     def __unicode__(self):
         return self.slug
 
+    def size(self):
+        """Return (width, height) of the image. If they weren't stored
+        yet, they are read from the image file once and saved."""
+        if self.width is None or self.height is None:
+            self.width, self.height = Image.open(self.image.path).size
+            self.save(update_fields=['width', 'height'])
+        return self.width, self.height
+
+    # The next three make GeoImages usable in event_result.kml
+
+    def url(self):
+        return self.image.url
+
+    def rotation(self):
+        return 0
+
+    @property
+    def name(self):
+        return self.slug
+
     @classmethod
     def check_existence(cls, slug):
-        geoimages = cls.objects.filter(slug=slug)
-        if geoimages.count() == 0:
+        """Return the GeoImage with this slug if its image file exists,
+        otherwise False. A GeoImage whose file is gone is left alone;
+        it is updated when the image is made again, or removed by the
+        clean_up command. For many slugs, use objects.existing()."""
+        geoimage = cls.objects.filter(slug=slug).first()
+        if geoimage is None or not geoimage.image:
             return False
-
-        for geoimage in geoimages:
-            if geoimage.image and os.path.exists(os.path.join(
-                    settings.MEDIA_ROOT, geoimage.image.name)):
-                return geoimage
-            else:
-                geoimage.delete()
-
-        return False
+        if not os.path.exists(
+                os.path.join(settings.MEDIA_ROOT, geoimage.image.name)):
+            return False
+        return geoimage
 
     @classmethod
-    def from_landuse_dataset(cls, dataset, slug):
-        """Create GeoImage from a dataset containing landuse data."""
+    def from_landuse_dataset(cls, dataset, slug, overview_level=0):
+        """Create GeoImage from a dataset containing landuse data.
+
+        With an overview level n, the image is made at 1 / 2 ** n of
+        the dataset's resolution. GDAL reads it with nearest neighbour
+        resampling (from the dataset's own overviews, if it has them),
+        so landuse codes aren't mixed. The level is raised until the
+        image has at most MAX_LANDUSE_IMAGE_CELLS cells, so that a huge
+        upload is never read at full resolution."""
         geoimage = cls.check_existence(slug)
         if geoimage:
             return geoimage
@@ -1113,10 +1885,24 @@ class GeoImage(models.Model):
         from .calc import landuse_legend
         legend = landuse_legend()
 
-        data = dataset.GetRasterBand(1).ReadAsArray()
+        factor = 2 ** overview_level
+        while ((dataset.RasterXSize // factor) *
+               (dataset.RasterYSize // factor) > MAX_LANDUSE_IMAGE_CELLS):
+            factor *= 2
+        width = max(dataset.RasterXSize // factor, 1)
+        height = max(dataset.RasterYSize // factor, 1)
+        data = dataset.GetRasterBand(1).ReadAsArray(
+            0, 0, dataset.RasterXSize, dataset.RasterYSize, width, height)
+
+        x0, dxx, dxy, y0, dyx, dyy = dataset.GetGeoTransform()
+        x_factor = dataset.RasterXSize / width
+        y_factor = dataset.RasterYSize / height
+        geotransform = (
+            x0, dxx * x_factor, dxy * y_factor,
+            y0, dyx * x_factor, dyy * y_factor)
 
         return cls.from_data_with_legend(
-            slug, data, legend, geotransform=dataset.GetGeoTransform())
+            slug, data, legend, geotransform=geotransform)
 
     @classmethod
     def from_data_with_legend(
@@ -1133,8 +1919,7 @@ class GeoImage(models.Model):
             return geoimage
 
         tmp_base = tempfile.mktemp()
-        colormap = mpl.colors.ListedColormap(legend, 'indexed')
-        rgba = colormap(data, bytes=True)
+        rgba = colormaps.apply_listed_lut(colormaps.listed_lut(legend), data)
         Image.fromarray(rgba).save(tmp_base + '.png', 'PNG')
         if extent is not None:
             results.write_extent_pgw(tmp_base + '.pgw', extent)
@@ -1155,21 +1940,10 @@ class GeoImage(models.Model):
 
         tmp_base = tempfile.mktemp()
         if cdict is None:
-            cdict = {
-                'red': ((0.0, 51. / 256, 51. / 256),
-                        (0.5, 237. / 256, 237. / 256),
-                        (1.0, 83. / 256, 83. / 256)),
-                'green': ((0.0, 114. / 256, 114. / 256),
-                          (0.5, 245. / 256, 245. / 256),
-                          (1.0, 83. / 256, 83. / 256)),
-                'blue': ((0.0, 54. / 256, 54. / 256),
-                         (0.5, 170. / 256, 170. / 256),
-                         (1.0, 83. / 256, 83. / 256)),
-                }
-        colormap = mpl.colors.LinearSegmentedColormap(
-            'something', cdict, N=1024)
-        normalize = mpl.colors.Normalize(vmin=min_value, vmax=max_value)
-        rgba = colormap(normalize(data), bytes=True)
+            lut = colormaps.HEIGHT_LUT
+        else:
+            lut = colormaps.segmented_lut(cdict)
+        rgba = colormaps.apply_lut(lut, data, vmin=min_value, vmax=max_value)
 
         if 'depth' in slug:
             # Make transparent where depth is zero or less
@@ -1193,6 +1967,25 @@ class GeoImage(models.Model):
 
         Does not save a .pgw for the new .png.
         """
+        # If there is a GeoImage whose file is gone, reuse it
+        geo_image = cls.objects.filter(slug=slug).first()
+        geo_image = cls._unsaved_from_rd_png(
+            tmp_base, slug, extent, geo_image=geo_image)
+        try:
+            with transaction.atomic():
+                geo_image.save()
+        except IntegrityError:
+            # Another request made it in the meantime, use that one.
+            # Our image file got a name of its own, so it can go.
+            geo_image.image.delete(save=False)
+            return cls.objects.get(slug=slug)
+        return geo_image
+
+    @classmethod
+    def _unsaved_from_rd_png(cls, tmp_base, slug, extent, geo_image=None):
+        """Does the work of _from_rd_png, except saving the GeoImage
+        to the database. The image file is stored. If geo_image is
+        given it is updated, otherwise a new GeoImage is made."""
 
         # Step 2: warp using gdalwarp to lon/lat in .tif
         # Warp png file, output is tif.
@@ -1205,16 +1998,21 @@ class GeoImage(models.Model):
         # Step 3: convert .tif back to .png
         im = Image.open(tmp_base + '.tif')
         im.save(tmp_base + '_2.png', 'PNG')
+        width, height = im.size
 
         # Step 4: put .png in GeoObject, with new extent
-        geo_image = cls(slug=slug)
+        if geo_image is None:
+            geo_image = cls(slug=slug)
+        elif geo_image.image:
+            geo_image.image.delete(save=False)
         geo_image.north = result_extent[3]
         geo_image.south = result_extent[1]
         geo_image.east = result_extent[2]
         geo_image.west = result_extent[0]
+        geo_image.width = width
+        geo_image.height = height
         with open(tmp_base + '_2.png', 'rb') as img_file:
-            geo_image.image.save(slug + '.png', File(img_file), save=True)
-        geo_image.save()
+            geo_image.image.save(slug + '.png', File(img_file), save=False)
 
         # Step 5: clean tempfiles.
         os.remove(tmp_base + '.png')
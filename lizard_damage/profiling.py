@@ -0,0 +1,138 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Optional memory profiling of calculations.
+
+If LIZARD_DAMAGE_PROFILE_MEMORY is set, a MemoryProfiler records the
+resident set size (current and peak) of the process at named checkpoints,
+plus tracemalloc statistics if the tracemalloc module is available. Every
+checkpoint is appended to the report file as one line of JSON right away,
+so that the report of a worker that gets OOM-killed still shows the last
+tile or stage it completed."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import contextlib
+import datetime
+import json
+import logging
+import os
+import resource
+
+try:
+    import tracemalloc
+except ImportError:
+    # Not in the standard library before Python 3.4
+    tracemalloc = None
+
+from lizard_damage.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILENAME = 'memory_profile.jsonl'
+
+# Number of lines with the largest allocations that is recorded
+TOP_ALLOCATIONS = 10
+
+
+def current_rss():
+    """Return the current resident set size in bytes, or None if we can't
+    know it (only Linux has /proc/self/statm)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize()
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryProfiler(object):
+    def __init__(self, path, enabled=None):
+        """Profiler that writes to path. If enabled isn't given, it
+        is taken from the LIZARD_DAMAGE_PROFILE_MEMORY setting. A
+        disabled profiler does nothing at all."""
+        if enabled is None:
+            enabled = settings.LIZARD_DAMAGE_PROFILE_MEMORY
+        self.path = path
+        self.enabled = enabled
+        self._started_tracemalloc = False
+        self._last_peak_rss = 0
+
+    def start(self):
+        if not self.enabled:
+            return
+
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        self._last_peak_rss = peak_rss()
+
+        # Start with an empty report
+        open(self.path, 'w').close()
+        logger.info("Writing memory profile to {}".format(self.path))
+        self.checkpoint('start')
+
+    def stop(self):
+        if not self.enabled:
+            return
+
+        self.checkpoint('stop')
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def checkpoint(self, name):
+        """Append a record of the memory use at this point to the
+        report. The peak RSS increase is what the work since the
+        previous checkpoint added to the peak of the whole process."""
+        if not self.enabled:
+            return
+
+        peak = peak_rss()
+        record = collections.OrderedDict((
+            ('name', name),
+            ('time', datetime.datetime.now().isoformat()),
+            ('rss', current_rss()),
+            ('peak_rss', peak),
+            ('peak_rss_increase', peak - self._last_peak_rss),
+        ))
+        self._last_peak_rss = peak
+
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            traced_current, traced_peak = tracemalloc.get_traced_memory()
+            record['traced'] = traced_current
+            record['traced_peak'] = traced_peak
+            statistics = tracemalloc.take_snapshot().statistics('lineno')
+            record['top_allocations'] = [
+                [str(statistic.traceback), statistic.size]
+                for statistic in statistics[:TOP_ALLOCATIONS]]
+            if hasattr(tracemalloc, 'reset_peak'):
+                # So that the next traced_peak is about the next stage
+                tracemalloc.reset_peak()
+
+        with open(self.path, 'a') as report:
+            report.write(json.dumps(record) + '\n')
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record a checkpoint after the stage has finished."""
+        try:
+            yield
+        finally:
+            self.checkpoint(name)
+
+
+def profiler_for_directory(directory):
+    return MemoryProfiler(os.path.join(directory, PROFILE_FILENAME))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+"""Per user limits on the area of uploaded waterlevels.
+
+Large waterlevels are calculated chunk by chunk (see chunks.py), so the
+area limit is not about memory anymore but about how much calculation
+time a user may ask for. Users are only known by their email address.
+LIZARD_DAMAGE_WATERLEVEL_SIZE_QUOTAS maps an address, or '@' and a
+domain for everybody of an organisation, to a maximum area in m2, or to
+None for the ceiling. Everybody else gets
+LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE.
+
+The address is typed into the wizard and not verified, so a quota can
+be claimed by anybody. No quota goes above
+LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE_CEILING, which is the real limit.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+from lizard_damage.conf import settings
+
+
+def _quota(email):
+    quotas = {
+        key.strip().lower(): value for key, value in
+        settings.LIZARD_DAMAGE_WATERLEVEL_SIZE_QUOTAS.items()}
+    if email:
+        email = email.strip().lower()
+        if email in quotas:
+            return quotas[email]
+        domain = '@' + email.rpartition('@')[2]
+        if domain in quotas:
+            return quotas[domain]
+    return settings.LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE
+
+
+def max_waterlevel_size(email):
+    """Return the largest waterlevel area in m2 that the user with
+    this email address may upload, never more than the ceiling."""
+    ceiling = settings.LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE_CEILING
+    quota = _quota(email)
+    return ceiling if quota is None else min(quota, ceiling)
+
+
+def exceeds(area, email):
+    """Return whether area (m2) is larger than the user may upload."""
+    return area > max_waterlevel_size(email)
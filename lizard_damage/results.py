@@ -5,6 +5,7 @@ around, and generated results (like land use images for a given tile) can
 be "thrown to" it."""
 
 import glob
+import json
 import os
 import shutil
 import subprocess
@@ -12,11 +13,20 @@ import tempfile
 import zipfile
 
 from PIL import Image
+from osgeo import gdal
+from osgeo import osr
 from pyproj import Proj
-import matplotlib as mpl
 import numpy as np
 
+from lizard_damage import cog
+from lizard_damage import colormaps
+from lizard_damage import profiling
+
 ZIP_FILENAME = 'result.zip'
+COG_FILENAME = 'schade.tif'
+
+# Which leaves were calculated, and which were skipped and why
+MANIFEST_FILENAME = 'manifest.json'
 
 RD = str(
     "+proj=sterea +lat_0=52.15616055555555 +lon_0=5.38763888888889 +k=0.999908"
@@ -26,37 +36,34 @@ RD = str(
 )
 
 WGS84 = str('+proj=latlong +datum=WGS84')
+RD_WKT = osr.GetUserInputAsWKT(str('epsg:28992'))
 
 rd_proj = Proj(RD)
 wgs84_proj = Proj(WGS84)
 
-CDICT_HEIGHT = {
-    'red': ((0.0, 51. / 256, 51. / 256),
-            (0.5, 237. / 256, 237. / 256),
-            (1.0, 83. / 256, 83. / 256)),
-    'green': ((0.0, 114. / 256, 114. / 256),
-              (0.5, 245. / 256, 245. / 256),
-              (1.0, 83. / 256, 83. / 256)),
-    'blue': ((0.0, 54. / 256, 54. / 256),
-             (0.5, 170. / 256, 170. / 256),
-             (1.0, 83. / 256, 83. / 256)),
+# Height and depth tiles are kept in tmp as uint16 codes until the
+# colour scale is known: code = (value - offset) / step + 1, and code 0
+# means no data. These (offset, step) pairs cover -100m to 555m NAP for
+# heights and 0m to 655m for depths, in cm.
+FIXED_SCALES = {
+    'height': (-100.0, 0.01),
+    'depth': (0.0, 0.01),
 }
+NODATA_CODE = 0
+MAX_CODE = np.iinfo(np.uint16).max
 
-CDICT_WATER_DEPTH = {
-    'red': ((0.0, 170. / 256, 170. / 256),
-            (0.5, 65. / 256, 65. / 256),
-            (1.0, 4. / 256, 4. / 256)),
-    'green': ((0.0, 200. / 256, 200. / 256),
-              (0.5, 120. / 256, 120. / 256),
-              (1.0, 65. / 256, 65. / 256)),
-    'blue': ((0.0, 255. / 256, 255. / 256),
-             (0.5, 221. / 256, 221. / 256),
-             (1.0, 176. / 256, 176. / 256)),
-    }
+# Besides the images, finalize() keeps the height, depth and landuse
+# tiles as compressed GeoTIFFs with overviews in this subdirectory of the
+# workdir, with a VRT per result type, for serving web tiles.
+RASTERS_DIR = 'rasters'
+RASTER_RESULT_TYPES = ('landuse', 'height', 'depth')
+LANDUSE_NODATA = 255
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
 
 
 class ResultCollector(object):
-    def __init__(self, workdir, all_leaves, logger):
+    def __init__(self, workdir, all_leaves, logger, profiler=None,
+                 zip_filename=ZIP_FILENAME):
         """Start a new ResultCollector.
 
         Workdir is a damage event's workdir. All result files are placed
@@ -81,9 +88,20 @@ class ResultCollector(object):
         All four types of tile are saved as images for showing using Google.
         The damage tiles are somewhat special in that they will first be
         saved, and need to have roads drawn in them afterwards.
+
+        If a profiling.MemoryProfiler is given, the stages of finalize()
+        are recorded in it.
+
+        Several collectors can record tiles of the same event, each in
+        its own zip_filename (see distributed.py). The one that finishes
+        the event takes over their state() with add_state() and their
+        zipfiles with add_zipfile().
         """
 
         self.workdir = workdir
+        if profiler is None:
+            profiler = profiling.MemoryProfiler(None, enabled=False)
+        self.profiler = profiler
 
         self.tempdir = os.path.join(self.workdir, 'tmp')
         if not os.path.exists(self.tempdir):
@@ -100,40 +118,93 @@ class ResultCollector(object):
         self.riskmap_data = []
 
         # Create an empty zipfile, throw away the old one if needed.
-        self.zipfile = mk(self.workdir, ZIP_FILENAME)
+        self.zipfile = mk(self.workdir, zip_filename)
         if os.path.exists(self.zipfile):
             os.remove(self.zipfile)
 
+        # Names of extra damage grids, like 'min' and 'max', that are
+        # saved next to the main one as schade_<variant>_<tile>
+        self.damage_variants = set()
+
         self.mins = {'depth': float("+inf"), 'height': float("+inf")}
         self.maxes = {'depth': float("-inf"), 'height': float("-inf")}
+        self.geotransforms = {}
 
     def png_path(self, result_type, tile):
         return mk(self.workdir, result_type, "{}.png".format(tile))
 
     def save_ma(
             self, tile, masked_array, result_type, ds_template=None,
-            repetition_time=None):
+            repetition_time=None, variant=None):
         # self.save_ma_to_geoimage(tile, masked_array, result_type)
         # ^^^ disable because google maps api no longer supports this,
         #     and because tmp takes excessive space because of this
         #     (uncompressed) storage.
+        if ds_template is not None:
+            self.geotransforms[tile] = ds_template.GetGeoTransform()
+
         if result_type == 'damage':
             filename = self.save_ma_to_asc(
-                tile, masked_array, result_type, ds_template, repetition_time)
-            if repetition_time is not None:
+                tile, masked_array, result_type, ds_template, repetition_time,
+                variant)
+            if repetition_time is not None and variant is None:
                 # TODO (Reinout wants to know where this is used. The file is
                 # deleted after adding it to the zipfile, so....)
                 self.riskmap_data.append(
                     (tile, repetition_time, filename))
+        elif result_type in FIXED_SCALES:
+            self.save_ma_to_codes(tile, masked_array, result_type)
+        elif result_type == 'landuse':
+            landuse = np.ma.getdata(masked_array).astype(np.uint8)
+            landuse[np.ma.getmaskarray(masked_array)] = LANDUSE_NODATA
+            write_byte_geotiff(
+                self.raster_path(result_type, tile), [landuse],
+                self.geotransform(tile), nodata=LANDUSE_NODATA)
+
+    def geotransform(self, tile):
+        """Geotransform of the tile's data. Without a template dataset,
+        it is computed from the extent like write_extent_pgw does."""
+        if tile in self.geotransforms:
+            return self.geotransforms[tile]
+        extent = self.all_leaves[tile]
+        return (min(extent[0], extent[2]), 0.5, 0,
+                max(extent[1], extent[3]), 0, -0.5)
+
+    def raster_path(self, result_type, tile):
+        return mk(self.workdir, RASTERS_DIR, result_type, "{}.tif".format(tile))
+
+    def codes_path(self, result_type, tile):
+        return os.path.join(
+            self.tempdir, "{}.{}.npy".format(tile, result_type))
+
+    def save_ma_to_codes(self, tile, masked_array, result_type):
+        """Keep track of the minimum and maximum, and write the tile to
+        tmp with the fixed scale encoding. The image is rendered from
+        that in finalize(), when the overall minimum and maximum are
+        known."""
+        if masked_array.count() == 0:
+            return
+
+        self.mins[result_type] = min(
+            self.mins[result_type], float(masked_array.min()))
+        self.maxes[result_type] = max(
+            self.maxes[result_type], float(masked_array.max()))
+
+        np.save(self.codes_path(result_type, tile),
+                encode(masked_array, *FIXED_SCALES[result_type]))
 
     def save_ma_to_asc(
             self, tile, masked_array, result_type, ds_template,
-            repetition_time):
+            repetition_time, variant=None):
         from lizard_damage import calc
+        prefix = 'schade_'
+        if variant is not None:
+            self.damage_variants.add(variant)
+            prefix += '{}_'.format(variant)
         if repetition_time is not None:
-            filename = 'schade_{}_T{}.asc'.format(tile, repetition_time)
+            filename = '{}{}_T{}.asc'.format(prefix, tile, repetition_time)
         else:
-            filename = 'schade_{}.asc'.format(tile)
+            filename = '{}{}.asc'.format(prefix, tile)
         filename = os.path.join(self.tempdir, filename)
         calc.write_result(
             name=filename,
@@ -148,6 +219,13 @@ class ResultCollector(object):
         calc.write_table(name=filename, **csvdata)
         self.save_file_for_zipfile(filename, zipname, delete_after=True)
 
+    def save_json_for_zipfile(self, zipname, data):
+        from lizard_damage import calc
+        filename = calc.mkstemp_and_close()
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        self.save_file_for_zipfile(filename, zipname, delete_after=True)
+
     def save_file_for_zipfile(self, file_path, zipname, delete_after=False):
         with zipfile.ZipFile(self.zipfile, 'a', zipfile.ZIP_DEFLATED) as myzip:
             self.logger.info('zipping %s...' % zipname)
@@ -157,6 +235,39 @@ class ResultCollector(object):
                     'removing %r (%s in arc)' % (file_path, zipname))
                 os.remove(file_path)
 
+    def add_zipfile(self, path):
+        """Add all files in the zipfile at path to our zipfile."""
+        with zipfile.ZipFile(path) as source:
+            with zipfile.ZipFile(
+                    self.zipfile, 'a', zipfile.ZIP_DEFLATED) as myzip:
+                for name in source.namelist():
+                    myzip.writestr(
+                        source.getinfo(name), source.read(name),
+                        zipfile.ZIP_DEFLATED)
+
+    def state(self):
+        """What is known about the saved tiles, as something that can
+        be stored as JSON."""
+        return {
+            'mins': self.mins,
+            'maxes': self.maxes,
+            'geotransforms': self.geotransforms,
+            'riskmap_data': self.riskmap_data,
+            'damage_variants': sorted(self.damage_variants),
+        }
+
+    def add_state(self, state):
+        """Take over the state() of a collector of other tiles."""
+        for result_type, minimum in state['mins'].items():
+            self.mins[result_type] = min(self.mins[result_type], minimum)
+        for result_type, maximum in state['maxes'].items():
+            self.maxes[result_type] = max(self.maxes[result_type], maximum)
+        for tile, geotransform in state['geotransforms'].items():
+            self.geotransforms[tile] = tuple(geotransform)
+        self.riskmap_data.extend(
+            tuple(riskmap_data) for riskmap_data in state['riskmap_data'])
+        self.damage_variants.update(state['damage_variants'])
+
     def build_damage_geotiff(self):
         orig_dir = os.getcwd()
         os.chdir(self.tempdir)
@@ -172,12 +283,37 @@ class ResultCollector(object):
             os.system(cmd % (asc_file, tiff_file))
             self.save_file_for_zipfile(tiff_file, tiff_file)
 
-        file_with_tiff_filenames = tempfile.NamedTemporaryFile()
+        # The extra damage grids get their own VRT, and no COG
         tiff_files = glob.glob('*.tiff')
+        for variant in sorted(self.damage_variants):
+            prefix = 'schade_{}_'.format(variant)
+            self.build_damage_vrt(
+                [name for name in tiff_files
+                 if name.startswith(prefix)],
+                'schade_{}.vrt'.format(variant))
+            tiff_files = [name for name in tiff_files
+                          if not name.startswith(prefix)]
+        self.build_damage_vrt(tiff_files, 'schade.vrt')
+
+        cog_file = os.path.join(self.workdir, COG_FILENAME)
+        if os.path.exists(cog_file):
+            os.remove(cog_file)
+        if tiff_files and cog.enabled():
+            self.logger.info("Writing damage as a single COG.")
+            cog.write_cog_from_files(tiff_files, cog_file)
+        elif os.path.exists('schade.vrt'):
+            # Web tiles are read from the VRT in the zipfile then; GDAL
+            # finds its overviews next to it
+            build_overviews('schade.vrt', 'average')
+            if os.path.exists('schade.vrt.ovr'):
+                self.save_file_for_zipfile('schade.vrt.ovr', 'schade.vrt.ovr')
+        os.chdir(orig_dir)
+
+    def build_damage_vrt(self, tiff_files, vrt_file):
+        file_with_tiff_filenames = tempfile.NamedTemporaryFile()
         for tiff_file in tiff_files:
             file_with_tiff_filenames.write(tiff_file + "\n")
         file_with_tiff_filenames.flush()
-        vrt_file = 'schade.vrt'
         cmd = "gdalbuildvrt -input_file_list %s %s" % (
             file_with_tiff_filenames.name, vrt_file)
         self.logger.debug(cmd)
@@ -185,7 +321,6 @@ class ResultCollector(object):
         file_with_tiff_filenames.close()  # Deletes the temporary file
         if os.path.exists(vrt_file):
             self.save_file_for_zipfile(vrt_file, vrt_file)
-        os.chdir(orig_dir)
 
     def finalize(self):
         """Make final version of the data:
@@ -195,37 +330,72 @@ class ResultCollector(object):
 
         self.extents = {}
 
-        for tile in self.all_leaves:
+        with self.profiler.stage('finalize: render height and depth'):
             for result_type in ('height', 'depth'):
-                tmp_filename = os.path.join(
-                    self.tempdir, "{}.{}".format(tile, result_type))
-                if os.path.exists(tmp_filename):
-                    masked_array = np.load(tmp_filename)
-                    os.remove(tmp_filename)
-
-                    normalize = mpl.colors.Normalize(
-                        vmin=self.mins[result_type],
-                        vmax=self.maxes[result_type])
-                    if result_type == 'height':
-                        cdict = CDICT_HEIGHT
-                    elif result_type == 'depth':
-                        cdict = CDICT_WATER_DEPTH
-                    colormap = mpl.colors.LinearSegmentedColormap(
-                        'something', cdict, N=1024)
-                    rgba = colormap(normalize(masked_array), bytes=True)
-                    if result_type == 'depth':
-                        rgba[:, :, 3] = np.where(
-                            np.greater(masked_array.filled(0), 0), 255, 0)
+                if self.mins[result_type] > self.maxes[result_type]:
+                    continue  # No tiles with data
+
+                # With the colour scale known, every possible code has
+                # a colour, and rendering a tile is a single lookup
+                code_colors = self.code_colors(result_type)
+                for tile in self.all_leaves:
+                    codes_filename = self.codes_path(result_type, tile)
+                    if not os.path.exists(codes_filename):
+                        continue
+                    codes = np.load(codes_filename, mmap_mode='r')
+                    rgba = np.take(code_colors, codes, axis=0)
+                    del codes
+                    os.remove(codes_filename)
+
                     filename = self.png_path(result_type, tile)
                     Image.fromarray(rgba).save(filename, 'PNG')
                     write_extent_pgw(filename.replace('.png', '.pgw'),
                                      self.all_leaves[tile])
-
-            for result_type in ('damage', 'landuse', 'height', 'depth'):
-                png = self.png_path(result_type, tile)
-                if os.path.exists(png):
-                    result_extent = rd_to_wgs84(png)
-                    self.extents[(tile, result_type)] = result_extent
+                    write_byte_geotiff(
+                        self.raster_path(result_type, tile),
+                        [rgba[:, :, band] for band in range(4)],
+                        self.geotransform(tile))
+
+        with self.profiler.stage('finalize: build raster VRTs'):
+            for result_type in RASTER_RESULT_TYPES:
+                self.build_raster_vrt(result_type)
+
+        with self.profiler.stage('finalize: warp images to WGS84'):
+            for tile in self.all_leaves:
+                for result_type in ('damage', 'landuse', 'height', 'depth'):
+                    png = self.png_path(result_type, tile)
+                    if os.path.exists(png):
+                        result_extent = rd_to_wgs84(png)
+                        self.extents[(tile, result_type)] = result_extent
+
+    def build_raster_vrt(self, result_type):
+        tifs = glob.glob(os.path.join(
+            self.workdir, RASTERS_DIR, result_type, '*.tif'))
+        if tifs:
+            path = vrt_path(self.workdir, result_type)
+            subprocess.call(['gdalbuildvrt', path] + tifs)
+            # Landuse codes and colours shouldn't be averaged
+            build_overviews(path, 'nearest')
+
+    def code_colors(self, result_type):
+        """Return an RGBA array with the colour of every uint16 code of
+        result_type, using the overall minimum and maximum."""
+        if result_type == 'height':
+            lut = colormaps.HEIGHT_LUT
+        elif result_type == 'depth':
+            lut = colormaps.WATER_DEPTH_LUT
+
+        values = decode(
+            np.arange(MAX_CODE + 1, dtype=np.uint16),
+            *FIXED_SCALES[result_type])
+        code_colors = colormaps.apply_lut(
+            lut, values,
+            vmin=self.mins[result_type], vmax=self.maxes[result_type])
+        if result_type == 'depth':
+            # Transparent where depth is zero or less
+            code_colors[:, 3] = np.where(
+                np.greater(values.filled(0), 0), 255, 0)
+        return code_colors
 
     def cleanup_tmp_dir(self):
         shutil.rmtree(self.tempdir)
@@ -240,6 +410,55 @@ class ResultCollector(object):
                 yield (result_type, relative, extent)
 
 
+def vrt_path(workdir, result_type):
+    return os.path.join(workdir, RASTERS_DIR, "{}.vrt".format(result_type))
+
+
+def build_overviews(path, resampling):
+    """Build overviews of the raster at path in an external <path>.ovr,
+    for web tiles of zoomed out views."""
+    if os.path.exists(path + '.ovr'):
+        os.remove(path + '.ovr')  # Of an earlier calculation
+    subprocess.call(
+        ['gdaladdo', '-ro', '-r', resampling, path] +
+        [str(factor) for factor in OVERVIEW_FACTORS])
+
+
+def write_byte_geotiff(path, bands, geotransform, nodata=None):
+    """Write a list of 2D uint8 arrays as a tiled, compressed GeoTIFF in
+    RD. It gets no overviews; the VRT of all tiles gets them."""
+    height, width = bands[0].shape
+    dataset = gdal.GetDriverByName('GTiff').Create(
+        str(path), width, height, len(bands), gdal.GDT_Byte,
+        ['TILED=YES', 'COMPRESS=DEFLATE'])
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(RD_WKT)
+    for index, band in enumerate(bands, 1):
+        dataset.GetRasterBand(index).WriteArray(band)
+        if nodata is not None:
+            dataset.GetRasterBand(index).SetNoDataValue(nodata)
+    dataset = None  # Close and flush
+
+
+def encode(masked_array, offset, step):
+    """Return the values of masked_array as uint16 codes, see
+    FIXED_SCALES. Values outside the range get the nearest code."""
+    codes = np.subtract(
+        np.ma.getdata(masked_array), offset, dtype=np.float32)
+    codes /= step
+    codes += 1.5  # 1 for the nodata code, 0.5 for rounding
+    np.clip(codes, NODATA_CODE + 1, MAX_CODE, out=codes)
+    codes = codes.astype(np.uint16)
+    codes[np.ma.getmaskarray(masked_array)] = NODATA_CODE
+    return codes
+
+
+def decode(codes, offset, step):
+    """Return a masked array of the values the codes stand for."""
+    values = (codes.astype(np.float64) - 1) * step + offset
+    return np.ma.masked_where(codes == NODATA_CODE, values)
+
+
 def write_extent_pgw(name, extent):
     """write pgw file:
 
@@ -12,7 +12,6 @@ from django.core.files import File
 from osgeo import gdal
 from osgeo import gdalconst
 
-import collections
 import numpy as np
 import os
 import re
@@ -20,6 +19,8 @@ import shutil
 import tempfile
 import zipfile
 
+from lizard_damage import cog
+from lizard_damage import profiling
 
 """
 from second zip, check if names unchanged.
@@ -87,14 +88,47 @@ def calculate_risk(iterable):
     return dict(geotransform=element['geotransform'], risk=risk)
 
 
+def risk_jobs(events):
+    """
+    Return dict of tile index -> list of jobs, one for each event.
+
+    Events that have no damage file for a tile get a job without
+    filename: their leaf was dry (see culling.py) and its damage is zero.
+    Leaving them out would make the risk of that tile too low.
+    """
+    filenames = [dict(_index_and_filenames(event)) for event in events]
+    indices = set().union(*filenames) if filenames else set()
+    return {
+        index: [
+            dict(event=event, filename=event_filenames.get(index))
+            for event, event_filenames in zip(events, filenames)
+        ]
+        for index in indices
+    }
+
+
 def iter_risk_and_damage(jobs):
     """
     generator of dicts with data for each job.
+
+    Jobs without filename yield zero damage, with the geotransform and
+    mask of the first job of the same tile that has a file.
     """
+    first = next(element for element in jobs if element['filename'])
+    first_data = first['event'].get_data(first['filename'])
+
     for element in jobs:
         event = element['event']
         filename = element['filename']
-        geotransform, damage = event.get_data(filename)
+        if element is first:
+            geotransform, damage = first_data
+        elif filename is None:
+            geotransform, template = first_data
+            damage = np.ma.array(
+                np.zeros(template.shape), mask=np.ma.getmaskarray(template),
+            )
+        else:
+            geotransform, damage = event.get_data(filename)
         yield dict(
             geotransform=geotransform,
             damage=damage,
@@ -102,6 +136,15 @@ def iter_risk_and_damage(jobs):
         )
 
 
+def save_cog(field_file, tiff_paths, tempdir, filename):
+    """Mosaic the tiffs into a COG and save it in field_file, without
+    saving the model instance."""
+    cogpath = os.path.join(tempdir, str(filename))
+    cog.write_cog_from_files(tiff_paths, cogpath)
+    with open(cogpath, 'rb') as cogfile:
+        field_file.save(filename, File(cogfile), save=False)
+
+
 def create_risk_map(damage_scenario, logger):
     """
     """
@@ -110,6 +153,8 @@ def create_risk_map(damage_scenario, logger):
     riskresults = damage_scenario.riskresult_set.all()
     for riskresult in riskresults:
         riskresult.zip_risk.delete()
+        if riskresult.cog_risk:
+            riskresult.cog_risk.delete()
         riskresult.delete()
 
     tempdir = tempfile.mkdtemp()
@@ -119,14 +164,13 @@ def create_risk_map(damage_scenario, logger):
     )
 
     events = damage_scenario.damageevent_set.order_by('-repetition_time').all()
+    jobdict = risk_jobs(list(events))
 
-    jobdict = collections.defaultdict(list)
-    for event in events:
-        for index, filename in _index_and_filenames(event):
-            jobdict[index].append(dict(event=event, filename=filename))
+    profiler = profiling.profiler_for_directory(damage_scenario.workdir)
+    profiler.start()
 
+    tiff_paths = []
     for index, jobs in jobdict.items():
-
         logger.debug('calculating risk for {} ({} rasters)'.format(
             index, len(jobs)),
         )
@@ -151,7 +195,13 @@ def create_risk_map(damage_scenario, logger):
         with zipfile.ZipFile(zipriskpath,
                              'a', zipfile.ZIP_DEFLATED) as archive:
             archive.write(ascpath, os.path.basename(ascpath))
-        os.remove(ascpath)
+        if cog.enabled():
+            tiff_paths.append(ascpath)
+        else:
+            os.remove(ascpath)
+
+        # The tile has been calculated and written at this point
+        profiler.checkpoint('risk {}'.format(index))
 
     riskresult = damage_scenario.riskresult_set.create()
 
@@ -161,8 +211,15 @@ def create_risk_map(damage_scenario, logger):
             os.path.basename(zipriskpath),
             File(zipriskfile),
         )
+
+    if cog.enabled() and tiff_paths:
+        with profiler.stage('risk COG'):
+            logger.debug('Writing risk map as a single COG')
+            save_cog(riskresult.cog_risk, tiff_paths, tempdir,
+                     'risk_' + slugify(damage_scenario.name) + '.tif')
     riskresult.save()
     shutil.rmtree(tempdir)
+    profiler.stop()
 
 
 def create_benefit_map(benefit_scenario, logger):
@@ -173,6 +230,9 @@ def create_benefit_map(benefit_scenario, logger):
     if benefit_scenario.zip_result:
         benefit_scenario.zip_result.delete()
     benefit_scenario.zip_result = None
+    if benefit_scenario.cog_result:
+        benefit_scenario.cog_result.delete()
+    benefit_scenario.cog_result = None
 
     # Create tempdir
     tempdir = tempfile.mkdtemp()
@@ -189,6 +249,7 @@ def create_benefit_map(benefit_scenario, logger):
             if match:
                 jobs.append((match.group(1), match.string))
 
+    tiff_paths = []
     for index, filename in jobs:
         logger.debug(
             'calculating benefit for {}'.format(index, len(jobs))
@@ -215,7 +276,10 @@ def create_benefit_map(benefit_scenario, logger):
             zipbenefitpath, 'a', zipfile.ZIP_DEFLATED,
         ) as archive:
             archive.write(ascpath, os.path.basename(ascpath))
-        os.remove(ascpath)
+        if cog.enabled():
+            tiff_paths.append(ascpath)
+        else:
+            os.remove(ascpath)
 
     logger.debug('Adding zip to result dir')
     with open(zipbenefitpath, 'rb') as zipbenefitfile:
@@ -223,6 +287,11 @@ def create_benefit_map(benefit_scenario, logger):
             os.path.basename(zipbenefitpath),
             File(zipbenefitfile),
         )
+
+    if cog.enabled() and tiff_paths:
+        logger.debug('Writing benefit map as a single COG')
+        save_cog(benefit_scenario.cog_result, tiff_paths, tempdir,
+                 'benefit_' + slugify(benefit_scenario.name) + '.tif')
     benefit_scenario.save()
 
     shutil.rmtree(tempdir)
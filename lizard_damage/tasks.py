@@ -6,6 +6,8 @@ import traceback
 
 from celery.task import task
 
+from lizard_damage import costs
+from lizard_damage import distributed
 from lizard_damage import models
 from lizard_damage import risk
 from lizard_damage import emails
@@ -17,8 +19,14 @@ from lizard_task.task import task_logging
 
 def damage_scenario_to_task(damage_scenario, username="admin"):
     """
-    Send provided damage scenario as task
+    Send provided damage scenario as task, to the queue that fits its
+    estimated calculation time (see costs.py)
     """
+    if damage_scenario.estimated_cost is None:
+        damage_scenario.estimated_cost = costs.estimate(
+            damage_scenario, logging.getLogger(__name__))
+        damage_scenario.save()
+
     task_name = 'Scenario (%05d) calculate damage' % damage_scenario.id
     task_kwargs = (
         '{"username": "%s", "taskname": "%s", "damage_scenario_id": "%d"}' % (
@@ -29,8 +37,14 @@ def damage_scenario_to_task(damage_scenario, username="admin"):
             'task': 'lizard_damage.tasks.calculate_damage'
             })
     calc_damage_task.task = 'lizard_damage.tasks.calculate_damage'
+    calc_damage_task.queue = costs.queue(damage_scenario)
     calc_damage_task.save()
-    calc_damage_task.send_task(username=username)
+    # Sent here instead of with calc_damage_task.send_task(), so that
+    # the queue is certainly used
+    calculate_damage.apply_async(
+        kwargs={'username': username, 'taskname': task_name,
+                'damage_scenario_id': damage_scenario.id},
+        **costs.queue_options(damage_scenario))
 
 
 def benefit_scenario_to_task(benefit_scenario, username="admin"):
@@ -78,23 +92,75 @@ def calculate_damage(
         damage_scenario.calculate(logger)
         logger.info("Calculation exited normally")
     except:
-        logger.info("An exception has occurred")
-        exc_info = sys.exc_info()
-        tracebackbuf = StringIO.StringIO()
-        traceback.print_exception(*exc_info, limit=None, file=tracebackbuf)
-        logger.info(tracebackbuf.getvalue())
+        send_exception_emails(damage_scenario_id, logger)
+
+
+def send_exception_emails(damage_scenario_id, logger):
+    """Log the exception that is being handled, and send emails about
+    it to the user and to LIZARD_DAMAGE_EXCEPTION_EMAIL."""
+    logger.info("An exception has occurred")
+    exc_info = sys.exc_info()
+    tracebackbuf = StringIO.StringIO()
+    traceback.print_exception(*exc_info, limit=None, file=tracebackbuf)
+    logger.info(tracebackbuf.getvalue())
+
+    emails.send_email_to_task(
+        damage_scenario_id, 'email_exception',
+        "WaterSchadeSchatter: berekening mislukt")
+
+    emails.send_email_to_task(
+        damage_scenario_id, 'email_exception_traceback',
+        "WaterSchadeSchatter: berekening gecrasht",
+        email=settings.LIZARD_DAMAGE_EXCEPTION_EMAIL, extra_context={
+            'exception': "{}: {}".format(exc_info[0], exc_info[1]),
+            'traceback': tracebackbuf.getvalue()
+            })
 
-        emails.send_email_to_task(
-            damage_scenario_id, 'email_exception',
-            "WaterSchadeSchatter: berekening mislukt")
 
-        emails.send_email_to_task(
-            damage_scenario_id, 'email_exception_traceback',
-            "WaterSchadeSchatter: berekening gecrasht",
-            email=settings.LIZARD_DAMAGE_EXCEPTION_EMAIL, extra_context={
-                'exception': "{}: {}".format(exc_info[0], exc_info[1]),
-                'traceback': tracebackbuf.getvalue()
-                })
+@task
+def calculate_damage_chunk(
+        damage_event_id, number, extent, names, taskname=None):
+    """Map step of a distributed event, see distributed.py. Returns the
+    path of the chunk's results, or None if it failed; exceptions are
+    not raised, because then the chord would never call
+    reduce_damage_event."""
+    logger = logging.getLogger(taskname)
+    try:
+        damage_event = models.DamageEvent.objects.get(pk=damage_event_id)
+        logger.info("Calculating chunk {} of event {}".format(
+            number, damage_event))
+        return distributed.calculate_chunk(
+            damage_event, number, extent, names, logger)
+    except:
+        logger.error("Calculating chunk {} failed".format(number))
+        for exception_line in traceback.format_exc().split('\n'):
+            logger.error(exception_line)
+        return None
+
+
+@task
+def reduce_damage_event(
+        json_paths, damage_event_id, event_index, errors, start_dt,
+        all_leaves, skipped_leaves, content_hash, taskname=None):
+    """Reduce step of a distributed event, see distributed.py. Finishes
+    the event and continues its scenario with the next event."""
+    logger = logging.getLogger(taskname)
+    damage_event = models.DamageEvent.objects.get(pk=damage_event_id)
+    damage_scenario_id = damage_event.scenario_id
+    try:
+        if None in json_paths:
+            raise RuntimeError(
+                "{} of the {} chunks of event {} failed".format(
+                    json_paths.count(None), len(json_paths), damage_event))
+        distributed.finish(
+            damage_event, json_paths, all_leaves, skipped_leaves,
+            content_hash, logger)
+        damage_event.scenario.calculate(
+            logger, first_event=event_index + 1, errors=errors,
+            start_dt=distributed.parse_datetime(start_dt))
+        logger.info("Calculation exited normally")
+    except:
+        send_exception_emails(damage_scenario_id, logger)
 
 
 @task
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from osgeo import gdal
+
+from lizard_damage import benchmark
+from lizard_damage import raster
+
+
+class TestTimings(TestCase):
+    def test_wrap_records_calls(self):
+        timings = benchmark.Timings()
+        wrapped = timings.wrap('double', lambda x: 2 * x)
+
+        self.assertEquals(wrapped(3), 6)
+        self.assertEquals(wrapped(4), 8)
+        self.assertEquals(timings.as_dict()['double']['calls'], 2)
+
+    def test_measure_records_on_exception(self):
+        timings = benchmark.Timings()
+        try:
+            with timings.measure('failing'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEquals(timings.as_dict()['failing']['calls'], 1)
+
+
+class TestSyntheticPolder(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_waterlevel_covers_requested_area(self):
+        polder = benchmark.SyntheticPolder(self.directory, 1, [2, 3])
+        path = polder.waterlevel_path(10)
+        polder.create_waterlevel(path, offset=0)
+
+        self.assertTrue(os.path.exists(path))
+        dataset = gdal.Open(str(path))
+        self.assertEquals(raster.get_area_with_data(dataset), 1000 * 1000)
+
+    def test_roads_are_found_by_geo(self):
+        polder = benchmark.SyntheticPolder(self.directory, 1, [2, 3])
+        polder.leaves = [('i00aa0_00', polder.extent)]
+        polder.create_roads()
+
+        gridcode = benchmark.ROAD_GRIDCODES[0]
+        geo = (raster.PROJECTION_RD,
+               (polder.extent[0], 0.5, 0, polder.extent[1] + 100, 0, -0.5))
+        roads = polder.get_roads_by_geo(gridcode, geo, (200, 200))
+        self.assertEquals([road.gridcode for road in roads], [gridcode])
@@ -0,0 +1,93 @@
+from django.test import TestCase
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import blocks
+from lizard_damage import utils
+
+
+class TestWindows(TestCase):
+    def setUp(self):
+        self.dataset = gdal.GetDriverByName(b'MEM').Create(
+            b'', 10, 25, 1, gdal.GDT_Float32)
+        self.dataset.SetGeoTransform((1000, 1, 0, 2000, 0, -1))
+        self.band = self.dataset.GetRasterBand(1)
+
+    def test_windows_cover_band(self):
+        windows = list(blocks.windows(self.band, window_size=100))
+        self.assertEquals(windows[0], (0, 0, 10, 10))
+        self.assertEquals(windows[-1], (0, 20, 10, 5))
+        self.assertEquals(sum(window[3] for window in windows), 25)
+
+    def test_small_window_size_reads_at_least_a_block(self):
+        windows = list(blocks.windows(self.band, window_size=1))
+        self.assertEquals(len(windows), 25)
+
+    def test_read_windows(self):
+        data = np.arange(250, dtype=np.float32).reshape(25, 10)
+        self.band.WriteArray(data)
+        result = np.vstack([
+            array for xoff, yoff, array in
+            blocks.read_windows(self.band, window_size=70)])
+        self.assertTrue((result == data).all())
+
+    def test_empty_like(self):
+        self.band.Fill(3)
+        empty = blocks.empty_like(self.dataset, nodatavalue=-999)
+        self.assertEquals(
+            empty.GetGeoTransform(), self.dataset.GetGeoTransform())
+        self.assertTrue((empty.ReadAsArray() == -999).all())
+
+
+class TestWindow(TestCase):
+    def setUp(self):
+        self.dataset = gdal.GetDriverByName(b'MEM').Create(
+            b'', 100, 50, 1, gdal.GDT_Float32)
+        self.dataset.SetGeoTransform((1000, 0.5, 0, 2000, 0, -0.5))
+
+    def test_window_inside(self):
+        self.assertEquals(
+            blocks.window(self.dataset, (1010, 1980, 1020, 1990)),
+            (20, 20, 20, 20))
+
+    def test_window_is_clipped_to_dataset(self):
+        self.assertEquals(
+            blocks.window(self.dataset, (900, 1900, 1010, 2100)),
+            (0, 0, 20, 50))
+
+    def test_window_outside(self):
+        self.assertEquals(
+            blocks.window(self.dataset, (0, 0, 10, 10)), None)
+
+
+class TestReproject(TestCase):
+    def dataset(self, value):
+        dataset = gdal.GetDriverByName(b'MEM').Create(
+            b'', 4, 4, 1, gdal.GDT_Float32)
+        dataset.SetGeoTransform((1000, 1, 0, 2000, 0, -1))
+        dataset.SetProjection(utils.projection(28992))
+        dataset.GetRasterBand(1).Fill(value)
+        return dataset
+
+    def test_uncovered_cells_are_nodata(self):
+        source = gdal.GetDriverByName(b'MEM').Create(
+            b'', 2, 2, 1, gdal.GDT_Float32)
+        source.SetGeoTransform((1000, 1, 0, 2000, 0, -1))
+        source.SetProjection(utils.projection(28992))
+        source.GetRasterBand(1).SetNoDataValue(-999)
+        source.GetRasterBand(1).Fill(5)
+
+        result = utils.reproject(source, self.dataset(1)).ReadAsArray()
+        self.assertEquals(result[0, 0], 5)
+        self.assertEquals(result[3, 3], -999)
+
+    def test_without_nodata_uncovered_cells_keep_match_data(self):
+        source = gdal.GetDriverByName(b'MEM').Create(
+            b'', 2, 2, 1, gdal.GDT_Float32)
+        source.SetGeoTransform((1000, 1, 0, 2000, 0, -1))
+        source.SetProjection(utils.projection(28992))
+        source.GetRasterBand(1).Fill(5)
+
+        result = utils.reproject(source, self.dataset(1)).ReadAsArray()
+        self.assertEquals(result[0, 0], 5)
+        self.assertEquals(result[3, 3], 1)
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import chunks
+
+
+class TestChunkLeaves(TestCase):
+    def test_leaves_grouped_by_centre(self):
+        leaves = [
+            ('i37en1_01', (0, 0, 1000, 1000)),
+            ('i37en1_02', (1000, 0, 2000, 1000)),
+            ('i37en1_03', (9000, 0, 10000, 1000)),
+            ('i37en1_04', (10500, 0, 11500, 1000)),
+        ]
+        self.assertEquals(chunks.chunk_leaves(leaves, 10000), [
+            ((0, 0, 10000, 1000), ['i37en1_01', 'i37en1_02', 'i37en1_03']),
+            ((10500, 0, 11500, 1000), ['i37en1_04']),
+        ])
+
+    def test_no_leaves(self):
+        self.assertEquals(chunks.chunk_leaves([], 10000), [])
+
+
+class TestClip(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'waterlevel.tif')
+        dataset = gdal.GetDriverByName(b'GTiff').Create(
+            self.path.encode('utf8'), 10, 10, 1, gdal.GDT_Float32)
+        dataset.SetGeoTransform((0, 1, 0, 10, 0, -1))
+        band = dataset.GetRasterBand(1)
+        band.SetNoDataValue(-9999)
+        self.data = np.arange(100, dtype=np.float32).reshape(10, 10)
+        band.WriteArray(self.data)
+        dataset = None
+        self.target_path = os.path.join(self.directory, 'clipped.tif')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_clip_with_margin(self):
+        # Small windows, so it is copied in more than one strip
+        chunks.clip(
+            self.path, (3, 3, 5, 5), self.target_path, window_size=4)
+        dataset = gdal.Open(self.target_path.encode('utf8'))
+        self.assertEquals(dataset.GetGeoTransform(), (2, 1, 0, 6, 0, -1))
+        self.assertEquals(dataset.GetRasterBand(1).GetNoDataValue(), -9999)
+        self.assertTrue(np.array_equal(
+            dataset.ReadAsArray(), self.data[4:8, 2:6]))
+
+    def test_no_overlap(self):
+        self.assertIsNone(
+            chunks.clip(self.path, (20, 20, 30, 30), self.target_path))
+        self.assertFalse(os.path.exists(self.target_path))
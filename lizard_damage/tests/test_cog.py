@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import cog
+from lizard_damage import utils
+
+
+class TestWriteCog(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cog_is_tiled_and_has_overviews(self):
+        dataset = utils.to_dataset(
+            np.ma.array(np.random.random((2048, 2048))),
+            (100000.0, 0.5, 0, 500000.0, 0, -0.5), utils.projection(28992))
+        path = os.path.join(self.directory, 'test.tif')
+
+        cog.write_cog(dataset, path)
+
+        result = gdal.Open(path)
+        band = result.GetRasterBand(1)
+        self.assertEquals(band.GetBlockSize(), [cog.BLOCKSIZE, cog.BLOCKSIZE])
+        self.assertTrue(band.GetOverviewCount() >= 2)
+        self.assertEquals(
+            result.GetMetadataItem('COMPRESSION', 'IMAGE_STRUCTURE'),
+            'DEFLATE')
+
+    @override_settings(LIZARD_DAMAGE_COG_COMPRESSION='NO_SUCH_COMPRESSION')
+    def test_unknown_compression_falls_back_to_deflate(self):
+        self.assertEquals(cog.compression(), 'DEFLATE')
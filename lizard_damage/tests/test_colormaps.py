@@ -0,0 +1,40 @@
+from django.test import TestCase
+from matplotlib import colors
+import numpy as np
+
+from lizard_damage import colormaps
+
+
+class TestSegmentedLut(TestCase):
+    def test_same_colors_as_matplotlib(self):
+        for cdict in (colormaps.CDICT_HEIGHT, colormaps.CDICT_WATER_DEPTH):
+            colormap = colors.LinearSegmentedColormap(
+                'test', cdict, N=colormaps.N)
+            expected = colormap(
+                np.linspace(0, 1, colormaps.N, endpoint=False), bytes=True)
+            lut = colormaps.segmented_lut(cdict)
+            self.assertTrue((lut[:colormaps.N] == expected).all())
+
+
+class TestApplyLut(TestCase):
+    def test_ends_and_masked_cells(self):
+        lut = colormaps.HEIGHT_LUT
+        data = np.ma.masked_equal([[-5.0, 0.0, 10.0, 20.0, 3.0]], 3.0)
+
+        rgba = colormaps.apply_lut(lut, data, vmin=0, vmax=10)
+
+        self.assertEquals(rgba.shape, (1, 5, 4))
+        self.assertEquals(rgba.dtype, np.uint8)
+        self.assertEquals(tuple(rgba[0, 0]), tuple(lut[0]))
+        self.assertEquals(tuple(rgba[0, 1]), tuple(lut[0]))
+        self.assertEquals(tuple(rgba[0, 2]), tuple(lut[colormaps.N - 1]))
+        self.assertEquals(tuple(rgba[0, 3]), tuple(lut[colormaps.N - 1]))
+        self.assertEquals(tuple(rgba[0, 4]), colormaps.BAD)
+
+    def test_listed_lut_uses_values_as_index(self):
+        lut = colormaps.listed_lut(['#000000', '#ff0000', '#00ff00'])
+        rgba = colormaps.apply_listed_lut(lut, np.array([[1, 2, 7]]))
+
+        self.assertEquals(tuple(rgba[0, 0]), (255, 0, 0, 255))
+        self.assertEquals(tuple(rgba[0, 1]), (0, 255, 0, 255))
+        self.assertEquals(tuple(rgba[0, 2]), (0, 255, 0, 255))
@@ -0,0 +1,78 @@
+import datetime
+import logging
+
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+
+from lizard_damage import costs
+from lizard_damage import models
+from lizard_damage import tasks
+
+from . import factories
+
+logger = logging.getLogger(__name__)
+
+
+@override_settings(
+    LIZARD_DAMAGE_COST_SECONDS_PER_SCENARIO=60,
+    LIZARD_DAMAGE_COST_SECONDS_PER_LEAF=10,
+    LIZARD_DAMAGE_COST_CUSTOM_INPUT_FACTOR=2,
+    LIZARD_DAMAGE_LARGE_SCENARIO_SECONDS=1000,
+    LIZARD_DAMAGE_SMALL_QUEUE='small',
+    LIZARD_DAMAGE_LARGE_QUEUE='large',
+    LIZARD_DAMAGE_QUEUE_CONCURRENCY=1)
+class TestCosts(TestCase):
+    def setUp(self):
+        self.scenario = factories.DamageScenarioFactory.create(
+            calc_type=models.DamageScenario.CALC_TYPE_MAX)
+        for path in ('/wl1.asc', '/wl2.asc'):
+            event = factories.DamageEventFactory.create(
+                scenario=self.scenario)
+            factories.DamageEventWaterlevelFactory.create(
+                event=event, waterlevel_path=path)
+
+    def test_estimate_per_leaf_of_every_waterlevel(self):
+        with mock.patch('lizard_damage.costs.leaf_count', return_value=4):
+            self.assertEquals(costs.estimate(self.scenario, logger), 140)
+
+            self.scenario.customlanduse = '/landuse.tif'
+            self.assertEquals(costs.estimate(self.scenario, logger), 220)
+
+    def test_queue(self):
+        self.scenario.estimated_cost = 500
+        self.assertEquals(costs.queue(self.scenario), 'small')
+        self.scenario.estimated_cost = 5000
+        self.assertEquals(costs.queue(self.scenario), 'large')
+        self.scenario.estimated_cost = None
+        self.assertEquals(costs.queue(self.scenario), 'small')
+
+    def test_scenario_is_sent_to_its_queue(self):
+        self.scenario.estimated_cost = 5000
+        with mock.patch.object(
+                tasks.calculate_damage, 'apply_async') as apply_async:
+            tasks.damage_scenario_to_task(self.scenario)
+        self.assertEquals(apply_async.call_args[1]['queue'], 'large')
+        self.assertEquals(
+            apply_async.call_args[1]['kwargs']['damage_scenario_id'],
+            self.scenario.id)
+
+    @override_settings(LIZARD_DAMAGE_SMALL_QUEUE=None)
+    def test_default_queue_is_not_set(self):
+        self.scenario.estimated_cost = 500
+        self.assertEquals(costs.queue_options(self.scenario), {})
+
+    def test_waiting_for_scenarios_in_the_same_queue(self):
+        for estimated_cost in (100, 200, 5000):
+            factories.DamageScenarioFactory.create(
+                estimated_cost=estimated_cost)
+        scenario = factories.DamageScenarioFactory.create(estimated_cost=50)
+        self.assertEquals(costs.waiting_seconds(scenario), 300)
+
+    def test_eta_after_start(self):
+        self.scenario.estimated_cost = 3600
+        self.assertEquals(
+            costs.eta(self.scenario, datetime.datetime(2018, 6, 1, 9, 30)),
+            '01-06-2018 10:30')
+        self.scenario.estimated_cost = None
+        self.assertIsNone(costs.eta(self.scenario))
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import culling
+
+
+class TestDryLeaves(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.waterlevel = os.path.join(self.directory, 'waterlevel.tif')
+
+        # Waterlevel of 1.0 over the left half, nodata on the right
+        data = np.full((10, 20), -999, dtype=np.float32)
+        data[:, :10] = 1.0
+        dataset = gdal.GetDriverByName(b'GTiff').Create(
+            self.waterlevel.encode('utf8'), 20, 10, 1, gdal.GDT_Float32)
+        dataset.SetGeoTransform((0, 100, 0, 1000, 0, -100))
+        dataset.GetRasterBand(1).SetNoDataValue(-999)
+        dataset.GetRasterBand(1).WriteArray(data)
+        dataset = None
+
+        self.leaves = [
+            ('i37en1_01', (0, 0, 1000, 1000)),
+            ('i37en1_02', (1000, 0, 2000, 1000)),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_ahn_tile(self, ahn_name, minimum):
+        directory = os.path.join(self.directory, 'ahn', ahn_name[1:4])
+        os.makedirs(directory)
+        dataset = gdal.GetDriverByName(b'GTiff').Create(
+            os.path.join(directory, ahn_name + '.tif').encode('utf8'),
+            2, 2, 1, gdal.GDT_Float32)
+        dataset.GetRasterBand(1).SetMetadataItem(
+            b'STATISTICS_MINIMUM', str(minimum).encode('utf8'))
+        dataset = None
+
+    def test_leaf_without_waterlevel_is_dry(self):
+        self.assertEquals(
+            culling.dry_leaves([self.waterlevel], self.leaves,
+                               os.path.join(self.directory, 'ahn')),
+            {'i37en1_02': culling.NO_WATERLEVEL})
+
+    def test_leaf_with_waterlevel_below_ground_is_dry(self):
+        self.write_ahn_tile('i37en1_01', 2.5)
+        self.assertEquals(
+            culling.dry_leaves([self.waterlevel], self.leaves,
+                               os.path.join(self.directory, 'ahn')),
+            {'i37en1_01': culling.BELOW_GROUND,
+             'i37en1_02': culling.NO_WATERLEVEL})
+
+    def test_leaf_with_waterlevel_above_ground_is_kept(self):
+        self.write_ahn_tile('i37en1_01', -2.5)
+        self.assertNotIn(
+            'i37en1_01',
+            culling.dry_leaves([self.waterlevel], self.leaves,
+                               os.path.join(self.directory, 'ahn')))
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+import mock
+import numpy as np
+
+from lizard_damage import damagetables
+from lizard_damage import models
+
+
+class MockDamageRow(object):
+    def __init__(self, direct, indirect):
+        self.direct = direct
+        self.indirect = indirect
+
+    def to_direct_damage(self, calc_type):
+        return self.direct
+
+    def to_indirect_damage(self, calc_type):
+        return self.indirect
+
+    def to_gamma_depth(self, depth):
+        return depth * self.direct
+
+    def to_gamma_floodtime(self, floodtime):
+        return 1
+
+    def to_gamma_month(self, month):
+        return 0.5 if month == 1 else 1
+
+    def to_gamma_repairtime(self, repairtime):
+        return 1
+
+
+class MockDamageTable(object):
+    def __init__(self):
+        self.data = {
+            1: MockDamageRow(direct=1, indirect=0.5),
+            3: MockDamageRow(direct=2, indirect=100),
+        }
+
+
+class TestCompiledDamageTable(TestCase):
+    def setUp(self):
+        self.compiled = damagetables.CompiledDamageTable(MockDamageTable())
+        self.landuse = np.array([3, 1, 99, 3, -1])
+        self.depth = np.array([1.0, 2.0, 1.0, 0.5, 1.0])
+
+    def test_unknown_codes_have_no_damage(self):
+        self.assertEquals(
+            list(self.compiled.lut_index(self.landuse)), [3, 1, 4, 3, 4])
+
+    def test_gamma_depth_per_code(self):
+        self.assertEquals(
+            list(self.compiled.gamma_depth(self.landuse, self.depth)),
+            [2, 2, 0, 1, 0])
+
+    def test_cell_damage(self):
+        cells = self.compiled.cell_damage(
+            self.landuse, self.depth, 2, 'max', 9, 0, 0,
+            road_grid_codes={3: 2})
+        # Code 3 is a road, so without indirect damage
+        self.assertEquals(list(cells), [8, 5, 0, 4, 0])
+        self.assertEquals(
+            self.compiled.per_code(self.landuse, cells), {1: 5, 3: 12})
+
+    def test_factors_per_month(self):
+        direct, indirect = self.compiled.factors(
+            'max', 1, 0, 0, road_grid_codes={})
+        self.assertEquals(list(direct), [0, 0.5, 0, 1, 0])
+        self.assertEquals(list(indirect), [0, 0.5, 0, 100, 0])
+
+
+class TestCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dt.cfg')
+        with open(self.path, 'w') as f:
+            f.write('[1]\n')
+        damagetables.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        damagetables.clear()
+
+    def test_parsed_once(self):
+        with mock.patch(
+                'lizard_damage_calculation.table.DamageTable.read_cfg',
+                return_value=MockDamageTable()) as read_cfg:
+            compiled = damagetables.compiled(self.path)
+            self.assertIs(damagetables.compiled(self.path), compiled)
+            self.assertEquals(read_cfg.call_count, 1)
+
+    def test_changed_unit_clears_cache(self):
+        with mock.patch(
+                'lizard_damage_calculation.table.DamageTable.read_cfg',
+                return_value=MockDamageTable()) as read_cfg:
+            damagetables.compiled(self.path)
+            models.Unit.objects.create(name='euro', factor=1)
+            damagetables.compiled(self.path)
+            self.assertEquals(read_cfg.call_count, 2)
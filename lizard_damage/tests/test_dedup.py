@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase
+
+from lizard_damage import dedup
+from lizard_damage import leafindex
+from lizard_damage import models
+
+from . import factories
+
+TESTDATA_DIR = os.path.join(settings.BUILDOUT_DIR, 'testdata')
+
+
+class TestDedup(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, relative_path, content):
+        path = os.path.join(self.directory, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_content_hash_depends_on_files_and_parameters(self):
+        a = self.write('a.asc', 'a')
+        b = self.write('b.asc', 'b')
+        hash_ab = dedup.content_hash([a, b], {'floodmonth': 9})
+
+        self.assertEquals(
+            hash_ab, dedup.content_hash([a, b], {'floodmonth': 9}))
+        self.assertNotEquals(
+            hash_ab, dedup.content_hash([b, a], {'floodmonth': 9}))
+        self.assertNotEquals(
+            hash_ab, dedup.content_hash([a, b], {'floodmonth': 10}))
+        self.assertNotEquals(
+            hash_ab, dedup.content_hash([a, b, None], {'floodmonth': 9}))
+
+    def test_event_hash_depends_on_tiles_and_settings(self):
+        models.Unit.fill_units_table()
+        event = factories.DamageEventFactory.create(
+            scenario=factories.DamageScenarioFactory(
+                damagetable_file=os.path.join(TESTDATA_DIR, 'dt.cfg')))
+        models.DamageEventWaterlevel.objects.create(
+            event=event, waterlevel_path=os.path.join(
+                TESTDATA_DIR, 'wl.asc'))
+        manifest = self.write(
+            os.path.join('data_lgn', leafindex.MANIFEST_FILENAME), '{}')
+
+        with self.settings(LIZARD_DAMAGE_DATA_ROOT=self.directory):
+            content_hash = event.compute_content_hash()
+            self.assertEquals(content_hash, event.compute_content_hash())
+
+            with self.settings(LIZARD_DAMAGE_CULL_DRY_LEAVES=False):
+                self.assertNotEquals(
+                    content_hash, event.compute_content_hash())
+
+            # The LGN tiles were updated and the manifest regenerated
+            os.utime(manifest, (0, 0))
+            self.assertNotEquals(content_hash, event.compute_content_hash())
+
+    def test_link_tree(self):
+        self.write('source/result.zip', 'zip')
+        self.write('source/rasters/depth.vrt', 'vrt')
+        self.write('source/waterlevels/1/ws.asc', 'ws')
+        source = os.path.join(self.directory, 'source')
+        target = os.path.join(self.directory, 'target')
+
+        self.assertEquals(
+            dedup.link_tree(source, target, exclude=('waterlevels',)), 2)
+        self.assertTrue(
+            os.path.exists(os.path.join(target, 'rasters', 'depth.vrt')))
+        self.assertFalse(os.path.exists(os.path.join(target, 'waterlevels')))
+        self.assertEquals(
+            os.stat(os.path.join(target, 'result.zip')).st_nlink, 2)
+
+    def test_unlink_shared(self):
+        shared = self.write('source/result.zip', 'zip')
+        own = self.write('target/own.txt', 'own')
+        os.link(shared, os.path.join(self.directory, 'target', 'result.zip'))
+
+        self.assertEquals(
+            dedup.unlink_shared(os.path.join(self.directory, 'target')), 1)
+        self.assertTrue(os.path.exists(shared))
+        self.assertTrue(os.path.exists(own))
@@ -0,0 +1,105 @@
+import datetime
+import logging
+import os
+
+from django.conf import settings
+from django.test import TestCase
+import mock
+
+from lizard_damage import chunks
+from lizard_damage import distributed
+from lizard_damage import models
+
+from . import factories
+
+logger = logging.getLogger(__name__)
+
+TESTDATA_DIR = os.path.join(settings.BUILDOUT_DIR, 'testdata')
+
+
+class TestDistributed(TestCase):
+    def setUp(self):
+        models.Unit.fill_units_table()
+
+    def make_event(self):
+        scenario = factories.DamageScenarioFactory(
+            damagetable_file=os.path.join(TESTDATA_DIR, 'dt.cfg'))
+        event = factories.DamageEventFactory.create(scenario=scenario)
+        models.DamageEventWaterlevel.objects.create(
+            event=event, waterlevel_path=os.path.join(
+                TESTDATA_DIR, 'wl.asc'))
+        return event
+
+    def test_chunks_give_the_same_table(self):
+        with self.settings(
+                LIZARD_DAMAGE_DATA_ROOT=TESTDATA_DIR,
+                LIZARD_DAMAGE_REUSE_RESULTS=False):
+            event = self.make_event()
+            event.calculate(logger)
+            expected = models.DamageEvent.objects.get(
+                pk=event.pk).parsed_table
+
+            event = self.make_event()
+            event_calculation = models.EventCalculation(event, logger)
+            all_leaves, skipped_leaves = event_calculation.leaves()
+            os.makedirs(os.path.join(
+                event.workdir, distributed.PARTIALS_DIR))
+            # Every leaf in a chunk of its own
+            json_paths = [
+                distributed.calculate_chunk(
+                    event, number, extent, names, logger)
+                for number, (extent, names) in enumerate(
+                    chunks.chunk_leaves(all_leaves, 1))]
+            distributed.finish(
+                event, json_paths, all_leaves, skipped_leaves, None, logger)
+
+        event = models.DamageEvent.objects.get(pk=event.pk)
+        for row, expected_row in zip(event.parsed_table[1], expected[1]):
+            self.assertAlmostEquals(row['damage'], expected_row['damage'])
+        self.assertTrue(os.path.exists(event.result))
+        self.assertFalse(os.path.exists(
+            os.path.join(event.workdir, distributed.PARTIALS_DIR)))
+
+    def test_scenario_resumes_by_primary_key(self):
+        scenario = factories.DamageScenarioFactory(scenario_type=0)
+        events = [
+            factories.DamageEventFactory.create(
+                scenario=scenario, name='event {}'.format(number))
+            for number in range(3)]
+        calculated = []
+
+        def calculate(damage_event, logger):
+            calculated.append(damage_event.pk)
+            return True, []
+
+        with mock.patch.object(
+                models.DamageEvent, 'calculate', autospec=True,
+                side_effect=calculate), \
+                mock.patch.object(
+                    models.DamageEvent, 'distribute', return_value=False), \
+                mock.patch('lizard_damage.emails.send_damage_success_mail'):
+            # As the task that finished the first event would
+            scenario.calculate(logger, first_event=1)
+
+        self.assertEquals(
+            calculated, sorted(event.pk for event in events)[1:])
+
+    def test_chunks_go_to_the_scenario_queue(self):
+        event = self.make_event()
+        event.scenario.estimated_cost = 5000
+        event.scenario.save()
+
+        with self.settings(
+                LIZARD_DAMAGE_DATA_ROOT=TESTDATA_DIR,
+                LIZARD_DAMAGE_REUSE_RESULTS=False,
+                LIZARD_DAMAGE_LARGE_SCENARIO_SECONDS=1000,
+                LIZARD_DAMAGE_LARGE_QUEUE='large'), \
+                mock.patch('lizard_damage.distributed.chord') as chord:
+            self.assertTrue(distributed.start(
+                event, 0, 0, datetime.datetime.now(), logger))
+
+        header = list(chord.call_args[0][0])
+        callback = chord.return_value.call_args[0][0]
+        self.assertTrue(header)
+        for signature in header + [callback]:
+            self.assertEquals(signature.options['queue'], 'large')
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from lizard_damage import downloads
+
+
+class TestParseRange(TestCase):
+    def test_no_header(self):
+        self.assertEquals(downloads.parse_range(None, 100), None)
+
+    def test_closed_range(self):
+        self.assertEquals(
+            downloads.parse_range('bytes=10-19', 100), (10, 19))
+
+    def test_open_range(self):
+        self.assertEquals(downloads.parse_range('bytes=90-', 100), (90, 99))
+
+    def test_end_past_size_is_clipped(self):
+        self.assertEquals(
+            downloads.parse_range('bytes=90-200', 100), (90, 99))
+
+    def test_suffix_range(self):
+        self.assertEquals(downloads.parse_range('bytes=-10', 100), (90, 99))
+
+    def test_multiple_ranges_are_ignored(self):
+        self.assertEquals(
+            downloads.parse_range('bytes=0-1,5-6', 100), None)
+
+    def test_start_past_size(self):
+        self.assertRaises(
+            ValueError, downloads.parse_range, 'bytes=100-', 100)
+
+
+class TestFileResponse(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'result.zip')
+        with open(self.path, 'wb') as f:
+            f.write(b'0123456789')
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_whole_file(self):
+        request = self.factory.get('/')
+        response = downloads.file_response(request, self.path)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(b''.join(response.streaming_content), b'0123456789')
+        self.assertEquals(response['Content-Length'], '10')
+        self.assertEquals(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    def test_range(self):
+        request = self.factory.get('/', HTTP_RANGE='bytes=2-4')
+        response = downloads.file_response(request, self.path)
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(b''.join(response.streaming_content), b'234')
+        self.assertEquals(response['Content-Range'], 'bytes 2-4/10')
+
+    def test_unsatisfiable_range(self):
+        request = self.factory.get('/', HTTP_RANGE='bytes=20-')
+        response = downloads.file_response(request, self.path)
+        self.assertEquals(response.status_code, 416)
+
+    def test_stale_if_range_sends_whole_file(self):
+        request = self.factory.get(
+            '/', HTTP_RANGE='bytes=2-4',
+            HTTP_IF_RANGE='Wed, 21 Oct 2015 07:28:00 GMT')
+        response = downloads.file_response(request, self.path)
+        self.assertEquals(response.status_code, 200)
+
+
+class TestZipMember(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'result.zip')
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as f:
+            f.writestr('schade_totaal.csv', b'a,b\n1,2\n' * 10000)
+            f.writestr('other.txt', b'other')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_member_is_decompressed(self):
+        response = downloads.zip_member_response(
+            self.path, 'schade_totaal.csv')
+        self.assertEquals(
+            b''.join(response.streaming_content), b'a,b\n1,2\n' * 10000)
+        self.assertEquals(response['Content-Length'], '80000')
+        self.assertIn('schade_totaal.csv', response['Content-Disposition'])
+
+
+class TestParseBbox(TestCase):
+    def test_parse_bbox(self):
+        self.assertEquals(
+            downloads.parse_bbox('1,2,3,4'), (1.0, 2.0, 3.0, 4.0))
+        self.assertRaises(ValueError, downloads.parse_bbox, '3,2,1,4')
+        self.assertRaises(ValueError, downloads.parse_bbox, '1,2,3')
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.test import TestCase
+from osgeo import gdal
+import numpy as np
+
+from lizard_damage import envelope
+
+
+def asc(values, xllcorner=0):
+    """ASC grid of a single row of values, -9999 is nodata."""
+    return '\n'.join([
+        'ncols {}'.format(len(values)),
+        'nrows 1',
+        'xllcorner {}'.format(xllcorner),
+        'yllcorner 0',
+        'cellsize 1',
+        'NODATA_value -9999',
+        ' '.join(str(value) for value in values),
+    ]) + '\n'
+
+
+class TestBuild(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.directory, 'timeseries.zip')
+        self.timesteps = [
+            [-9999, -9999, -9999, -9999],
+            [1.0, -9999, -9999, -9999],
+            [1.5, 0.5, -9999, -9999],
+            [0.5, 0.7, -9999, -9999],
+        ]
+        with zipfile.ZipFile(self.zip_path, 'w') as archive:
+            for index, values in enumerate(self.timesteps):
+                archive.writestr('ws{}.asc'.format(index), asc(values))
+
+        self.paths = [
+            envelope.vsizip_path(self.zip_path, 'ws{}.asc'.format(index))
+            for index in range(len(self.timesteps))]
+        self.envelope_path = os.path.join(self.directory, 'max.tif')
+        self.inundation_path = os.path.join(self.directory, 'inundation.tif')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_maximum_of_timesteps(self):
+        envelope.build(self.paths, self.envelope_path)
+        data = gdal.Open(self.envelope_path.encode('utf8')).ReadAsArray()
+        self.assertTrue(np.allclose(
+            data[0], [1.5, 0.7, envelope.NODATA, envelope.NODATA]))
+        self.assertFalse(os.path.exists(self.inundation_path))
+
+    def test_inundation(self):
+        envelope.build(self.paths, self.envelope_path, self.inundation_path)
+        dataset = gdal.Open(self.inundation_path.encode('utf8'))
+        first = dataset.GetRasterBand(
+            envelope.FIRST_TIMESTEP_BAND).ReadAsArray()
+        wet = dataset.GetRasterBand(envelope.TIMESTEPS_WET_BAND).ReadAsArray()
+        self.assertEquals(list(first[0]), [1, 2, -1, -1])
+        self.assertEquals(list(wet[0]), [3, 2, -1, -1])
+
+    def test_missing_member(self):
+        self.assertRaises(
+            ValueError, envelope.build,
+            self.paths + [envelope.vsizip_path(self.zip_path, 'ws9.asc')],
+            self.envelope_path)
+
+    def test_growing_flood(self):
+        # The last timestep reaches two cells further east
+        with zipfile.ZipFile(self.zip_path, 'a') as archive:
+            archive.writestr('ws4.asc', asc([0.9, 0.8, 0.6, 2.0], 2))
+        envelope.build(
+            self.paths + [envelope.vsizip_path(self.zip_path, 'ws4.asc')],
+            self.envelope_path)
+
+        dataset = gdal.Open(self.envelope_path.encode('utf8'))
+        self.assertEquals(dataset.GetGeoTransform()[0], 0)
+        data = dataset.ReadAsArray()
+        self.assertTrue(np.allclose(
+            data[0], [1.5, 0.7, 0.9, 0.8, 0.6, 2.0]))
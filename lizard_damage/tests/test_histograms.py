@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+import numpy as np
+
+from lizard_damage import damagetables
+from lizard_damage import histograms
+
+
+class MockDamageRow(object):
+    def __init__(self, direct, indirect):
+        self.direct = direct
+        self.indirect = indirect
+
+    def to_direct_damage(self, calc_type):
+        return self.direct
+
+    def to_indirect_damage(self, calc_type):
+        return self.indirect
+
+    def to_gamma_depth(self, depth):
+        return np.where(depth > 0.5, 1.0, 0.5)
+
+    def to_gamma_floodtime(self, floodtime):
+        return 1
+
+    def to_gamma_month(self, month):
+        return 1
+
+    def to_gamma_repairtime(self, repairtime):
+        return 1
+
+
+class MockDamageTable(object):
+    def __init__(self):
+        self.data = {
+            1: MockDamageRow(direct=1, indirect=0.1),
+            22: MockDamageRow(direct=2, indirect=100),
+        }
+
+
+class TestLevelHistogram(TestCase):
+    def setUp(self):
+        # One row of heights 0.005 to 0.995 m
+        self.heights = np.ma.array(
+            np.arange(100, dtype=np.float32).reshape(1, 100) / 100 + 0.005)
+        self.landuse = np.ones((1, 100), dtype=np.int64)
+        self.landuse[:, 50:] = 22
+        self.mask = np.ones((1, 100), dtype=bool)
+
+        self.histogram = histograms.LevelHistogram()
+        self.histogram.add(self.landuse, self.heights, self.mask, 2)
+
+        # Road over the highest 50 cells
+        road_mask = np.zeros((1, 100), dtype=bool)
+        road_mask[:, 50:] = True
+        self.histogram.add_road(
+            7, 22, road_mask, self.heights, self.mask, 2)
+
+    def damage(self, histogram, level):
+        return histogram.damage(
+            level, damagetables.CompiledDamageTable(MockDamageTable()), 1,
+            9, 0, 0, 0, road_grid_codes={22: 2})
+
+    def test_only_masked_cells_count(self):
+        mask = np.zeros((1, 100), dtype=bool)
+        mask[:, :10] = True
+        histogram = histograms.LevelHistogram()
+        histogram.add(self.landuse, self.heights, mask, 2)
+        self.assertEquals(sum(histogram.landuse.values()), 20)
+
+    def test_area_only_counts_wet_cells(self):
+        damage, area = self.damage(self.histogram, 0.3)
+        self.assertAlmostEquals(area[1], 60)
+        self.assertAlmostEquals(area[22], 0)
+        self.assertEquals(damage[22], 0)
+
+    def test_damage_below_road_threshold(self):
+        # 40 wet road cells of 2 m2 is less than 100 m2
+        damage, area = self.damage(self.histogram, 0.9)
+        self.assertAlmostEquals(area[22], 80)
+        self.assertAlmostEquals(damage[22], 2 * 80 * 0.5)
+
+    def test_damage_of_flooded_road(self):
+        damage, area = self.damage(self.histogram, 1.5)
+        self.assertAlmostEquals(area[1], 100)
+        # Landuse 1: direct plus indirect over 100 m2, depth > 0.5
+        self.assertAlmostEquals(damage[1], 100 + 10)
+        # Landuse 22: 50 cells deeper than 0.5 m and one flooded road
+        self.assertAlmostEquals(damage[22], 2 * 100 + 100)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'histogram.npz')
+            self.histogram.save(path)
+            loaded = histograms.LevelHistogram.load(path)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEquals(loaded.road_codes, {7: 22})
+        self.assertEquals(
+            self.damage(loaded, 0.9), self.damage(self.histogram, 0.9))
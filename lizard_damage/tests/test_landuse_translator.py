@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from osgeo import gdal
+import mock
+import numpy as np
+
+from lizard_damage import landuse_translator
+
+
+class TestLanduseTranslator(TestCase):
+    def setUp(self):
+        self.translator = landuse_translator.LanduseTranslator('unused.xls')
+        self.translator.translate_dict = {10: 1, 11: 2, 15: 3}
+        self.translator._build_lut()
+
+    def test_translate_grid(self):
+        grid = np.array([[10, 11], [15, -9]], dtype=np.int16)
+        translated = self.translator.translate_grid(grid, nodatavalue=-9)
+        self.assertEquals(translated.dtype, np.uint8)
+        self.assertEquals(translated.tolist(), [[1, 2], [3, 255]])
+
+    def test_translate_grid_twice(self):
+        grid = np.array([[10, 15]])
+        first = self.translator.translate_grid(grid)
+        second = self.translator.translate_grid(grid)
+        self.assertEquals(first.tolist(), second.tolist())
+        self.assertEquals(self.translator.translate_dict, {10: 1, 11: 2, 15: 3})
+
+    def test_lut_is_read_only(self):
+        self.assertRaises(ValueError, self.translator.lut.__setitem__, 0, 5)
+
+    def test_unknown_values_raise(self):
+        for value in (12, 9, 300):
+            self.assertRaises(
+                landuse_translator.TranslatorException,
+                self.translator.translate_grid, np.array([[10, value]]))
+
+    def test_translated_windows_cover_dataset(self):
+        self.translator.WINDOW_SIZE = 30
+        dataset = gdal.GetDriverByName(b'MEM').Create(
+            b'', 10, 7, 1, gdal.GDT_Int16)
+        band = dataset.GetRasterBand(1)
+        band.SetNoDataValue(-9)
+        grid = np.array([10, 11, 15, -9] * 18)[:70].reshape(7, 10)
+        band.WriteArray(grid)
+
+        result = np.zeros((7, 10), dtype=np.uint8)
+        for xoff, yoff, translated in (
+                self.translator._translated_windows(dataset)):
+            height, width = translated.shape
+            result[yoff:yoff + height, xoff:xoff + width] = translated
+        self.assertEquals(
+            result.tolist(),
+            self.translator.translate_grid(grid, -9).tolist())
+
+    def test_translate_dataset_with_unknown_code(self):
+        dataset = gdal.GetDriverByName(b'MEM').Create(
+            b'', 2, 1, 1, gdal.GDT_Int16)
+        dataset.GetRasterBand(1).WriteArray(np.array([[10, 12]]))
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'landuse.tif')
+        try:
+            with mock.patch.object(self.translator, 'check_damage_table'):
+                self.assertRaises(
+                    landuse_translator.TranslatorException,
+                    self.translator.translate_dataset, dataset, path)
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
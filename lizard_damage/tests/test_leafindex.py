@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from lizard_damage import leafindex
+
+
+class TestLeafIndex(TestCase):
+    def setUp(self):
+        self.index = leafindex.LeafIndex({
+            'i37en1_01': (0, 0, 1000, 1250),
+            'i37en1_02': (1000, 0, 2000, 1250),
+            'i38cn2_11': (50000, 50000, 51000, 51250),
+        })
+
+    def test_intersecting(self):
+        self.assertEquals(
+            self.index.intersecting((500, 500, 1500, 600)),
+            ['i37en1_01', 'i37en1_02'])
+        self.assertEquals(
+            self.index.intersecting((50500, 50500, 50600, 50600)),
+            ['i38cn2_11'])
+
+    def test_touching_is_not_intersecting(self):
+        self.assertEquals(
+            self.index.intersecting((2000, 0, 3000, 1000)), [])
+
+    def test_missing(self):
+        self.assertEquals(
+            self.index.missing(['i37en1_02', 'i37en1_03']), ['i37en1_03'])
+
+
+class TestManifest(TestCase):
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.data_root, 'data_ahn3', '37e'))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_root)
+
+    def test_no_manifest_falls_back_to_files(self):
+        open(os.path.join(
+            self.data_root, 'data_ahn3', '37e', 'i37en1_01.tif'), 'w').close()
+        with override_settings(LIZARD_DAMAGE_DATA_ROOT=self.data_root):
+            self.assertEquals(leafindex.get_index('data_ahn3'), None)
+            self.assertEquals(
+                leafindex.missing_tiles(
+                    'data_ahn3', ['i37en1_01', 'i37en1_02']),
+                ['i37en1_02'])
+
+    def test_manifest_is_used(self):
+        with override_settings(LIZARD_DAMAGE_DATA_ROOT=self.data_root):
+            self.assertEquals(leafindex.build_manifest('data_ahn3'), 0)
+            self.assertEquals(len(leafindex.get_index('data_ahn3')), 0)
+            self.assertEquals(
+                leafindex.missing_tiles('data_ahn3', ['i37en1_01']),
+                ['i37en1_01'])
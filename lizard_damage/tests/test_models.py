@@ -1,14 +1,20 @@
+import json
 import logging
 import os
 import shutil
 import tempfile
 
 from django.conf import settings
+from django.core.files.base import ContentFile
 from django.test import TestCase
 
 from lizard_damage import models
 from lizard_damage import calc
+from lizard_damage import damagetables
+from lizard_damage import utils
 
+from PIL import Image
+import mock
 import numpy as np
 
 from . import factories
@@ -39,6 +45,24 @@ class TestDamageScenario(TestCase):
                 name="Testscenario").count(),
             1)
 
+    def test_calc_type_all_calculates_average_first(self):
+        scenario = factories.DamageScenarioFactory.create(
+            calc_type=models.DamageScenario.CALC_TYPE_ALL)
+        self.assertEquals(
+            scenario.calculator_calc_type,
+            models.DamageScenario.CALC_TYPE_AVG)
+        self.assertEquals(
+            [name for name, calc_type in scenario.extra_calc_types],
+            ['min', 'max'])
+
+    def test_other_calc_types_have_no_extras(self):
+        scenario = factories.DamageScenarioFactory.create(
+            calc_type=models.DamageScenario.CALC_TYPE_MIN)
+        self.assertEquals(
+            scenario.calculator_calc_type,
+            models.DamageScenario.CALC_TYPE_MIN)
+        self.assertEquals(scenario.extra_calc_types, ())
+
     def test_delete_deletes_files(self):
         scenario = factories.DamageScenarioFactory.create()
 
@@ -110,6 +134,133 @@ class TestDamageEvent(TestCase):
         self.assertTrue(os.path.exists(zippath))
         self.assertTrue(os.stat(zippath).st_size > 0)
 
+    def test_totals_can_be_added_after_json(self):
+        scenario = factories.DamageScenarioFactory(
+            damagetable_file=os.path.join(
+                TESTDATA_DIR, 'dt.cfg'))
+        event = factories.DamageEventFactory.create(
+            scenario=scenario, floodmonth=9)
+        event.parsed_floodmonths = [3]
+        road_code = list(models.Roads.ROAD_GRIDCODE)[0]
+
+        first = models.EventCalculation(event, logger)
+        first.overall_damage[2] = 10
+        first.overall_month_damage[3][2] = 5
+        first.roads_flooded_global[road_code][1234] = 60
+        second = models.EventCalculation(event, logger)
+        second.overall_damage[2] = 1
+        second.roads_flooded_global[road_code][1234] = 50
+
+        second.add_totals(json.loads(json.dumps(first.totals())))
+        self.assertEquals(second.overall_damage[2], 11)
+        self.assertEquals(second.overall_month_damage[3][2], 5)
+        # Together over the threshold of 100 m2 for indirect damage
+        self.assertEquals(second.roads_flooded_global[road_code][1234], 110)
+
+
+class MockDamageRow(object):
+    def __init__(self, code, direct, indirect):
+        self.code = code
+        self.source = 'test'
+        self.description = 'code {}'.format(code)
+        self.direct = direct
+        self.indirect = indirect
+
+    def to_direct_damage(self, calc_type):
+        return self.direct[calc_type]
+
+    def to_indirect_damage(self, calc_type):
+        return self.indirect[calc_type]
+
+    def to_gamma_depth(self, depth):
+        return np.minimum(depth, 1)
+
+    def to_gamma_floodtime(self, floodtime):
+        return 1
+
+    def to_gamma_month(self, month):
+        return 1
+
+    def to_gamma_repairtime(self, repairtime):
+        return 1
+
+
+class TestDamageForCalcType(TestCase):
+    def setUp(self):
+        class MockDamageTable(object):
+            data = {
+                1: MockDamageRow(1, {'min': 1, 'max': 3}, {'min': 0.5,
+                                                           'max': 1}),
+                22: MockDamageRow(22, {'min': 2, 'max': 4}, {'min': 10,
+                                                             'max': 20}),
+            }
+        self.damage_table = MockDamageTable()
+        self.landuse = np.ma.masked_array(
+            [[1, 1, 22, 22]], mask=[[False, False, False, True]])
+        self.depth = np.ma.masked_array(
+            [[0.5, 0, 2, 2]], mask=[[False, False, False, False]])
+
+    def damage(self, calc_type):
+        return calc.damage_for_calc_type(
+            self.landuse, self.depth, 0.25,
+            damagetables.CompiledDamageTable(self.damage_table), calc_type,
+            month=9, floodtime=0, repairtime_buildings=0,
+            road_grid_codes={22: 2})
+
+    def test_only_wet_cells_have_damage(self):
+        damage, result = self.damage('max')
+        self.assertEquals(
+            list(np.ma.getmaskarray(result)[0]), [False, True, False, True])
+
+    def test_damage_per_code(self):
+        damage, result = self.damage('min')
+        # Direct and indirect damage for code 1, only direct for roads
+        self.assertAlmostEquals(damage[1], 1 * 0.25 * 0.5 + 0.5 * 0.25)
+        self.assertAlmostEquals(damage[22], 2 * 0.25 * 1)
+        self.assertAlmostEquals(result.sum(), damage[1] + damage[22])
+
+    def test_damage_per_month(self):
+        class MonthDamageRow(MockDamageRow):
+            def to_gamma_month(self, month):
+                return 0.5 if month == 1 else 1
+
+        self.damage_table.data[1] = MonthDamageRow(
+            1, {'min': 1}, {'min': 0.5})
+        month_damage = calc.damage_per_month(
+            self.landuse, self.depth, 0.25,
+            damagetables.CompiledDamageTable(self.damage_table), 'min',
+            months=[1, 9], floodtime=0, repairtime_buildings=0,
+            road_grid_codes={22: 2})
+        self.assertAlmostEquals(month_damage[9][1], self.damage('min')[0][1])
+        # Only the direct damage depends on the month
+        self.assertAlmostEquals(
+            month_damage[1][1], 1 * 0.25 * 0.5 * 0.5 + 0.5 * 0.25)
+
+    def test_result_as_dict_has_extra_columns(self):
+        head, data = calc.result_as_dict(
+            damage={1: 1, 22: 2}, area={1: 10000, 22: 0},
+            damage_table=self.damage_table,
+            extra_damage={'min': {1: 0.5, 22: 1}, 'max': {1: 2, 22: 4}})
+        self.assertEquals(
+            [column['key'] for column in head][-2:],
+            ['damage_max', 'damage_min'])
+        self.assertEquals(data[0]['damage_min'], 1.5)
+        self.assertEquals(data[0]['damage_max'], 6)
+
+
+class TestDamageEventFloodmonths(TestCase):
+    def test_extra_floodmonths_leave_out_floodmonth(self):
+        event = factories.DamageEventFactory.create(floodmonth=9)
+        event.parsed_floodmonths = [12, 9, 3, 3]
+        self.assertEquals(event.parsed_floodmonths, [3, 9, 12])
+        self.assertEquals(event.extra_floodmonths, [3, 12])
+
+    def test_month_totals(self):
+        event = factories.DamageEventFactory.create()
+        event.parsed_month_tables = {
+            10: ([], [{'damage': 5}]), 9: ([], [{'damage': 7}])}
+        self.assertEquals(event.month_totals(), [(9, 7), (10, 5)])
+
 
 class TestDamageEventWaterlevel(TestCase):
     def test_setup_moves_file_correctly(self):
@@ -141,6 +292,32 @@ class TestDamageEventWaterlevel(TestCase):
             shutil.rmtree(target_dir)
 
 
+class TestDamageEventResult(TestCase):
+    def test_delete_with_files_removes_files_only(self):
+        event = factories.DamageEventFactory.create()
+        path = os.path.join(event.workdir, 'damage', 'i37en1_01.png')
+        os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+        models.DamageEventResult.objects.create(
+            result_type='damage', damage_event=event,
+            relative_path='/damage/i37en1_01.png',
+            west=0, south=0, east=1, north=1)
+        # An event whose workdir doesn't exist
+        other = factories.DamageEventFactory.create()
+        other_workdir = models.event_workdir_path(other.scenario_id, other.id)
+        models.DamageEventResult.objects.create(
+            result_type='damage', damage_event=other,
+            relative_path='/damage/i37en1_01.png',
+            west=0, south=0, east=1, north=1)
+
+        models.DamageEventResult.objects.all().delete_with_files()
+
+        self.assertFalse(models.DamageEventResult.objects.exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(other_workdir))
+        shutil.rmtree(event.scenario.workdir)
+
+
 class TestGeoImage(TestCase):
     def test_from_data_with_legend_creates_wgs84_png(self):
         landuse_legend = calc.landuse_legend()
@@ -168,3 +345,112 @@ class TestGeoImage(TestCase):
 
         # Cleanup
         os.remove(image_path)
+
+    def test_from_data_with_legend_returns_concurrently_made_geoimage(self):
+        other = models.GeoImage.objects.create(
+            slug='race_slug', north=1, south=0, east=1, west=0)
+
+        # As if the other request saved it after we looked
+        with mock.patch.object(
+                models.GeoImageQuerySet, 'first', return_value=None):
+            geo_image = models.GeoImage.from_data_with_legend(
+                'race_slug', np.zeros((4, 4)), calc.landuse_legend(),
+                extent=(100000.0, 500000.0, 120000.0, 520000.0))
+
+        self.assertEquals(geo_image.pk, other.pk)
+        # Our own image file was removed
+        self.assertFalse([
+            name for name in os.listdir(
+                os.path.join(settings.MEDIA_ROOT, 'geoimage'))
+            if name.startswith('race_slug')])
+
+    def test_from_landuse_dataset_overview_level_is_smaller(self):
+        data = np.ma.array(np.ones((40, 40)))
+        dataset = utils.to_dataset(
+            data, (100000.0, 0.5, 0, 500000.0, 0, -0.5),
+            utils.projection(28992))
+
+        full = models.GeoImage.from_landuse_dataset(
+            dataset, calc.slug_for_landuse('testing'))
+        overview = models.GeoImage.from_landuse_dataset(
+            dataset, calc.slug_for_landuse('testing', 2), overview_level=2)
+
+        self.assertEquals(overview.slug, 'landuse_testing_o2')
+        self.assertEquals(Image.open(full.image.path).size[0] // 4,
+                          Image.open(overview.image.path).size[0])
+        # The size is stored, so KMLs don't have to open the image
+        self.assertEquals(
+            (overview.width, overview.height),
+            Image.open(overview.image.path).size)
+        self.assertEquals(
+            models.GeoImage.objects.get(slug=overview.slug).size(),
+            (overview.width, overview.height))
+        # Same area
+        self.assertAlmostEquals(full.north, overview.north, places=5)
+        self.assertAlmostEquals(full.west, overview.west, places=5)
+
+        models.GeoImage.objects.all().delete_with_files()
+
+    def test_from_landuse_dataset_caps_image_size(self):
+        data = np.ma.array(np.ones((40, 40)))
+        dataset = utils.to_dataset(
+            data, (100000.0, 0.5, 0, 500000.0, 0, -0.5),
+            utils.projection(28992))
+
+        overview = models.GeoImage.from_landuse_dataset(
+            dataset, calc.slug_for_landuse('testing', 2), overview_level=2)
+        with mock.patch.object(models, 'MAX_LANDUSE_IMAGE_CELLS', 100):
+            capped = models.GeoImage.from_landuse_dataset(
+                dataset, 'customlanduse_testing')
+
+        # 10 x 10 cells, like overview level 2
+        self.assertEquals(capped.size(), overview.size())
+
+        models.GeoImage.objects.all().delete_with_files()
+
+    def test_delete_with_files_removes_rows_and_files(self):
+        paths = []
+        for slug in ('first_slug', 'second_slug'):
+            geo_image = models.GeoImage(
+                slug=slug, north=1, south=0, east=1, west=0)
+            geo_image.image.save(
+                slug + '.png', ContentFile(b'not really a png'))
+            paths.append(geo_image.image.path)
+
+        models.GeoImage.objects.filter(
+            slug__in=('first_slug', 'second_slug')).delete_with_files()
+
+        self.assertFalse(models.GeoImage.objects.filter(
+            slug__in=('first_slug', 'second_slug')).exists())
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_existing_skips_geoimages_without_file(self):
+        present = models.GeoImage(
+            slug='present_slug', north=1, south=0, east=1, west=0)
+        present.image.save('present_slug.png', ContentFile(b'png'))
+        models.GeoImage.objects.create(
+            slug='missing_slug', image='geoimage/not_there.png',
+            north=1, south=0, east=1, west=0)
+
+        existing = models.GeoImage.objects.existing(
+            ['present_slug', 'missing_slug', 'unknown_slug'])
+
+        self.assertEquals(existing.keys(), ['present_slug'])
+        self.assertEquals(
+            models.GeoImage.check_existence('present_slug'), present)
+        # check_existence doesn't delete anything anymore
+        self.assertFalse(models.GeoImage.check_existence('missing_slug'))
+        self.assertTrue(
+            models.GeoImage.objects.filter(slug='missing_slug').exists())
+
+        present.image.delete()
+
+    def test_reconcile_deletes_geoimages_without_file(self):
+        models.GeoImage.objects.create(
+            slug='missing_slug', image='geoimage/not_there.png',
+            north=1, south=0, east=1, west=0)
+
+        self.assertEquals(models.GeoImage.objects.reconcile(), 1)
+        self.assertFalse(
+            models.GeoImage.objects.filter(slug='missing_slug').exists())
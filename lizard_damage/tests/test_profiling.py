@@ -0,0 +1,44 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from lizard_damage import profiling
+
+
+class TestMemoryProfiler(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, profiling.PROFILE_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disabled_profiler_writes_nothing(self):
+        profiler = profiling.MemoryProfiler(self.path, enabled=False)
+        profiler.start()
+        profiler.checkpoint('tile')
+        profiler.stop()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_every_checkpoint_is_a_line(self):
+        profiler = profiling.MemoryProfiler(self.path, enabled=True)
+        profiler.start()
+        with profiler.stage('some stage'):
+            pass
+        profiler.stop()
+
+        with open(self.path) as report:
+            records = [json.loads(line) for line in report]
+        self.assertEquals(
+            [record['name'] for record in records],
+            ['start', 'some stage', 'stop'])
+        self.assertTrue(all(record['peak_rss'] > 0 for record in records))
+
+    def test_setting_enables_profiler(self):
+        with self.settings(LIZARD_DAMAGE_PROFILE_MEMORY=True):
+            self.assertTrue(profiling.MemoryProfiler(self.path).enabled)
+        with self.settings(LIZARD_DAMAGE_PROFILE_MEMORY=False):
+            self.assertFalse(profiling.MemoryProfiler(self.path).enabled)
@@ -0,0 +1,36 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from lizard_damage import quotas
+
+
+@override_settings(
+    LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE=200,
+    LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE_CEILING=3000,
+    LIZARD_DAMAGE_WATERLEVEL_SIZE_QUOTAS={
+        'Someone@Example.com': 5000,
+        '@waterschap.nl': 2000,
+        'unlimited@waterschap.nl': None,
+    })
+class TestQuotas(TestCase):
+    def test_default(self):
+        self.assertEquals(quotas.max_waterlevel_size('a@b.nl'), 200)
+        self.assertEquals(quotas.max_waterlevel_size(None), 200)
+
+    def test_address_before_domain(self):
+        self.assertEquals(
+            quotas.max_waterlevel_size(' someone@example.COM'), 5000)
+        self.assertEquals(
+            quotas.max_waterlevel_size('user@waterschap.nl'), 2000)
+
+    def test_ceiling(self):
+        self.assertEquals(
+            quotas.max_waterlevel_size('unlimited@waterschap.nl'), 3000)
+        # Email addresses aren't verified, no quota goes above the ceiling
+        self.assertEquals(
+            quotas.max_waterlevel_size('someone@example.com'), 3000)
+
+    def test_exceeds(self):
+        self.assertTrue(quotas.exceeds(201, 'a@b.nl'))
+        self.assertFalse(quotas.exceeds(1000, 'user@waterschap.nl'))
+        self.assertTrue(quotas.exceeds(10 ** 12, 'unlimited@waterschap.nl'))
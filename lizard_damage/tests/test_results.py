@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.test import TestCase
+import numpy as np
+
+from lizard_damage import results
+
+logger = logging.getLogger(__name__)
+
+
+class TestFixedScaleCodes(TestCase):
+    def test_roundtrip_to_the_centimeter(self):
+        heights = np.ma.masked_equal([[-5.333, 0.0, 12.345, -9999]], -9999)
+
+        codes = results.encode(heights, *results.FIXED_SCALES['height'])
+        self.assertEquals(codes.dtype, np.uint16)
+        self.assertEquals(codes[0, 3], results.NODATA_CODE)
+
+        decoded = results.decode(codes, *results.FIXED_SCALES['height'])
+        self.assertTrue(decoded.mask[0, 3])
+        for expected, value in zip([-5.33, 0.0, 12.35], decoded[0, :3]):
+            self.assertAlmostEquals(expected, value, places=5)
+
+
+class TestResultCollector(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_save_ma_tracks_min_and_max(self):
+        collector = results.ResultCollector(
+            self.workdir, [('tile1', None), ('tile2', None)], logger)
+        collector.save_ma(
+            'tile1', np.ma.masked_less([[1.0, 2.0], [-50, 3.0]], -10),
+            result_type='height')
+        collector.save_ma(
+            'tile2', np.ma.array([[-1.5, 0.5]]), result_type='height')
+
+        self.assertEquals(collector.mins['height'], -1.5)
+        self.assertEquals(collector.maxes['height'], 3.0)
+        self.assertTrue(
+            os.path.exists(collector.codes_path('height', 'tile1')))
+
+    def test_code_colors_make_depth_of_zero_transparent(self):
+        collector = results.ResultCollector(self.workdir, [], logger)
+        collector.save_ma('tile', np.ma.array([[0.0, 1.0]]), 'depth')
+        codes = np.load(collector.codes_path('depth', 'tile'))
+
+        rgba = np.take(collector.code_colors('depth'), codes, axis=0)
+        self.assertEquals(rgba[0, 0, 3], 0)
+        self.assertEquals(rgba[0, 1, 3], 255)
+
+    def test_add_state_of_other_collector(self):
+        other = results.ResultCollector(
+            self.workdir, [], logger, zip_filename='partials/chunk_0.zip')
+        other.save_ma('tile2', np.ma.array([[-1.5, 0.5]]), 'height')
+        other.save_json_for_zipfile('tile2.json', {})
+
+        collector = results.ResultCollector(
+            self.workdir, [('tile1', None), ('tile2', None)], logger)
+        collector.save_ma('tile1', np.ma.array([[1.0, 3.0]]), 'height')
+        collector.add_state(json.loads(json.dumps(other.state())))
+        collector.add_zipfile(other.zipfile)
+
+        self.assertEquals(collector.mins['height'], -1.5)
+        self.assertEquals(collector.maxes['height'], 3.0)
+        with zipfile.ZipFile(collector.zipfile) as archive:
+            self.assertEquals(archive.namelist(), ['tile2.json'])
@@ -0,0 +1,61 @@
+from django.test import TestCase
+import numpy as np
+
+from lizard_damage import risk
+
+GEOTRANSFORM = (0, 0.5, 0, 1000, 0, -0.5)
+
+
+class FakeEvent(object):
+    """Event with damage tiles in memory instead of in a result zip."""
+    def __init__(self, repetition_time, tiles):
+        self.repetition_time = repetition_time
+        self.tiles = tiles
+
+    def get_filenames(self):
+        return ['schade_{}_T{}.tiff'.format(index, self.repetition_time)
+                for index in self.tiles]
+
+    def get_data(self, filename):
+        index = filename.split('_T')[0][len('schade_'):]
+        return GEOTRANSFORM, self.tiles[index]
+
+
+class TestRiskOfCulledLeaves(TestCase):
+    def setUp(self):
+        self.damage = np.ma.array([[100., 200.], [0., 50.]],
+                                  mask=[[0, 0], [0, 1]])
+        self.zero = np.ma.array(np.zeros((2, 2)), mask=[[0, 0], [0, 1]])
+
+    def risk(self, events):
+        jobs = risk.risk_jobs(events)
+        self.assertEquals(list(jobs), ['i37en1_01'])
+        return risk.calculate_risk(
+            risk.iter_risk_and_damage(jobs['i37en1_01']))
+
+    def test_culled_leaf_counts_as_zero_damage(self):
+        # Without culling the dry leaf has a damage tile of zeros, with
+        # culling the event has no tile for it
+        not_culled = self.risk([
+            FakeEvent(100, {'i37en1_01': self.damage}),
+            FakeEvent(10, {'i37en1_01': self.zero}),
+        ])
+        culled = self.risk([
+            FakeEvent(100, {'i37en1_01': self.damage}),
+            FakeEvent(10, {}),
+        ])
+        self.assertEquals(culled['geotransform'], GEOTRANSFORM)
+        np.testing.assert_array_equal(
+            culled['risk'].filled(-1), not_culled['risk'].filled(-1))
+
+    def test_culled_most_likely_event(self):
+        not_culled = self.risk([
+            FakeEvent(100, {'i37en1_01': self.zero}),
+            FakeEvent(10, {'i37en1_01': self.damage}),
+        ])
+        culled = self.risk([
+            FakeEvent(100, {}),
+            FakeEvent(10, {'i37en1_01': self.damage}),
+        ])
+        np.testing.assert_array_equal(
+            culled['risk'].filled(-1), not_culled['risk'].filled(-1))
@@ -1,10 +1,15 @@
 import mock
 import os
+import shutil
+import tempfile
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from osgeo import gdal
 
 from lizard_damage.conf import settings
 from lizard_damage import tiles
+from lizard_damage import utils
 
 
 class TestTiles(TestCase):
@@ -22,3 +27,60 @@ class TestTiles(TestCase):
                 'est', 'testing.tif').encode('utf8')
 
             mocked.assert_called_with(expected_path)
+
+    def test_get_tile_names_lists_tifs_in_subdirectories(self):
+        data_root = tempfile.mkdtemp()
+        try:
+            for name in ('i37en1_01', 'i37en1_02', 'i38cn2_11'):
+                directory = os.path.join(data_root, 'data_lgn', name[1:4])
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                open(os.path.join(directory, name + '.tif'), 'w').close()
+
+            with override_settings(LIZARD_DAMAGE_DATA_ROOT=data_root):
+                self.assertEquals(
+                    tiles.get_tile_names('data_lgn'),
+                    ['i37en1_01', 'i37en1_02', 'i38cn2_11'])
+        finally:
+            shutil.rmtree(data_root)
+
+
+class TestWarpToTiles(TestCase):
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.target_dir = tempfile.mkdtemp()
+
+        directory = os.path.join(self.data_root, 'data_ahn3', '37e')
+        os.makedirs(directory)
+        tile = gdal.GetDriverByName(b'GTiff').Create(
+            os.path.join(directory, 'i37en1_01.tif').encode('utf8'),
+            4, 4, 1, gdal.GDT_Float32)
+        tile.SetGeoTransform((1000, 1, 0, 2000, 0, -1))
+        tile.SetProjection(utils.projection(28992))
+        tile = None
+
+        self.custom = gdal.GetDriverByName(b'MEM').Create(
+            b'', 8, 8, 1, gdal.GDT_Float32)
+        self.custom.SetGeoTransform((998, 1, 0, 2002, 0, -1))
+        self.custom.SetProjection(utils.projection(28992))
+        self.custom.GetRasterBand(1).SetNoDataValue(-999)
+        self.custom.GetRasterBand(1).Fill(7)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_root)
+        shutil.rmtree(self.target_dir)
+
+    def test_warps_existing_tiles_once(self):
+        with override_settings(LIZARD_DAMAGE_DATA_ROOT=self.data_root):
+            written = tiles.warp_to_tiles(
+                self.custom, 'data_ahn3', ['i37en1_01', 'i37en1_02'],
+                self.target_dir)
+            self.assertEquals(written, 1)
+
+            path = os.path.join(self.target_dir, '37e', 'i37en1_01.tif')
+            warped = gdal.Open(path.encode('utf8'))
+            self.assertEquals(warped.GetGeoTransform()[0], 1000)
+            self.assertTrue((warped.ReadAsArray() == 7).all())
+
+            self.assertEquals(tiles.warp_to_tiles(
+                self.custom, 'data_ahn3', ['i37en1_01'], self.target_dir), 0)
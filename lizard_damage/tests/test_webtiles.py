@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+import mock
+
+from lizard_damage import webtiles
+
+
+class TestTileBounds(TestCase):
+    def test_zoom_level_zero_is_the_world(self):
+        minx, miny, maxx, maxy = webtiles.tile_bounds(0, 0, 0)
+        self.assertAlmostEquals(minx, -webtiles.ORIGIN_SHIFT)
+        self.assertAlmostEquals(maxy, webtiles.ORIGIN_SHIFT)
+        self.assertAlmostEquals(maxx, webtiles.ORIGIN_SHIFT)
+        self.assertAlmostEquals(miny, -webtiles.ORIGIN_SHIFT)
+
+    def test_y_counts_from_the_top(self):
+        minx, miny, maxx, maxy = webtiles.tile_bounds(1, 1, 1)
+        self.assertAlmostEquals(minx, 0)
+        self.assertAlmostEquals(maxy, 0)
+
+
+class TestTileCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_then_get(self):
+        cache = webtiles.TileCache(self.directory, 1000)
+        path = cache.path(1, 'damage', 10, 5, 3)
+        self.assertEquals(cache.get(path), None)
+
+        cache.put(path, b'tile')
+        self.assertEquals(cache.get(path), b'tile')
+
+    def test_evict_removes_least_recently_used(self):
+        cache = webtiles.TileCache(self.directory, 10)
+        paths = [cache.path('damage', 1, 0, i) for i in range(3)]
+        for age, path in zip((300, 100, 200), paths):
+            cache.put(path, b'12345')
+            os.utime(path, (1000000 - age, 1000000 - age))
+
+        cache.evict()
+
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[1]))
+        self.assertTrue(os.path.exists(paths[2]))
+
+
+class TestGetTile(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_version_is_the_mtime_of_the_file_that_is_read(self):
+        event = mock.Mock(
+            id=1, workdir=self.directory,
+            cog=os.path.join(self.directory, 'schade.tif'),
+            result=os.path.join(self.directory, 'result.zip'))
+        for path, mtime in ((event.cog, 2000), (event.result, 1000)):
+            open(path, 'w').close()
+            os.utime(path, (mtime, mtime))
+        cache = webtiles.TileCache(
+            os.path.join(self.directory, 'cache'), 10 ** 6)
+
+        with mock.patch.object(webtiles, 'get_cache', return_value=cache), \
+                mock.patch.object(
+                    webtiles, 'render_tile', return_value=b'tile'):
+            webtiles.get_tile(event, 'damage', 10, 5, 3)
+
+        self.assertTrue(os.path.exists(
+            cache.path(1, 2000, 'damage', 10, 5, 3)))
@@ -9,6 +9,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import glob
 import os
 
 import gdal
@@ -25,6 +26,16 @@ def get_tile_filename(datadir, ahn_name):
         ahn_name + '.tif').encode('utf8')
 
 
+def get_tile_names(datadir):
+    """Return the sorted names of all tiles in datadir ('data_ahn' or
+    'data_lgn')."""
+    pattern = os.path.join(
+        settings.LIZARD_DAMAGE_DATA_ROOT, datadir, '*', '*.tif')
+    return sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(pattern))
+
+
 def get_tile_dataset(datadir, ahn_name):
     return gdal.Open(get_tile_filename(datadir, ahn_name))
 
@@ -84,3 +95,36 @@ def get_datasets_for_tile(
         ds_ahn = utils.reproject(alternative_heights_dataset, ds_ahn)
 
     return ds_ahn, ds_lgn, orig_ds_lgn
+
+
+def warp_to_tiles(dataset, datadir, ahn_names, target_dir, logger=None):
+    """Warp dataset onto the grid of the tiles ahn_names in datadir,
+    and save the results in target_dir, in the same layout as datadir
+    (so that target_dir can be used instead of it). Tiles that are
+    missing in datadir or already exist in target_dir are skipped.
+    Returns the number of tiles written."""
+    written = 0
+    for ahn_name in sorted(ahn_names):
+        path = os.path.join(target_dir, ahn_name[1:4], ahn_name + '.tif')
+        if os.path.exists(path):
+            continue
+
+        ds_match = get_tile_dataset(datadir, ahn_name)
+        if ds_match is None:
+            if logger:
+                logger.warning('No {} tile for {}'.format(datadir, ahn_name))
+            continue
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        ds_warped = utils.reproject(dataset, ds_match)
+
+        # Write under another name first, a half written tile must not
+        # be mistaken for a finished one
+        tmp_path = path + '.tmp'
+        gdal.GetDriverByName(b'GTiff').CreateCopy(
+            tmp_path.encode('utf8'), ds_warped,
+            options=[b'TILED=YES', b'COMPRESS=DEFLATE'])
+        os.rename(tmp_path, path)
+        written += 1
+    return written
@@ -71,6 +71,31 @@ urlpatterns = patterns(
         views.Disclaimer.as_view(
             template_name="lizard_damage/disclaimer.html"),
         name='lizard_damage_disclaimer'),
+    url(
+        r'^download/event/(?P<slug>[^/]+)/$',
+        views.DamageEventResultDownload.as_view(),
+        name='lizard_damage_event_download'
+    ),
+    url(
+        r'^download/event/(?P<slug>[^/]+)/files/$',
+        views.DamageEventResultFiles.as_view(),
+        name='lizard_damage_event_files'
+    ),
+    url(
+        r'^download/event/(?P<slug>[^/]+)/files/(?P<filename>.+)$',
+        views.DamageEventResultFile.as_view(),
+        name='lizard_damage_event_file'
+    ),
+    url(
+        r'^download/risk/(?P<slug>[^/]+)/(?P<pk>\d+)/$',
+        views.RiskResultDownload.as_view(),
+        name='lizard_damage_risk_download'
+    ),
+    url(
+        r'^download/benefit/(?P<slug>[^/]+)/$',
+        views.BenefitResultDownload.as_view(),
+        name='lizard_damage_benefit_download'
+    ),
     url(
         r'^result/(?P<slug>.*)/$',
         views.DamageScenarioResult.as_view(),
@@ -91,6 +116,12 @@ urlpatterns = patterns(
         views.BenefitScenarioKML.as_view(),
         name='lizard_damage_benefit_kml'
     ),
+    url(
+        r'^event/(?P<slug>[^/]+)/(?P<result_type>[a-z]+)/tiles/' +
+        r'(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$',
+        views.DamageEventTile.as_view(),
+        name='lizard_damage_event_tile'
+    ),
     url(
         r'^event/(?P<slug>.*)/(?P<result_type>.*)/kml/$',
         views.DamageEventKML.as_view(),
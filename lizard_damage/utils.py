@@ -14,6 +14,8 @@ import numpy as np
 import logging
 import re
 
+from lizard_damage import blocks
+
 logger = logging.getLogger(__name__)
 
 
@@ -178,18 +180,21 @@ def ds2ma(ds, bandnumber=1):
 
 def reproject(ds_source, ds_match):
     """
-    Accepts and returns gdal datasets. Creates a copy of ds_match.
-    """
-    ds_dest = gdal.GetDriverByName(b'MEM').CreateCopy(b'', ds_match)
+    Accepts and returns gdal datasets. Returns a dataset with the grid
+    of ds_match.
 
-    # Fill dest with NoData so that cells where no data is projected
-    # to are handled correctly
+    If ds_source has a nodatavalue, the result is filled with that
+    where no data is projected to. Otherwise those cells keep the data
+    of ds_match, and that has to be copied.
+    """
     source_nodatavalue = ds_source.GetRasterBand(1).GetNoDataValue()
 
     if source_nodatavalue is not None:
-        ds_dest.GetRasterBand(1).SetNoDataValue(source_nodatavalue)
-        ds_dest.GetRasterBand(1).Fill(
-            ds_dest.GetRasterBand(1).GetNoDataValue())
+        # The data of ds_match would be overwritten anyway
+        ds_dest = blocks.empty_like(
+            ds_match, nodatavalue=source_nodatavalue)
+    else:
+        ds_dest = gdal.GetDriverByName(b'MEM').CreateCopy(b'', ds_match)
 
     gdal.ReprojectImage(
         ds_source,
@@ -2,7 +2,10 @@
 from __future__ import unicode_literals
 
 from django.core.urlresolvers import reverse
+from django.db.models import Q
+from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.views.generic import TemplateView
 from django.views.generic import View
 from django.shortcuts import get_object_or_404
@@ -11,18 +14,25 @@ from django.contrib.sites.models import Site
 
 from osgeo import gdal
 
+from lizard_damage import downloads
+from lizard_damage import envelope
+from lizard_damage import quotas
 from lizard_damage import tasks
+from lizard_damage import webtiles
 from lizard_damage.raster import get_area_with_data
 from lizard_damage.conf import settings
+from lizard_damage.forms import FormStep1
 from lizard_damage.models import BenefitScenario
 from lizard_damage.models import DamageScenario
 from lizard_damage.models import DamageEvent
 from lizard_damage.models import GeoImage
+from lizard_damage.models import RiskResult
 from lizard_ui.views import ViewContextMixin
 from lizard_damage import tools
 
 from zipfile import ZipFile
 import csv
+import json
 import shutil
 import os
 import re
@@ -35,6 +45,9 @@ import logging
 from django.http import HttpResponseRedirect
 from django.contrib.formtools.wizard.views import SessionWizardView
 
+# Slugs of landuse overview levels, see calc.slug_for_landuse
+LANDUSE_OVERVIEW_SLUG = re.compile(r'^(.*)_o(\d+)$')
+
 # Do not generate directoryname, because for each worker the directory
 # will be different and that loads to errors.
 temp_storage_location = '/tmp/django_uploads'
@@ -46,9 +59,10 @@ logger = logging.getLogger(__name__)
 
 
 class AreaError(Exception):
-    def __init__(self, name, area):
+    def __init__(self, name, area, max_area):
         self.name = name
         self.area = area
+        self.max_area = max_area
 
 
 def show_form_condition(condition):
@@ -91,6 +105,7 @@ def damage_scenario_from_type_0(all_form_data):
             repairtime_roads_days=all_form_data['repairtime_roads'],
             repairtime_buildings_days=all_form_data['repairtime_buildings'],
             floodmonth=all_form_data['floodmonth'],
+            floodmonths=all_form_data.get('floodmonths'),
             repetition_time=all_form_data.get('repetition_time'),
             waterlevels=[dict(
                 waterlevel=all_form_data['waterlevel'],
@@ -98,13 +113,18 @@ def damage_scenario_from_type_0(all_form_data):
 
 
 def damage_scenario_from_uniform_levels_batch_type(all_form_data):
+    """The total damage of all levels is calculated from histograms of
+    the area (see histograms.py). Only the levels that the user wants
+    to see maps of become damage events."""
     events = []
     tempdir = tempfile.mkdtemp()
     base_waterlevel_file = all_form_data['waterlevel_file']
     increment = all_form_data['increment']
     start_level = all_form_data['start_level']
-    for index in range(all_form_data['number_of_increments']):
-        desired_level = start_level + index * increment
+    levels = [start_level + index * increment
+              for index in range(all_form_data['number_of_increments'])]
+    rendered_levels = all_form_data.get('rendered_levels') or levels[-1:]
+    for index, desired_level in enumerate(rendered_levels):
         level_filename = os.path.join(tempdir, 'waterlevel_%s.tif' % desired_level)
         # ^^^ 'waterlevel_' should be retained as prefix, this is needed for
         # re-assembling the output afterwards.
@@ -133,7 +153,17 @@ def damage_scenario_from_uniform_levels_batch_type(all_form_data):
         customheights=all_form_data.get('customheights_file'),
         customlanduse=all_form_data.get('customlanduse_file'),
         damagetable=all_form_data.get('damagetable'),
-        damage_events=events)
+        damage_events=events,
+        uniform_levels=dict(
+            levels=levels,
+            floodmonth=int(all_form_data['floodmonth']),
+            # In seconds, like DamageEvent
+            floodtime=float(all_form_data['floodtime']) * 3600,
+            repairtime_roads=(
+                float(all_form_data['repairtime_roads']) * 3600 * 24),
+            repairtime_buildings=(
+                float(all_form_data['repairtime_buildings']) * 3600 * 24)),
+        uniform_levels_region=base_waterlevel_file)
 
 
 class BatchConfig(object):
@@ -176,7 +206,7 @@ def unpack_zipfile_into_scenario(zipfile, scenario_name='', scenario_email=''):
             'damage_events': []
         }
         scenario_data['calc_type'] = {
-            'min': 1, 'max': 2, 'avg': 3,
+            'min': 1, 'max': 2, 'avg': 3, 'all': 4,
         }.get(config.scenario_calc_type.lower(), 2)
 
         if config.scenario_damage_table:
@@ -193,6 +223,11 @@ def unpack_zipfile_into_scenario(zipfile, scenario_name='', scenario_email=''):
                 'repairtime_roads_days': event['repairtime_roads'],
                 'repairtime_buildings_days': event['repairtime_buildings'],
                 'floodmonth': event['floodmonth'],
+                # Optional, like "3;6;9"
+                'floodmonths': [
+                    int(month) for month in
+                    (event.get('floodmonths') or '').split(';')
+                    if month.strip()],
                 'waterlevels': [],
                 'repetition_time': event.get('repetition_time', None) or None
             }
@@ -207,33 +242,58 @@ def unpack_zipfile_into_scenario(zipfile, scenario_name='', scenario_email=''):
 
                 re_pattern = re.compile(
                     '%s[0-9]+%s' % (re_match[0], re_match[2]))
+                re_pattern_number = re.compile(
+                    '%s([0-9]+)%s' % (re_match[0], re_match[2]))
                 water_level_filenames = [
                     fn for fn in zip_file_names
                     if re.match(re_pattern, fn)]
-                water_level_filenames.sort()
+                # By timestep number, ws10 comes after ws9
+                water_level_filenames.sort(key=lambda fn: int(
+                    re.match(re_pattern_number, fn).group(1)))
             else:
                 water_level_filenames = [event['waterlevel']]
 
+            if len(water_level_filenames) > 1:
+                # Time series: only their maximum is needed, read it
+                # from the zip one timestep at a time
+                number = len(scenario_data['damage_events'])
+                tempfilename = os.path.join(
+                    zip_temp, 'max_waterlevel_{}.tif'.format(number))
+                inundation = os.path.join(
+                    zip_temp, 'inundation_{}.tif'.format(number))
+                envelope.build(
+                    [envelope.vsizip_path(zipfile.file.name, filename)
+                     for filename in water_level_filenames],
+                    tempfilename, inundation, logger=logger)
+                water_level_filenames = [tempfilename]
+            else:
+                inundation = None
+
             for index, water_level_filename in enumerate(
                     water_level_filenames):
-                myzip.extract(water_level_filename, zip_temp)
-                tempfilename = os.path.join(
-                    zip_temp, water_level_filename)
+                if inundation is None:
+                    # Not a time series, so not read into an envelope
+                    myzip.extract(water_level_filename, zip_temp)
+                    tempfilename = os.path.join(
+                        zip_temp, water_level_filename)
 
                 # check area
                 area = get_area_with_data(gdal.Open(tempfilename))
-                max_area = settings.LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE
-                if area > max_area:
+                if quotas.exceeds(area, scenario_email):
                     # cleanup and raise
                     shutil.rmtree(zip_temp)
                     raise AreaError(
                         name=water_level_filename,
                         area='{:.0f}'.format(area / 1000000.),
+                        max_area='{:.0f}'.format(
+                            quotas.max_waterlevel_size(scenario_email) /
+                            1000000.),
                     )
 
                 damage_event['waterlevels'].append({
                     'waterlevel': tempfilename,
-                    'index': index
+                    'index': index,
+                    'inundation': inundation,
                 })
         damage_scenario = DamageScenario.setup(**scenario_data)
 
@@ -265,9 +325,10 @@ def damage_scenario_from_zip_type(all_form_data):
     return damage_scenario
 
 
-def analyze_zip_file(zipfile):
+def analyze_zip_file(zipfile, email=None):
     """
-    Analyze zip file: generate kind of logging
+    Analyze zip file: generate kind of logging. Waterlevel areas are
+    checked against the quota of email.
 
     This function is kinda dirty, because parts are copied from
     unpack_zipfile_into_scenario.
@@ -294,8 +355,8 @@ def analyze_zip_file(zipfile):
 
     # scenario calc type
     calc_type = config.scenario_calc_type
-    if calc_type not in ('min', 'max', 'avg'):
-        message = 'Onbekend berekeningstype ({}); kies min, max of avg.'
+    if calc_type not in ('min', 'max', 'avg', 'all'):
+        message = 'Onbekend berekeningstype ({}); kies min, max, avg of all.'
         result.append(message.format(calc_type))
 
     # scenario damage table
@@ -315,8 +376,8 @@ def analyze_zip_file(zipfile):
         vsipath = '/vsizip/' + os.path.join(zipfile.file.name, waterlevel)
         dataset = gdal.Open(vsipath)
         area = get_area_with_data(dataset)
-        max_area = settings.LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE
-        if area > max_area:
+        if quotas.exceeds(area, email):
+            max_area = quotas.max_waterlevel_size(email)
             template = ('Oppervlakte van waterstand "{}"'
                         ' ({:.0f} km2) is groter dan {:.0f} km2.')
             message = template.format(
@@ -326,6 +387,18 @@ def analyze_zip_file(zipfile):
             )
             result.append(message)
 
+    # optional extra months, like "3;6;9"
+    for event in config.events:
+        floodmonths = event.get('floodmonths') or ''
+        try:
+            months = [int(month) for month in floodmonths.split(';')
+                      if month.strip()]
+        except ValueError:
+            months = [0]
+        if not all(1 <= month <= 12 for month in months):
+            message = 'Ongeldige maanden "{}"; gebruik bijvoorbeeld 3;6;9.'
+            result.append(message.format(floodmonths))
+
     # repetition times
     rtimes = [event['repetition_time'] for event in config.events]
     if scenario in (1, 4) and not all(rtimes):
@@ -373,7 +446,9 @@ class Wizard(ViewContextMixin, SessionWizardView):
             try:
                 zipfile = form_datas['zipfile']
                 logger.info('zipfile.file.name %s' % zipfile.file.name)
-                return {'zip_content': analyze_zip_file(zipfile)}
+                email = (self.get_cleaned_data_for_step('0') or {}).get(
+                    'email')
+                return {'zip_content': analyze_zip_file(zipfile, email)}
             except:
                 return {'zip_content': 'analyse gefaald, zipfile is niet goed'}
         # For batenkaart
@@ -390,6 +465,14 @@ class Wizard(ViewContextMixin, SessionWizardView):
                     }
         return super(Wizard, self).get_form_initial(step)
 
+    def get_form_kwargs(self, step=None):
+        kwargs = super(Wizard, self).get_form_kwargs(step)
+        if issubclass(self.form_list[step], FormStep1):
+            # For the waterlevel area quota
+            kwargs['email'] = (
+                self.get_cleaned_data_for_step('0') or {}).get('email')
+        return kwargs
+
     def version(self):
         return tools.version()
 
@@ -433,8 +516,9 @@ class Wizard(ViewContextMixin, SessionWizardView):
                 damage_scenario = damage_scenario_from_zip_type(all_form_data)
             except AreaError as area_error:
                 url = reverse('lizard_damage_max_area_exceeded')
-                query = '?name={name}&area={area}'.format(
+                query = '?name={name}&area={area}&max_area={max_area}'.format(
                         name=area_error.name, area=area_error.area,
+                        max_area=area_error.max_area,
                 )
                 return HttpResponseRedirect(url + query)
             finally:
@@ -537,6 +621,85 @@ class DamageEventKML(ViewContextMixin, TemplateView):
             context, mimetype='application/vnd.google-earth.kml+xml')
 
 
+class DamageEventTile(View):
+    """Web map tile (XYZ, EPSG:3857) of a damage event's results."""
+    def get(self, request, slug, result_type, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        if (result_type not in webtiles.RESULT_TYPES or
+                z > webtiles.MAX_ZOOM or x >= 2 ** z or y >= 2 ** z):
+            raise Http404
+
+        damage_event = get_object_or_404(DamageEvent, slug=slug)
+        data = webtiles.get_tile(damage_event, result_type, z, x, y)
+        if data is None:
+            raise Http404
+        return HttpResponse(data, content_type='image/png')
+
+
+class DamageEventResultDownload(View):
+    def get(self, request, slug):
+        damage_event = get_object_or_404(DamageEvent, slug=slug)
+        if not os.path.exists(damage_event.result):
+            raise Http404
+        return downloads.file_response(
+            request, damage_event.result,
+            filename='schade_{}.zip'.format(damage_event.slug))
+
+
+class DamageEventResultFiles(View):
+    """JSON list of the files in a damage event's result zip."""
+    def get(self, request, slug):
+        damage_event = get_object_or_404(DamageEvent, slug=slug)
+        if not os.path.exists(damage_event.result):
+            raise Http404
+        files = [
+            {'name': filename,
+             'url': reverse('lizard_damage_event_file', kwargs={
+                 'slug': slug, 'filename': filename})}
+            for filename in damage_event.get_filenames()]
+        return HttpResponse(
+            json.dumps({'files': files}), content_type='application/json')
+
+
+class DamageEventResultFile(View):
+    """A single file from a damage event's result zip. If a bbox
+    (minx,miny,maxx,maxy in RD) is given and the file is a raster, only
+    the part of it inside the bbox is sent, as a GeoTIFF."""
+    def get(self, request, slug, filename):
+        damage_event = get_object_or_404(DamageEvent, slug=slug)
+        if (not os.path.exists(damage_event.result) or
+                filename not in damage_event.get_filenames()):
+            raise Http404
+
+        if 'bbox' not in request.GET:
+            return downloads.zip_member_response(
+                damage_event.result, filename)
+        try:
+            return downloads.raster_window_response(
+                damage_event.result, filename,
+                downloads.parse_bbox(request.GET['bbox']))
+        except ValueError as e:
+            return HttpResponseBadRequest(unicode(e))
+
+
+class RiskResultDownload(View):
+    def get(self, request, slug, pk):
+        riskresult = get_object_or_404(
+            RiskResult, pk=pk, scenario__slug=slug)
+        if not riskresult.zip_risk:
+            raise Http404
+        return downloads.file_response(request, riskresult.zip_risk.path)
+
+
+class BenefitResultDownload(View):
+    def get(self, request, slug):
+        benefit_scenario = get_object_or_404(BenefitScenario, slug=slug)
+        if not benefit_scenario.zip_result:
+            raise Http404
+        return downloads.file_response(
+            request, benefit_scenario.zip_result.path)
+
+
 class GeoImageKML(DamageEventKML):
     @property
     def scenario(self):
@@ -571,6 +734,57 @@ class GeoImageLandUseKML(GeoImageKML):
     def legend_url(self):
         return self.root_url + '/static_media/lizard_damage/legend_landuse.png'
 
+    @property
+    def events(self):
+        """Also return the lower resolution overview levels of the
+        landuse images, if they were made (see the
+        damage_prerender_landuse command). Each level gets a KML
+        level-of-detail range in which it is shown, so that zoomed out
+        views don't load the full resolution images."""
+        slugs = self.kwargs['slugs'].split(',')
+        query = Q(slug__in=slugs)
+        for slug in slugs:
+            query |= Q(slug__startswith=slug + '_o')
+
+        levels = {}
+        for geoimage in GeoImage.objects.filter(query):
+            match = LANDUSE_OVERVIEW_SLUG.match(geoimage.slug)
+            if match and match.group(1) in slugs:
+                base_slug, level = match.group(1), int(match.group(2))
+            elif geoimage.slug in slugs:
+                base_slug, level = geoimage.slug, 0
+            else:
+                continue
+            levels.setdefault(base_slug, []).append((level, geoimage))
+
+        events = []
+        for base_slug in sorted(levels):
+            if len(levels[base_slug]) == 1:
+                # No overviews, no need for levels of detail
+                events.append(levels[base_slug][0][1])
+                continue
+
+            # An image is shown while its region takes between half and
+            # all of the image's width in screen pixels; the finest
+            # level from there on, the coarsest one below that.
+            max_lod_pixels = -1
+            for level, geoimage in sorted(levels[base_slug]):
+                width = geoimage.size()[0]
+                events.append({
+                    'name': geoimage.name,
+                    'url': geoimage.url(),
+                    'north': geoimage.north,
+                    'south': geoimage.south,
+                    'east': geoimage.east,
+                    'west': geoimage.west,
+                    'rotation': 0,
+                    'min_lod_pixels': width // 2,
+                    'max_lod_pixels': max_lod_pixels,
+                })
+                max_lod_pixels = width // 2
+            events[-1]['min_lod_pixels'] = 0
+        return events
+
 
 class GeoImageHeightKML(GeoImageKML):
     @property
@@ -688,7 +902,9 @@ class MaxAreaExceeded(ViewContextMixin, TemplateView):
     template_name = 'lizard_damage/max_area_exceeded.html'
 
     def get_context_data(self):
-        max_area = settings.LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE / 1000000
+        max_area = self.request.GET.get(
+            'max_area',
+            settings.LIZARD_DAMAGE_MAX_WATERLEVEL_SIZE / 1000000)
         context = {
             'name': self.request.GET.get('name'),
             'area': self.request.GET.get('area'),
@@ -0,0 +1,294 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
+# -*- coding: utf-8 -*-
+
+"""Rendering web map tiles (XYZ, in EPSG:3857) of damage event results.
+
+The sources are the rasters a calculation leaves behind: the damage
+COG if there is one, otherwise the damage GeoTIFFs in the result
+zipfile (through their VRT), and the landuse, height and depth GeoTIFFs
+that ResultCollector keeps if LIZARD_DAMAGE_SAVE_TILE_LAYERS is set. For a
+tile, only the window of the source that the tile covers is read, at
+roughly the tile's resolution, so that GDAL can use the overviews of
+the source. That window is then warped to the tile.
+
+Rendered tiles are kept in an on disk cache. When it grows beyond
+LIZARD_DAMAGE_TILE_CACHE_SIZE bytes, the least recently used tiles are
+removed."""
+
+# Python 3 is coming
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+import logging
+import math
+import os
+
+from PIL import Image
+from osgeo import gdal
+from osgeo import osr
+import numpy as np
+
+from lizard_damage import colormaps
+from lizard_damage import results
+from lizard_damage.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+MAX_ZOOM = 22
+RESULT_TYPES = ('damage', 'landuse', 'height', 'depth')
+
+# Half the circumference of the earth in EPSG:3857
+ORIGIN_SHIFT = math.pi * 6378137
+
+# Check the size of the cache after this many new tiles
+EVICT_EVERY = 100
+
+MERCATOR_WKT = osr.GetUserInputAsWKT(str('epsg:3857'))
+
+
+def tile_bounds(z, x, y):
+    """Return (minx, miny, maxx, maxy) of a tile in EPSG:3857."""
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def _to_rd(bounds):
+    """Return the bounding box in RD of bounds in EPSG:3857."""
+    transform = osr.CoordinateTransformation(
+        osr.SpatialReference(MERCATOR_WKT),
+        osr.SpatialReference(results.RD_WKT))
+    minx, miny, maxx, maxy = bounds
+    midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+    points = [transform.TransformPoint(px, py)[:2] for px, py in (
+        (minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy),
+        (midx, miny), (midx, maxy), (minx, midy), (maxx, midy))]
+    xs, ys = zip(*points)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def source_path(damage_event, result_type):
+    """Return bytestring path of the GDAL dataset to render tiles from,
+    or None if it doesn't exist (yet)."""
+    if result_type == 'damage':
+        if os.path.exists(damage_event.cog):
+            path = damage_event.cog
+        elif os.path.exists(damage_event.result):
+            path = '/vsizip/{}/schade.vrt'.format(damage_event.result)
+        else:
+            return None
+    else:
+        path = results.vrt_path(damage_event.workdir, result_type)
+        if not os.path.exists(path):
+            return None
+    return path.encode('utf8')
+
+
+def _colorize_landuse(masked_array):
+    from lizard_damage import calc
+    return colormaps.apply_listed_lut(
+        colormaps.listed_lut(calc.landuse_legend()), masked_array)
+
+
+def _colorize_damage(masked_array):
+    from lizard_damage import calc
+    return calc.colorize_damage(masked_array)
+
+
+# Height and depth rasters are already coloured
+COLORIZERS = {
+    'damage': _colorize_damage,
+    'landuse': _colorize_landuse,
+}
+
+
+def _read_window(dataset, rd_bounds, rd_pixel_size):
+    """Read the part of the dataset inside rd_bounds, at about
+    rd_pixel_size. Returns a list of masked arrays (one per band) and
+    their geotransform, or (None, None) if the dataset doesn't overlap."""
+    x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+    minx, miny, maxx, maxy = rd_bounds
+
+    col0 = max(int(math.floor((minx - x0) / dx)), 0)
+    col1 = min(int(math.ceil((maxx - x0) / dx)), dataset.RasterXSize)
+    row0 = max(int(math.floor((maxy - y0) / dy)), 0)
+    row1 = min(int(math.ceil((miny - y0) / dy)), dataset.RasterYSize)
+    if col1 <= col0 or row1 <= row0:
+        return None, None
+
+    width, height = col1 - col0, row1 - row0
+    buf_width = max(min(width, int(math.ceil(width * dx / rd_pixel_size))), 1)
+    buf_height = max(
+        min(height, int(math.ceil(height * -dy / rd_pixel_size))), 1)
+
+    bands = []
+    for index in range(1, dataset.RasterCount + 1):
+        band = dataset.GetRasterBand(index)
+        data = band.ReadAsArray(
+            col0, row0, width, height, buf_width, buf_height)
+        nodata = band.GetNoDataValue()
+        if nodata is None:
+            bands.append(np.ma.array(data))
+        else:
+            bands.append(np.ma.masked_equal(data, nodata))
+
+    geotransform = (
+        x0 + col0 * dx, width * dx / buf_width, 0,
+        y0 + row0 * dy, 0, height * dy / buf_height)
+    return bands, geotransform
+
+
+def _to_png(rgba):
+    png = io.BytesIO()
+    Image.fromarray(rgba).save(png, 'PNG')
+    return png.getvalue()
+
+
+def render_tile(path, result_type, z, x, y):
+    """Return the PNG data of a tile of the dataset at path."""
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+
+    dataset = gdal.Open(path)
+    if dataset is None:
+        return _to_png(rgba)
+
+    bounds = tile_bounds(z, x, y)
+    rd_bounds = _to_rd(bounds)
+    bands, geotransform = _read_window(
+        dataset, rd_bounds, (rd_bounds[2] - rd_bounds[0]) / TILE_SIZE)
+    if bands is None:
+        return _to_png(rgba)
+
+    if result_type in COLORIZERS:
+        source_rgba = COLORIZERS[result_type](bands[0])
+    else:
+        source_rgba = np.dstack([band.filled(0) for band in bands])
+
+    driver = gdal.GetDriverByName(b'MEM')
+    source = driver.Create(
+        b'', source_rgba.shape[1], source_rgba.shape[0], 4, gdal.GDT_Byte)
+    source.SetGeoTransform(geotransform)
+    source.SetProjection(results.RD_WKT)
+    for index in range(4):
+        source.GetRasterBand(index + 1).WriteArray(source_rgba[:, :, index])
+
+    tile = driver.Create(b'', TILE_SIZE, TILE_SIZE, 4, gdal.GDT_Byte)
+    tile.SetGeoTransform((
+        bounds[0], (bounds[2] - bounds[0]) / TILE_SIZE, 0,
+        bounds[3], 0, (bounds[1] - bounds[3]) / TILE_SIZE))
+    tile.SetProjection(MERCATOR_WKT)
+    gdal.ReprojectImage(
+        source, tile, None, None, gdal.GRA_NearestNeighbour)
+
+    for index in range(4):
+        rgba[:, :, index] = tile.GetRasterBand(index + 1).ReadAsArray()
+    return _to_png(rgba)
+
+
+class TileCache(object):
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.new_tiles = 0
+
+    def path(self, *parts):
+        return os.path.join(
+            self.directory, *[unicode(part) for part in parts]) + '.png'
+
+    def get(self, path):
+        """Return the cached tile, or None. A cache hit updates the
+        tile's mtime, which is what eviction goes by."""
+        try:
+            with open(path, 'rb') as tile:
+                data = tile.read()
+        except IOError:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass  # Evicted in the meantime
+        return data
+
+    def put(self, path, data):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass  # Made by another process in the meantime
+
+        # Write under another name first, so that concurrent requests
+        # never read half a tile
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as tile:
+            tile.write(data)
+        os.rename(tmp_path, path)
+
+        self.new_tiles += 1
+        if self.new_tiles % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used tiles until the cache is
+        within its maximum size."""
+        tiles = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                tiles.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        tiles.sort()
+        for mtime, size, path in tiles:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TileCache(
+            settings.LIZARD_DAMAGE_TILE_CACHE_DIR,
+            settings.LIZARD_DAMAGE_TILE_CACHE_SIZE)
+    return _cache
+
+
+def get_tile(damage_event, result_type, z, x, y):
+    """Return PNG data of a tile of the damage event's results, from
+    the cache if possible. Returns None if there is nothing to render
+    tiles from."""
+    path = source_path(damage_event, result_type)
+    if path is None:
+        return None
+
+    # A recalculated event gets new tiles, the old ones are evicted.
+    # A /vsizip/ path goes by the zipfile it is in.
+    version = int(os.path.getmtime(
+        damage_event.result if path.startswith(b'/vsizip/') else path))
+
+    cache = get_cache()
+    cache_path = cache.path(
+        damage_event.id, version, result_type, z, x, y)
+    data = cache.get(cache_path)
+    if data is None:
+        data = render_tile(path, result_type, z, x, y)
+        cache.put(cache_path, data)
+    return data